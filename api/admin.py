@@ -3,9 +3,12 @@ from django.contrib import admin
 # Register your models here.
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import Quiz, SheetImage
+from .models import Quiz, SheetImage, CorrectionJob, CorrectionResult, StageHistogram
 
 # admin.site.register(UserAdmin)
 admin.site.register(Quiz)
 admin.site.register(SheetImage)
+admin.site.register(CorrectionJob)
 
+admin.site.register(CorrectionResult)
+admin.site.register(StageHistogram)
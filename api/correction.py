@@ -0,0 +1,240 @@
+from rest_framework import exceptions
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q, F
+from django.utils.timezone import now
+from .models import Quiz, SheetImage, CorrectionJob, CorrectionResult, StageHistogram
+from .sheets_correction import engine
+from .sheets_correction.tracing import add_to_buckets
+import os
+import shutil
+
+
+# this function moves a sheet image which has been corrected from the pending directory to the corrected directory.
+# The new status and path are only set on the instance, they are saved for the whole batch by save_corrected_images
+def move_corrected_image(image: SheetImage):
+    try:
+        filename = image.image.name.split('/')[-1]
+        im_path = image.image.path
+        new_name = '/'.join(['images', 'sheets', 'sheet_{}'.format(image.sheet_id), 'corrected', filename])
+        new_path = image.image.storage.path(new_name)
+
+        # Create dir if necessary and move file
+        if not os.path.exists(os.path.dirname(new_path)):
+            os.makedirs(os.path.dirname(new_path))
+
+        shutil.move(im_path, new_path)
+        image.status = 'corrected'
+        image.image.name = new_name
+
+    except FileNotFoundError as err:
+        raise exceptions.ValidationError('Could not find the image file {} '.format(err), code=404)
+
+    except OSError as err:
+        raise exceptions.ValidationError('Could not move file to corrected folder ==> {} '.format(err), 400)
+
+
+# saves the images of a sheet which were corrected with one bulk update and moves the sheet counters with one atomic
+# update, so concurrent uploads and corrections of the same sheet never lose a count. The new (image, result) pairs are
+# stored in the same transaction
+def save_corrected_images(sheet: Quiz, images, results, job: CorrectionJob = None):
+    if not images and not results:
+        return
+
+    with transaction.atomic():
+        if images:
+            SheetImage.objects.bulk_update(images, ['status', 'image'])
+            Quiz.objects.filter(pk=sheet.id).update(pending_images=F('pending_images') - len(images),
+                                                    corrected_images=F('corrected_images') + len(images))
+
+        CorrectionResult.objects.bulk_create([build_correction_result(sheet, image, res, job)
+                                              for image, res in results])
+
+
+def build_correction_result(sheet: Quiz, image: SheetImage, res, job: CorrectionJob = None):
+    return CorrectionResult(image=image, sheet=sheet, job=job,
+                            student_code=res['student_code'],
+                            score=float(res['score']),
+                            total=float(res['total']),
+                            sheet_number=res['sheet_number'],
+                            quiz_version=sheet.version,
+                            summary=res['summary'])
+
+
+# results stored for images with the same content corrected with the current version of the quiz, keyed by hash
+def find_cached_results(sheet: Quiz, images):
+    hashes = {image.content_hash for image in images if image.content_hash}
+    if not hashes:
+        return {}
+
+    results = CorrectionResult.objects.filter(sheet_id=sheet.id, quiz_version=sheet.version,
+                                              image__content_hash__in=hashes).select_related('sheet', 'image')
+
+    return {res.image.content_hash: res for res in results.order_by('id')}
+
+
+# saves the layout template learned by the correctors of a sheet, unless one was saved in the meantime
+def save_layout_template(sheet: Quiz, template):
+    if Quiz.objects.filter(pk=sheet.id, layout_template__isnull=True).update(layout_template=template):
+        sheet.layout_template = template
+
+
+# adds the stages of the given traces to the histograms of their stage. The rows are locked while they are updated so
+# that the workers never lose each other's counts
+def record_stage_timings(traces):
+    stages = {}
+    for trace in traces:
+        for stage in trace:
+            stages.setdefault(stage['stage'], []).append(stage)
+
+    if not stages:
+        return
+
+    with transaction.atomic():
+        for name in stages:
+            StageHistogram.objects.get_or_create(stage=name)
+
+        # bulk_update does not apply auto_now, the histograms are marked updated here
+        updated = now()
+        histograms = list(StageHistogram.objects.select_for_update().filter(stage__in=stages))
+        for histogram in histograms:
+            histogram.updated = updated
+            for stage in stages[histogram.stage]:
+                histogram.count += 1
+                histogram.wall_total += stage['wall']
+                histogram.cpu_total += stage['cpu']
+                histogram.pixels_total += stage['width'] * stage['height']
+                add_to_buckets(histogram.wall_buckets, stage['wall'])
+                add_to_buckets(histogram.cpu_buckets, stage['cpu'])
+
+        StageHistogram.objects.bulk_update(histograms, ['count', 'wall_total', 'cpu_total', 'pixels_total',
+                                                        'wall_buckets', 'cpu_buckets', 'updated'])
+
+
+# size of the process pool of a job worker. By default the cores are shared between the job workers started by the
+# correction_workers command, which tells its workers how many they are with CORRECTION_JOB_WORKERS
+def correction_pool_size():
+    size = getattr(settings, 'CORRECTION_POOL_SIZE', None)
+    if size:
+        return size
+
+    job_workers = int(os.environ.get('CORRECTION_JOB_WORKERS') or getattr(settings, 'CORRECTION_WORKERS', 2))
+    return max(1, (os.cpu_count() or 1) // max(1, job_workers))
+
+
+def get_batch_corrector(trace=False):
+    return engine.create_batch_corrector(max_workers=correction_pool_size(), trace=trace)
+
+
+# batches is a list of (sheet, images) pairs. For each sheet we return the list of (ok, result_or_error, cached)
+# triples of its images in order, cached is the stored CorrectionResult the result was taken from if any. Only the
+# images which were never corrected with the current version of their quiz go through the correction pipeline.
+# Their stages are only timed with trace or CORRECTION_TRACE_STAGES, the timings are then recorded in the stage
+# histograms and they are only kept in the results with trace
+def correct_sheets(batches, trace=False):
+    traced = trace or getattr(settings, 'CORRECTION_TRACE_STAGES', False)
+    cached = [find_cached_results(sheet, images) for sheet, images in batches]
+    outcomes = get_batch_corrector(trace=traced).correct(
+        [(sheet, [image.image.path for image in images if image.content_hash not in hits])
+         for (sheet, images), hits in zip(batches, cached)])
+
+    corrected = []
+    traces = []
+    for (sheet, images), hits, sheet_outcomes in zip(batches, cached, outcomes):
+        sheet_outcomes = iter(sheet_outcomes)
+        sheet_corrected = []
+        template = None
+
+        for number, image in enumerate(images, start=1):
+            hit = hits.get(image.content_hash)
+            ok, res = (True, hit.as_result()) if hit is not None else next(sheet_outcomes)
+
+            # results are numbered by their position in the batch, wherever they come from
+            if ok:
+                res['sheet_number'] = number
+                template = res.pop('layout_template', None) or template
+
+                if hit is None and traced:
+                    traces.append(res.get('trace', []) if trace else res.pop('trace', []))
+
+            sheet_corrected.append((ok, res, hit))
+
+        if template is not None and sheet.layout_template is None:
+            save_layout_template(sheet, template)
+
+        corrected.append(sheet_corrected)
+
+    record_stage_timings(traces)
+    return corrected
+
+
+# the clients opt in to the stage timings of their sheets when they start a job, see views.trace_requested
+def job_traced(job: CorrectionJob = None):
+    return job is not None and bool(job.payload.get('trace'))
+
+
+# corrects freshly uploaded images of one sheet, the first badly formatted image fails the whole upload.
+# Images which were already corrected (e.g. uploaded again) are not moved and keep their stored result
+def correct_images(sheet: Quiz, images, job: CorrectionJob = None):
+    images = list(images)
+    outcomes = correct_sheets([(sheet, images)], trace=job_traced(job))[0]
+    results = []
+    moved = []
+    new_results = []
+
+    try:
+        for image, (ok, res, hit) in zip(images, outcomes):
+            if not ok:
+                raise exceptions.ValidationError(
+                    'One or more of the sheets is not well formatted ===> {}'.format(res), code=400)
+
+            if image.status == 'pending':
+                move_corrected_image(image)
+                moved.append(image)
+
+            if hit is None or hit.image_id != image.id:
+                new_results.append((image, res))
+
+            results.append(res)
+
+    finally:
+        # the images corrected before a failure are kept as corrected
+        save_corrected_images(sheet, moved, new_results, job)
+
+    return {'results': results}
+
+
+# corrects all the pending images of the given sheets, errors are collected per sheet and do not stop the batch
+def correct_pending_sheets(sheet_ids, job: CorrectionJob = None):
+    sheets = list(Quiz.objects.filter(pk__in=sheet_ids))
+    pending = [list(SheetImage.objects.filter(Q(sheet_id=sheet.id) & Q(status='pending'))) for sheet in sheets]
+
+    # the images of all the sheets are spread over the same process pool
+    outcomes = correct_sheets(list(zip(sheets, pending)), trace=job_traced(job))
+
+    final_results = []
+
+    for sheet, images, sheet_outcomes in zip(sheets, pending, outcomes):
+        sheet_results = {'sheet_id': sheet.id, 'sheet_name': sheet.sheet_name, 'results': [], 'errors': []}
+        moved = []
+        new_results = []
+
+        for image, (ok, res, hit) in zip(images, sheet_outcomes):
+            if not ok:
+                sheet_results['errors'].append(res)
+                continue
+
+            sheet_results['results'].append(res)
+            try:
+                move_corrected_image(image)
+                moved.append(image)
+                if hit is None or hit.image_id != image.id:
+                    new_results.append((image, res))
+
+            except Exception as err:
+                sheet_results['errors'].append(str(err))
+
+        save_corrected_images(sheet, moved, new_results, job)
+        final_results.append(sheet_results)
+
+    return final_results
@@ -0,0 +1,95 @@
+from django.conf import settings
+from django.db import transaction, close_old_connections
+from django.utils.timezone import now
+from rest_framework import exceptions
+from .models import CorrectionJob
+from datetime import timedelta
+import time
+
+
+def enqueue_job(kind, payload, creator):
+    return CorrectionJob.objects.create(kind=kind, payload=payload, creator=creator)
+
+
+# jobs still running CORRECTION_JOB_TIMEOUT seconds after they were claimed were left by a worker which died. They are
+# queued again, unless they were already claimed CORRECTION_JOB_ATTEMPTS times in which case they fail
+def requeue_stale_jobs():
+    timeout = getattr(settings, 'CORRECTION_JOB_TIMEOUT', 30 * 60)
+    attempts = getattr(settings, 'CORRECTION_JOB_ATTEMPTS', 3)
+    stale = CorrectionJob.objects.filter(status='running', started__lt=now() - timedelta(seconds=timeout))
+
+    error = 'The correction was stopped {} times before it finished'.format(attempts)
+    stale.filter(attempts__gte=attempts).update(status='failed', finished=now(), error=error)
+
+    return stale.update(status='queued', worker='')
+
+
+# we take the oldest queued job and mark it as running, skip_locked makes sure that two workers polling at the same
+# time never claim the same job
+def claim_next_job(worker_name):
+    requeue_stale_jobs()
+
+    with transaction.atomic():
+        job = CorrectionJob.objects.select_for_update(skip_locked=True) \
+            .filter(status='queued').order_by('created', 'id').first()
+
+        if job is None:
+            return None
+
+        job.status = 'running'
+        job.worker = worker_name
+        job.started = now()
+        job.attempts += 1
+        job.save(update_fields=['status', 'worker', 'started', 'attempts'])
+
+    return job
+
+
+def run_job(job: CorrectionJob):
+    # the correction stack is only imported by the workers which actually correct sheets
+    from . import correction
+    from .models import Quiz, SheetImage
+
+    try:
+        if job.kind == 'upload':
+            sheet = Quiz.objects.get(pk=job.payload['sheet_id'])
+            images = SheetImage.objects.filter(pk__in=job.payload['image_ids']).order_by('id')
+            job.result = correction.correct_images(sheet, images, job)
+        else:
+            job.result = correction.correct_pending_sheets(job.payload['sheets'], job)
+
+        job.status = 'done'
+
+    except exceptions.ValidationError as err:
+        job.status = 'failed'
+        job.error = ' '.join(str(detail) for detail in err.detail)
+
+    except Exception as err:
+        job.status = 'failed'
+        job.error = str(err)
+
+    # a job requeued while it ran (see requeue_stale_jobs) belongs to the worker which claimed it again
+    job.finished = now()
+    CorrectionJob.objects.filter(pk=job.pk, status='running', worker=job.worker) \
+        .update(status=job.status, result=job.result, error=job.error, finished=job.finished)
+    return job
+
+
+# main loop of a correction worker, it keeps draining the queue and sleeps when there is nothing to do
+def work(worker_name, poll_interval=1.0, max_jobs=None):
+    done = 0
+    while max_jobs is None or done < max_jobs:
+        # the worker lives for days, connections which were closed by the database or went bad are replaced
+        close_old_connections()
+
+        job = claim_next_job(worker_name)
+        if job is None:
+            if max_jobs is not None:
+                break
+            time.sleep(poll_interval)
+            continue
+
+        run_job(job)
+        done += 1
+
+    return done
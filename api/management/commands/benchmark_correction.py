@@ -0,0 +1,176 @@
+from django.core.management.base import BaseCommand
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+# percentiles of the stage latencies reported by the benchmark
+PERCENTILES = (50, 90, 99)
+
+
+# current commit of the repository, so that reports of different commits can be told apart. The commit is marked
+# "-dirty" when some of the given files have uncommitted changes: the report was then made on top of that commit
+def git_commit(paths=()):
+    directory = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                                cwd=directory).stdout.strip()
+        if paths and subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no', '--', *paths],
+                                    capture_output=True, text=True, check=True, cwd=directory).stdout.strip():
+            commit += '-dirty'
+
+        return commit
+
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# peak resident memory of the process in megabytes, linux reports ru_maxrss in kilobytes and macos in bytes
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+# latency percentiles (in milliseconds) of every stage of the given traces
+def stage_percentiles(traces):
+    import numpy as np
+
+    stages = {}
+    for trace in traces:
+        for stage in trace:
+            stages.setdefault(stage['stage'], []).append(stage['wall'] * 1000)
+
+    percentiles = {}
+    for name, times in stages.items():
+        values = np.percentile(times, PERCENTILES)
+        percentiles[name] = {'p{}'.format(p): float(value) for p, value in zip(PERCENTILES, values)}
+        percentiles[name].update(mean=float(np.mean(times)), count=len(times))
+
+    return percentiles
+
+
+class Command(BaseCommand):
+    help = 'Corrects synthetic answer sheets and reports the throughput and the stage latencies of the correction'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--questions', type=int, nargs='+', default=[10, 25, 50])
+        parser.add_argument('--scales', type=float, nargs='+', default=[1.0, 2.0, 3.0],
+                            help='resolutions of the photos, relative to an 850x1100 page')
+        parser.add_argument('--noise', type=float, nargs='+', default=[0.0, 4.0, 8.0],
+                            help='standard deviations of the noise added to the photos')
+        parser.add_argument('--sheets', type=int, default=5, help='sheets corrected for every configuration')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--ocr', action='store_true', help='read the student codes with tesseract too')
+        parser.add_argument('--output', help='file the JSON report is written to')
+        parser.add_argument('--compare', help='JSON report of an earlier run the results are compared to')
+
+    def handle(self, *args, **options):
+        # the correction stack is only loaded by the benchmark itself, see api.sheets_correction.engine
+        import cv2
+        from api.sheets_correction.engine import create_corrector
+        from api.sheets_correction.golden import detected_answers
+        from api.sheets_correction.synthetic import render_sheet, synthetic_quiz
+
+        configurations = []
+        all_traces = []
+        total_sheets = 0
+        total_seconds = 0.0
+
+        with tempfile.TemporaryDirectory() as directory:
+            for questions in options['questions']:
+                for scale in options['scales']:
+                    for noise in options['noise']:
+                        # the photos are written as jpeg files first, so decoding them is measured like in production
+                        sheets = []
+                        for i in range(options['sheets']):
+                            image, answers = render_sheet(questions, scale=scale, noise=noise,
+                                                          seed=options['seed'] + i)
+                            path = os.path.join(directory, 'sheet-{}-{}-{}-{}.jpg'.format(questions, scale, noise, i))
+                            cv2.imwrite(path, image)
+                            sheets.append((path, answers))
+
+                        # the answers of the first sheet are the answer key of the quiz
+                        quiz = synthetic_quiz(sheets[0][1])
+                        corrector = create_corrector(quiz, read_student_code=options['ocr'], trace=True)
+                        traces = []
+                        exact = 0
+                        errors = 0
+
+                        start = time.perf_counter()
+                        for number, (path, answers) in enumerate(sheets, start=1):
+                            try:
+                                result = corrector.correct_sheet(path, sheet_number=number)
+                            except Exception:
+                                errors += 1
+                                continue
+
+                            traces.append(result['trace'])
+                            exact += detected_answers(result['summary']) == answers
+
+                        seconds = time.perf_counter() - start
+
+                        configurations.append({
+                            'questions': questions,
+                            'scale': scale,
+                            'noise': noise,
+                            'sheets': len(sheets),
+                            'seconds': seconds,
+                            'sheets_per_second': len(sheets) / seconds if seconds else None,
+                            'exact': exact,  # sheets whose answers were all read correctly
+                            'errors': errors,
+                            'stages': stage_percentiles(traces),
+                        })
+
+                        all_traces.extend(traces)
+                        total_sheets += len(sheets)
+                        total_seconds += seconds
+
+                        self.stdout.write('{:>3} questions  scale {:<4} noise {:<4} {:6.1f} sheets/s  {}/{} exact'
+                                          .format(questions, scale, noise, len(sheets) / seconds, exact, len(sheets)))
+
+        report = {
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'opencv': cv2.__version__,
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'options': {name: options[name] for name in ('questions', 'scales', 'noise', 'sheets', 'seed', 'ocr')},
+            'sheets': total_sheets,
+            'seconds': total_seconds,
+            'sheets_per_second': total_sheets / total_seconds if total_seconds else None,
+            'peak_rss_mb': peak_rss_mb(),
+            'stages': stage_percentiles(all_traces),
+            'configurations': configurations,
+        }
+
+        self.stdout.write('{} sheets, {:.1f} sheets/s, peak RSS {:.0f} MB'.format(
+            total_sheets, report['sheets_per_second'] or 0, report['peak_rss_mb']))
+
+        for name, stats in report['stages'].items():
+            self.stdout.write('  {:<12} p50 {:7.2f} ms  p90 {:7.2f} ms  p99 {:7.2f} ms'.format(
+                name, stats['p50'], stats['p90'], stats['p99']))
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+
+        if options['compare']:
+            with open(options['compare']) as baseline:
+                self.compare(json.load(baseline), report)
+
+    # prints the changes of the throughput and of the median stage latencies since the baseline report
+    def compare(self, baseline, report):
+        self.stdout.write('compared to {}:'.format(baseline.get('commit') or 'baseline'))
+        self.stdout.write('  sheets/s     {:7.1f} -> {:7.1f} ({:+.0%})'.format(
+            baseline['sheets_per_second'], report['sheets_per_second'],
+            report['sheets_per_second'] / baseline['sheets_per_second'] - 1))
+
+        for name, stats in report['stages'].items():
+            if name in baseline['stages']:
+                before = baseline['stages'][name]['p50']
+                self.stdout.write('  {:<12} p50 {:7.2f} -> {:7.2f} ms ({:+.0%})'.format(
+                    name, before, stats['p50'], stats['p50'] / before - 1 if before else 0))
@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from django import db
+import multiprocessing
+import platform
+import os
+
+
+def run_worker(worker_name, poll_interval):
+    # with the spawn start method the child starts from a fresh interpreter, so django has to be set up again
+    import django
+    django.setup()
+
+    # connections inherited from the parent process must never be shared between processes
+    db.connections.close_all()
+
+    # the correction stack is loaded before the first job is claimed, see api.sheets_correction.engine
+    from api.sheets_correction import engine
+    engine.preload()
+
+    from api import jobs
+    jobs.work(worker_name, poll_interval=poll_interval)
+
+
+class Command(BaseCommand):
+    help = 'Starts a pool of local worker processes which drain the sheet correction job queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=getattr(settings, 'CORRECTION_WORKERS', 2))
+        parser.add_argument('--poll-interval', type=float, default=getattr(settings, 'CORRECTION_POLL_INTERVAL', 1.0))
+
+    def handle(self, *args, **options):
+        db.connections.close_all()
+
+        # the workers share the cores between their process pools, see api.correction.correction_pool_size
+        os.environ['CORRECTION_JOB_WORKERS'] = str(options['workers'])
+
+        processes = []
+        for i in range(options['workers']):
+            worker_name = '{}-{}-{}'.format(platform.node(), os.getpid(), i)
+            # workers are not daemonic so that they are allowed to start child processes of their own
+            process = multiprocessing.Process(target=run_worker, args=(worker_name, options['poll_interval']),
+                                              name=worker_name)
+            process.start()
+            processes.append(process)
+
+        self.stdout.write('Started {} correction workers'.format(len(processes)))
+
+        try:
+            for process in processes:
+                process.join()
+
+        except KeyboardInterrupt:
+            for process in processes:
+                process.terminate()
+                process.join()
@@ -0,0 +1,85 @@
+from django.core.management.base import BaseCommand, CommandError
+from .benchmark_correction import git_commit
+import json
+import os
+
+
+class Command(BaseCommand):
+    help = 'Records the outputs of the correction engine on the golden corpus, or checks them against the recorded ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['record', 'check'])
+        parser.add_argument('--corpus', help='corpus file, the one shipped with the repository by default')
+        parser.add_argument('--engine', choices=['serial', 'batch'], default='serial')
+        parser.add_argument('--workers', type=int, help='workers of the batch engine')
+        parser.add_argument('--ocr', action='store_true', help='read the student codes with tesseract too')
+        parser.add_argument('--output', help='file the JSON report of a check is written to')
+        parser.add_argument('--case', action='append', dest='cases', metavar='NAME',
+                            help='only check the sheet of that name, can be repeated')
+
+    def handle(self, *args, **options):
+        from api.sheets_correction import golden
+
+        path = options['corpus'] or golden.DEFAULT_CORPUS
+        corpus = None
+        if os.path.exists(path):
+            with open(path) as corpus_file:
+                corpus = json.load(corpus_file)
+
+        if options['action'] == 'check' and corpus is None:
+            raise CommandError('there is no corpus at {}, record one first'.format(path))
+
+        if options['cases']:
+            if options['action'] == 'record':
+                raise CommandError('only whole corpora are recorded')
+
+            unknown = set(options['cases']) - {case['name'] for case in corpus['cases']}
+            if unknown:
+                raise CommandError('there is no sheet named {} in the corpus'.format(', '.join(sorted(unknown))))
+
+            corpus['cases'] = [case for case in corpus['cases'] if case['name'] in options['cases']]
+
+        # a recorded corpus keeps its sheets, a new one is made of the default synthetic sheets
+        cases = [{name: value for name, value in case.items() if name != 'expected'} for case in corpus['cases']] \
+            if corpus is not None else golden.default_cases()
+
+        outcomes, truths, seconds = golden.correct_corpus(cases, os.path.dirname(os.path.abspath(path)),
+                                                          engine=options['engine'], workers=options['workers'],
+                                                          ocr=options['ocr'])
+
+        correct, questions = map(sum, zip(*[golden.truth_accuracy(outcome, answers)
+                                           for outcome, answers in zip(outcomes, truths)]))
+        self.stdout.write('{} sheets in {:.2f}s ({:.1f} sheets/s), {}/{} questions read as filled'.format(
+            len(cases), seconds, len(cases) / seconds if seconds else 0, correct, questions))
+
+        if options['action'] == 'record':
+            with open(path, 'w') as corpus_file:
+                json.dump({'commit': git_commit(golden.engine_sources()), 'sources': golden.engine_digest(),
+                           'engine': options['engine'], 'ocr': options['ocr'],
+                           'cases': [dict(case, expected=outcome) for case, outcome in zip(cases, outcomes)]},
+                          corpus_file, indent=1)
+
+            self.stdout.write('recorded {} sheets in {}'.format(len(cases), path))
+            return
+
+        deltas = []
+        for case, outcome in zip(corpus['cases'], outcomes):
+            delta = golden.compare_outcome(case['expected'], outcome)
+            if delta is not None:
+                deltas.append(dict(delta, name=case['name']))
+                self.stdout.write('  {:<24} {}'.format(case['name'], ', '.join(
+                    '{} {}'.format(name, value) for name, value in delta.items() if name != 'name')))
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump({'commit': git_commit(golden.engine_sources()), 'baseline': corpus.get('commit'),
+                           'sources': golden.engine_digest(), 'baseline_sources': corpus.get('sources'),
+                           'engine': options['engine'], 'sheets': len(cases), 'seconds': seconds,
+                           'questions': questions, 'questions_read_as_filled': correct, 'deltas': deltas},
+                          output, indent=2)
+
+        if deltas:
+            raise CommandError('{} of {} sheets differ from the golden corpus recorded at {}'.format(
+                len(deltas), len(cases), corpus.get('commit')))
+
+        self.stdout.write('all {} sheets match the golden corpus'.format(len(cases)))
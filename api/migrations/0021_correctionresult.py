@@ -0,0 +1,36 @@
+# Generated by Django 3.2.3 on 2026-10-18 14:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0020_quiz_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CorrectionResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('student_code', models.CharField(blank=True, default='', max_length=255)),
+                ('score', models.FloatField()),
+                ('total', models.FloatField()),
+                ('sheet_number', models.IntegerField(default=1)),
+                ('summary', models.JSONField(default=dict)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('image', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='results', to='api.sheetimage')),
+                ('job', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='results', to='api.correctionjob')),
+                ('sheet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='results', to='api.quiz')),
+            ],
+            options={
+                'ordering': ['sheet_id', 'sheet_number', 'id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='correctionresult',
+            index=models.Index(fields=['sheet', 'student_code'], name='api_correct_sheet_i_36d638_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.2.3 on 2026-10-18 14:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0021_correctionresult'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='correctionresult',
+            name='quiz_version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='sheetimage',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddIndex(
+            model_name='correctionresult',
+            index=models.Index(fields=['sheet', 'quiz_version'], name='api_correct_sheet_i_63e03d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sheetimage',
+            index=models.Index(fields=['sheet', 'content_hash'], name='api_sheetim_sheet_i_5b1ee6_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.3 on 2026-10-18 14:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0022_sheetimage_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='quiz',
+            name='student_id_length',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.3 on 2026-10-18 14:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0023_quiz_student_id_length'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='quiz',
+            name='layout_template',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='quiz',
+            name='use_layout_template',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.3 on 2026-10-18 14:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0024_quiz_layout_template'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='quiz',
+            name='fiducials',
+            field=models.BooleanField(default=False),
+        ),
+    ]
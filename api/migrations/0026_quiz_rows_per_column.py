@@ -0,0 +1,25 @@
+# Generated by Django 3.2.3 on 2026-10-18 14:25
+
+from django.db import migrations, models
+
+
+# the boxes of the templates are now named after the answer columns, templates are learned again from the next sheet
+def forget_layout_templates(apps, schema_editor):
+    Quiz = apps.get_model('api', 'Quiz')
+    Quiz.objects.filter(layout_template__isnull=False).update(layout_template=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0025_quiz_fiducials'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='quiz',
+            name='rows_per_column',
+            field=models.PositiveIntegerField(default=25),
+        ),
+        migrations.RunPython(forget_layout_templates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 3.2.3 on 2026-10-18 14:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0026_quiz_rows_per_column'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StageHistogram',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stage', models.CharField(max_length=50, unique=True)),
+                ('count', models.BigIntegerField(default=0)),
+                ('wall_total', models.FloatField(default=0)),
+                ('cpu_total', models.FloatField(default=0)),
+                ('pixels_total', models.BigIntegerField(default=0)),
+                ('wall_buckets', models.JSONField(default=list)),
+                ('cpu_buckets', models.JSONField(default=list)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['stage'],
+            },
+        ),
+    ]
@@ -0,0 +1,99 @@
+# Generated by Django 3.2.3 on 2026-10-18 14:49
+
+from django.db import migrations, models
+import base64
+import struct
+
+# version 1 of the packed summaries of api.sheets_correction.packing, copied so that the migration keeps reading and
+# writing that version whatever the module becomes
+PACKED_VERSION = 1
+
+PACKED_HEADER = struct.Struct('<BHB')
+
+
+def pack_summary(choices, chosen, correct, marks, percentage_pass):
+    size = (choices + 7) // 8
+    questions = len(chosen)
+
+    return base64.b64encode(b''.join([
+        PACKED_HEADER.pack(PACKED_VERSION, questions, choices),
+        b''.join(mask.to_bytes(size, 'little') for mask in chosen),
+        b''.join(mask.to_bytes(size, 'little') for mask in correct),
+        struct.pack('<{}f'.format(questions), *marks),
+        struct.pack('<{}f'.format(questions), *percentage_pass),
+    ])).decode('ascii')
+
+
+# the (choices, chosen masks, correct masks, marks, percentages) of a packed summary
+def unpack_summary(packed):
+    data = base64.b64decode(packed)
+    version, questions, choices = PACKED_HEADER.unpack_from(data)
+    if version != PACKED_VERSION:
+        raise ValueError('unknown version {} of packed summary'.format(version))
+
+    size = (choices + 7) // 8
+    offset = PACKED_HEADER.size
+    masks = [int.from_bytes(data[start:start + size], 'little')
+             for start in range(offset, offset + 2 * questions * size, size)]
+    floats = struct.unpack_from('<{}f'.format(2 * questions), data, offset + 2 * questions * size)
+
+    return choices, masks[:questions], masks[questions:], list(floats[:questions]), list(floats[questions:])
+
+
+# the summaries stored column by column with choice indexes e.g {'correct': [[0], []], 'wrong': [[], [1, 2]],
+# 'percentage_pass': [100.0, 0.0], 'mark': [2.0, 0.0]} are packed
+def pack_summaries(apps, schema_editor):
+    CorrectionResult = apps.get_model('api', 'CorrectionResult')
+
+    results = []
+    for result in CorrectionResult.objects.select_related('sheet').iterator():
+        summary = result.summary
+        if not isinstance(summary, dict):
+            continue
+
+        def masks(column):
+            return [sum(1 << j for j in choices) for choices in summary.get(column, [])]
+
+        correct, wrong = masks('correct'), masks('wrong')
+        result.summary = pack_summary(int(result.sheet.choices), [c | w for c, w in zip(correct, wrong)], correct,
+                                      summary.get('mark', []), summary.get('percentage_pass', []))
+        results.append(result)
+
+    CorrectionResult.objects.bulk_update(results, ['summary'], batch_size=500)
+
+
+def unpack_summaries(apps, schema_editor):
+    CorrectionResult = apps.get_model('api', 'CorrectionResult')
+
+    results = []
+    for result in CorrectionResult.objects.iterator():
+        if not isinstance(result.summary, str) or not result.summary:
+            continue
+
+        choices, chosen, correct, marks, percentage_pass = unpack_summary(result.summary)
+        bits = range(choices)
+        result.summary = {
+            'correct': [[j for j in bits if mask >> j & 1] for mask in correct],
+            'wrong': [[j for j in bits if (mask & ~right) >> j & 1] for mask, right in zip(chosen, correct)],
+            'percentage_pass': percentage_pass,
+            'mark': marks,
+        }
+        results.append(result)
+
+    CorrectionResult.objects.bulk_update(results, ['summary'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0027_stagehistogram'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='correctionresult',
+            name='summary',
+            field=models.JSONField(default=str),
+        ),
+        migrations.RunPython(pack_summaries, unpack_summaries),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.3 on 2026-10-18 14:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0028_packed_result_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='correctionjob',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
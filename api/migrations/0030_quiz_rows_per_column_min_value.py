@@ -0,0 +1,19 @@
+# Generated by Django 3.2.3 on 2026-10-18 15:28
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0029_correctionjob_attempts'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='quiz',
+            name='rows_per_column',
+            field=models.PositiveIntegerField(default=25, validators=[django.core.validators.MinValueValidator(1)]),
+        ),
+    ]
@@ -1,3 +1,4 @@
+from django.core.validators import MinValueValidator
 from django.db import models
 from django.conf import settings
 from django.db.models.signals import post_save
@@ -5,6 +6,7 @@ from django.dispatch import receiver
 from rest_framework.authtoken.models import Token
 from django_mysql.models import ListCharField, ListTextField
 from datetime import datetime
+from .sheets_correction.packing import PackedSummary
 import os
 
 
@@ -18,6 +20,14 @@ class Quiz(models.Model):
     bubble_types = [('Circles', 'Circles'), ('Squares', 'Squares')]
     label_types = [('A-B-C', 'A-B-C'), ('i-ii-iii', 'i-ii-iii'), ('1-2-3', '1-2-3')]
 
+    # fields the correction of a sheet depends on, saving a change of any of them makes a new version of the quiz
+    versioned_fields = ('questions', 'choices', 'choiceLabels', 'failMark', 'correctAnswers', 'marksAllocation',
+                        'marksDistribution', 'bubble', 'rows_per_column', 'student_id_length', 'fiducials')
+
+    # versioned fields which move the boxes printed on the sheet, saving a change of any of them forgets the layout
+    # template learned from the sheets printed before
+    layout_fields = ('questions', 'choices', 'rows_per_column', 'student_id_length', 'fiducials')
+
     sheet_name = models.CharField(max_length=255, default="default_sheet")
     created = models.DateTimeField(auto_now_add=True)
     bubble = models.CharField(choices=bubble_types, max_length=100)
@@ -28,6 +38,24 @@ class Quiz(models.Model):
     pending_images = models.IntegerField(default=0)
     corrected_images = models.IntegerField(default=0)
 
+    # the answers are printed in columns of this many questions, from left to right
+    rows_per_column = models.PositiveIntegerField(default=25, validators=[MinValueValidator(1)])
+
+    # number of digits of the student id grid printed instead of the code box, 0 when the code is read with OCR
+    student_id_length = models.PositiveIntegerField(default=0)
+
+    # the sheets are printed with fiducial markers in the corners of the page, see api.sheets_correction.fiducials
+    fiducials = models.BooleanField(default=False)
+
+    # when set, the boxes of the sheets are located with a template of the layout learned from the first sheet corrected
+    # cleanly, see api.sheets_correction.layout. It is forgotten when one of the layout fields changes
+    use_layout_template = models.BooleanField(default=False)
+    layout_template = models.JSONField(null=True, blank=True)
+
+    # incremented by save() every time one of the versioned fields changes, compiled answer keys are cached and
+    # results are reused per quiz id and version. Queryset updates of these fields bypass it
+    version = models.PositiveIntegerField(default=1)
+
     # list fields
     correctAnswers = ListCharField(
         base_field=models.CharField(max_length=3),
@@ -69,6 +97,64 @@ class Quiz(models.Model):
     def __str__(self):
         return self.sheet_name
 
+    # every write path (API, admin, shell...) goes through save, which compares the versioned fields with the stored
+    # ones. A change increments the version with an F() expression, so concurrent updates never reuse a version. A
+    # save of some fields only (update_fields) only compares those, the others are not written
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        versioned = self.versioned_fields if update_fields is None else \
+            [name for name in self.versioned_fields if name in set(update_fields)]
+
+        changed = self.changed_fields(versioned)
+        saved = set()
+        if changed:
+            self.version = models.F('version') + 1
+            saved.add('version')
+
+        if set(changed) & set(self.layout_fields):
+            self.layout_template = None
+            saved.add('layout_template')
+
+        if update_fields is not None and saved:
+            kwargs['update_fields'] = set(update_fields) | saved
+
+        super().save(*args, **kwargs)
+
+        if changed:
+            from .sheets_correction.answer_keys import answer_keys
+
+            self.refresh_from_db(fields=['version'])
+            answer_keys.invalidate(self.id)
+
+    # the fields among the given ones whose value differs from the stored one, none for a quiz not stored yet
+    def changed_fields(self, names):
+        if not names or self._state.adding or self.pk is None:
+            return []
+
+        stored = Quiz.objects.filter(pk=self.pk).values(*names).first()
+        if stored is None:
+            return []
+
+        fields = [self._meta.get_field(name) for name in names]
+        return [field.name for field in fields
+                if field.to_python(getattr(self, field.attname)) != field.to_python(stored[field.name])]
+
+    # returns the label printed on the sheet for the choice with the given index
+    def get_choice_label(self, number):
+        if self.choiceLabels == "A-B-C":
+            return 'ABCDE'[number]
+        elif self.choiceLabels == 'i-ii-iii':
+            return ['i', 'ii', 'iii', 'iv', 'v'][number]
+        else:
+            return '12345'[number]
+
+    def choice_labels(self):
+        return [self.get_choice_label(i) for i in range(int(self.choices))]
+
+    # the verbose form of a packed result summary, see api.sheets_correction.packing
+    def expand_summary(self, packed):
+        return PackedSummary.from_json(packed).expand(self.choice_labels())
+
     # quiz properties that are very useful to us
 
     class Meta:
@@ -79,7 +165,8 @@ def nameFile(instance, filename):
     now = datetime.now()
     ext = '.' + filename.split('.')[-1]
 
-    return os.path.join(settings.MEDIA_ROOT, 'images', 'sheets', 'sheet_{}'.format(instance.sheet_id),
+    # the path is relative to MEDIA_ROOT, the storage refuses absolute upload paths
+    return os.path.join('images', 'sheets', 'sheet_{}'.format(instance.sheet_id),
                         instance.status, now.isoformat() + ext)
 
 
@@ -89,3 +176,102 @@ class SheetImage(models.Model):
     image = models.ImageField(upload_to=nameFile, blank=True, null=True)
     sheet = models.ForeignKey(Quiz, related_name="image", on_delete=models.CASCADE)
     status = models.CharField(choices=status_types, max_length=50, default='pending')
+
+    # sha256 of the uploaded file, an image uploaded again for the same sheet is not stored twice
+    content_hash = models.CharField(max_length=64, blank=True, default="")
+
+    class Meta:
+        indexes = [models.Index(fields=['sheet', 'content_hash'])]
+
+
+class CorrectionJob(models.Model):
+    kind_types = [('upload', 'upload'), ('batch', 'batch')]
+    status_types = [('queued', 'queued'), ('running', 'running'), ('done', 'done'), ('failed', 'failed')]
+
+    kind = models.CharField(choices=kind_types, max_length=50)
+    status = models.CharField(choices=status_types, max_length=50, default='queued')
+    creator = models.ForeignKey('auth.User', related_name='correction_jobs', on_delete=models.CASCADE)
+
+    # what the job has to correct e.g {'sheet_id': 1, 'image_ids': [1, 2]} or {'sheets': [1, 2]}
+    payload = models.JSONField(default=dict)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True, default="")
+
+    worker = models.CharField(max_length=255, blank=True, default="")
+    attempts = models.PositiveIntegerField(default=0)  # number of times the job was claimed by a worker
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return '{} job {} ({})'.format(self.kind, self.id, self.status)
+
+    class Meta:
+        ordering = ['-created']
+        indexes = [models.Index(fields=['status', 'created'])]
+
+
+class CorrectionResult(models.Model):
+    image = models.ForeignKey(SheetImage, related_name='results', on_delete=models.CASCADE)
+    sheet = models.ForeignKey(Quiz, related_name='results', on_delete=models.CASCADE)
+    job = models.ForeignKey(CorrectionJob, related_name='results', null=True, blank=True, on_delete=models.SET_NULL)
+
+    student_code = models.CharField(max_length=255, blank=True, default="")
+    score = models.FloatField()
+    total = models.FloatField()
+    sheet_number = models.IntegerField(default=1)
+
+    # version of the quiz the image was corrected with, results of older versions are not reused
+    quiz_version = models.PositiveIntegerField(default=1)
+
+    # per question summary in the packed JSON form of api.sheets_correction.packing, the one returned by
+    # MCQCorrector.correct_sheet
+    summary = models.JSONField(default=str)
+
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return '{} - {}'.format(self.sheet_id, self.student_code)
+
+    # the verbose form of the summary
+    def expanded_summary(self):
+        return self.sheet.expand_summary(self.summary)
+
+    # the result in the form returned by MCQCorrector.correct_sheet
+    def as_result(self):
+        return {
+            'student_code': self.student_code,
+            'score': self.score,
+            'total': self.total,
+            'sheet_name': self.sheet.sheet_name,
+            'summary': self.summary,
+            'sheet_number': self.sheet_number
+        }
+
+    class Meta:
+        ordering = ['sheet_id', 'sheet_number', 'id']
+        indexes = [models.Index(fields=['sheet', 'student_code']), models.Index(fields=['sheet', 'quiz_version'])]
+
+
+# histograms of the timings of a stage of the correction pipeline over all the sheets corrected, see
+# api.sheets_correction.tracing. Bucket i counts the stages which took at most tracing.BUCKET_BOUNDS[i] milliseconds,
+# the last bucket those which took longer
+class StageHistogram(models.Model):
+    stage = models.CharField(max_length=50, unique=True)
+    count = models.BigIntegerField(default=0)
+
+    # sums of the wall and CPU times (in seconds) and of the pixels of the images handled
+    wall_total = models.FloatField(default=0)
+    cpu_total = models.FloatField(default=0)
+    pixels_total = models.BigIntegerField(default=0)
+
+    wall_buckets = models.JSONField(default=list)
+    cpu_buckets = models.JSONField(default=list)
+
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return '{} ({})'.format(self.stage, self.count)
+
+    class Meta:
+        ordering = ['stage']
@@ -1,5 +1,6 @@
 from django.contrib.auth.models import User, Group
-from .models import Quiz, SheetImage
+from .models import Quiz, SheetImage, CorrectionJob, CorrectionResult, StageHistogram
+from .sheets_correction.tracing import BUCKET_BOUNDS
 from rest_framework import serializers
 
 
@@ -28,6 +29,7 @@ class QuizSerializer(serializers.ModelSerializer):
         model = Quiz
         fields = '__all__'
         include = ['creator']
+        read_only_fields = ['version', 'layout_template']
 
 
 class ImageSerializer(serializers.ModelSerializer):
@@ -37,3 +39,63 @@ class ImageSerializer(serializers.ModelSerializer):
 
         fields = ('id', 'name', 'image', 'sheet', 'status')
         read_only_fields = ('id', 'name', 'sheet')
+
+
+class CorrectionJobSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = CorrectionJob
+
+        fields = ('id', 'kind', 'status', 'error', 'created', 'started', 'finished')
+        read_only_fields = fields
+
+
+class CorrectionResultSerializer(serializers.ModelSerializer):
+    sheet_name = serializers.ReadOnlyField(source='sheet.sheet_name')
+    summary = serializers.SerializerMethodField()
+
+    class Meta:
+        model = CorrectionResult
+
+        fields = ('id', 'image', 'sheet', 'sheet_name', 'job', 'student_code', 'score', 'total', 'sheet_number',
+                  'summary', 'created')
+        read_only_fields = fields
+
+    # the summary is packed unless the view asks for the verbose one
+    def get_summary(self, obj):
+        if self.context.get('verbose_summary'):
+            return obj.expanded_summary()
+
+        return obj.summary
+
+
+# mean timings (in milliseconds) of a stage and its histograms, the buckets are listed with their upper bound and the
+# last one, which has no bound, holds the slower stages
+class StageHistogramSerializer(serializers.ModelSerializer):
+    mean_wall_ms = serializers.SerializerMethodField()
+    mean_cpu_ms = serializers.SerializerMethodField()
+    mean_pixels = serializers.SerializerMethodField()
+    buckets = serializers.SerializerMethodField()
+
+    class Meta:
+        model = StageHistogram
+
+        fields = ('stage', 'count', 'mean_wall_ms', 'mean_cpu_ms', 'mean_pixels', 'buckets', 'updated')
+        read_only_fields = fields
+
+    def get_mean_wall_ms(self, obj):
+        return 1000 * obj.wall_total / obj.count if obj.count else 0.0
+
+    def get_mean_cpu_ms(self, obj):
+        return 1000 * obj.cpu_total / obj.count if obj.count else 0.0
+
+    def get_mean_pixels(self, obj):
+        return obj.pixels_total / obj.count if obj.count else 0.0
+
+    def get_buckets(self, obj):
+        bounds = list(BUCKET_BOUNDS) + [None]
+        wall = obj.wall_buckets + [0] * (len(bounds) - len(obj.wall_buckets))
+        cpu = obj.cpu_buckets + [0] * (len(bounds) - len(obj.cpu_buckets))
+
+        return [{'le_ms': bound, 'wall': wall_count, 'cpu': cpu_count}
+                for bound, wall_count, cpu_count in zip(bounds, wall, cpu)]
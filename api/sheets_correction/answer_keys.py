@@ -0,0 +1,48 @@
+from collections import OrderedDict
+import threading
+
+
+# process wide LRU cache of compiled answer keys. Entries are keyed by quiz id and remember the quiz version they were
+# compiled from, a quiz whose version changed is compiled again
+class AnswerKeyCache:
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()  # quiz id => (version, answer key)
+        self._lock = threading.Lock()
+
+    def get(self, quiz, compile_key):
+        # quizzes which are not saved have no identity to cache them under
+        if quiz.id is None:
+            return compile_key()
+
+        with self._lock:
+            entry = self._entries.get(quiz.id)
+            if entry is not None and entry[0] == quiz.version:
+                self._entries.move_to_end(quiz.id)
+                return entry[1]
+
+        answer_key = compile_key()
+        self.put(quiz, answer_key)
+        return answer_key
+
+    def put(self, quiz, answer_key):
+        if quiz.id is None:
+            return
+
+        with self._lock:
+            self._entries[quiz.id] = (quiz.version, answer_key)
+            self._entries.move_to_end(quiz.id)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, quiz_id):
+        with self._lock:
+            self._entries.pop(quiz_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+answer_keys = AnswerKeyCache()
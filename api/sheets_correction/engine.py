@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+"""
+Entry points of the correction engine.
+
+The engine needs opencv, numpy, imutils and tesseract, which take most of the start up time and resident memory of a
+process. The web processes, management commands and migrations never correct a sheet, so they only import this
+module: the computer vision stack is imported by the first call which needs it, and the correction workers load it
+up front with preload().
+"""
+
+# modules of the computer vision stack, loaded by preload()
+ENGINE_MODULES = ('api.sheets_correction.mcq_corrector', 'api.sheets_correction.parallel')
+
+
+# returns an MCQCorrector of the quiz, see mcq_corrector.MCQCorrector for the arguments
+def create_corrector(quiz, **kwargs):
+    from .mcq_corrector import MCQCorrector
+
+    return MCQCorrector(quiz, **kwargs)
+
+
+# returns a BatchCorrector, see parallel.BatchCorrector for the arguments
+def create_batch_corrector(**kwargs):
+    from .parallel import BatchCorrector
+
+    return BatchCorrector(**kwargs)
+
+
+# imports the whole stack, so that the first sheet corrected by a worker does not pay for it
+def preload():
+    import importlib
+
+    for name in ENGINE_MODULES:
+        importlib.import_module(name)
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Fiducial markers printed at the corners of the sheets.
+
+Sheets generated with draw_fiducials carry one ArUco marker in each corner of the page. find_fiducials detects them
+on a downscaled copy of the photo, which takes about the same time whatever the background, and returns the outer
+corners of the four markers. They are the page corners used by scanSheet instead of searching the page contour.
+"""
+import cv2
+import numpy as np
+
+ARUCO_DICT = cv2.aruco.DICT_4X4_50
+
+# id of the marker printed in each corner of the page, in the order of transform.order_points:
+# top-left, top-right, bottom-right, bottom-left. The outer corner of each marker has the same index in the
+# corners returned by the detector, as markers are printed upright
+MARKER_IDS = (0, 1, 2, 3)
+
+
+def get_dictionary():
+    return cv2.aruco.getPredefinedDictionary(ARUCO_DICT)
+
+
+def detect_markers(gray):
+    # opencv 4.7 replaced the detection functions by the ArucoDetector class
+    if hasattr(cv2.aruco, 'ArucoDetector'):
+        corners, ids, rejected = cv2.aruco.ArucoDetector(get_dictionary()).detectMarkers(gray)
+    else:
+        corners, ids, rejected = cv2.aruco.detectMarkers(gray, get_dictionary())
+
+    return corners, ids
+
+
+# draws the markers in the corners of a grayscale page, size and margin are in pixels
+def draw_fiducials(page, size=None, margin=None):
+    height, width = page.shape[:2]
+    size = size or max(int(min(width, height) * 0.06), 24)
+    margin = margin if margin is not None else size // 3
+
+    origins = [(margin, margin), (width - margin - size, margin),
+               (width - margin - size, height - margin - size), (margin, height - margin - size)]
+
+    for marker_id, (x, y) in zip(MARKER_IDS, origins):
+        if hasattr(cv2.aruco, 'generateImageMarker'):
+            marker = cv2.aruco.generateImageMarker(get_dictionary(), marker_id, size)
+        else:
+            marker = cv2.aruco.drawMarker(get_dictionary(), marker_id, size)
+
+        page[y:y + size, x:x + size] = marker if page.ndim == 2 else marker[..., None]
+
+    return page
+
+
+# returns the outer corners of the four markers in the order of MARKER_IDS, or None when they are not all found.
+# The markers are detected on a copy of the image no larger than max_size, the corners are then refined on small
+# windows of the full resolution image
+def find_fiducials(image, max_size=1000):
+    factor = max(max(image.shape[:2]) / max_size, 1)
+    small = image
+    if factor > 1:
+        # the markers are big enough for a linear resize, which is much faster than an area one
+        small = cv2.resize(image, None, fx=1 / factor, fy=1 / factor, interpolation=cv2.INTER_LINEAR)
+
+    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+    corners, ids = detect_markers(gray)
+    if ids is None:
+        return None
+
+    found = {int(marker_id): marker_corners.reshape(4, 2) for marker_id, marker_corners in zip(ids.ravel(), corners)}
+    if not all(marker_id in found for marker_id in MARKER_IDS):
+        return None
+
+    points = np.float32([found[marker_id][i] for i, marker_id in enumerate(MARKER_IDS)]) * factor
+
+    return refine_points(image, points, radius=int(np.ceil(2 * factor)) + 3)
+
+
+def refine_points(image, points, radius):
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.01)
+    height, width = image.shape[:2]
+    refined = points.copy()
+
+    for i, (x, y) in enumerate(points):
+        x0, y0 = max(int(x) - 2 * radius, 0), max(int(y) - 2 * radius, 0)
+        window = image[y0:min(int(y) + 2 * radius, height), x0:min(int(x) + 2 * radius, width)]
+        if min(window.shape[:2]) <= 2 * radius:
+            continue
+
+        window = cv2.cvtColor(window, cv2.COLOR_BGR2GRAY) if window.ndim == 3 else window
+        point = np.float32([[[x - x0, y - y0]]])
+        cv2.cornerSubPix(window, point, (radius, radius), (-1, -1), criteria)
+        refined[i] = point.reshape(2) + [x0, y0]
+
+    return refined
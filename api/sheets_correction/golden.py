@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+Golden corpus of the correction engine.
+
+The corpus is a JSON file listing sheets with the output the engine gave for each of them when it was recorded. A
+sheet is either synthetic, described by the arguments of synthetic.render_sheet and rendered again on every run, or a
+photo (e.g an anonymized scan) stored next to the corpus file with the fields of its quiz. Running the corpus again
+and comparing the outputs with the recorded ones tells whether a change of the engine (thresholds, downscaling,
+vectorization, parallelism...) changes any score, see the golden_corpus management command.
+"""
+import hashlib
+import os
+import tempfile
+import time
+
+# corpus shipped with the repository
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'golden_corpus.json')
+
+# the answer key of a synthetic sheet is drawn with the seed of the sheet plus this offset
+KEY_SEED_OFFSET = 1000
+
+
+# the modules the outputs of the engine depend on, everything in the package but this harness
+def engine_sources():
+    directory = os.path.dirname(os.path.abspath(__file__))
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory))
+            if name.endswith('.py') and name != 'golden.py']
+
+
+# digest of the sources of the engine. A corpus is recorded before the commit of the engine change it records, so
+# its commit is the one it was recorded on top of, the digest tells which engine it was recorded with
+def engine_digest():
+    digest = hashlib.sha1()
+    for path in engine_sources():
+        digest.update(os.path.basename(path).encode())
+        with open(path, 'rb') as source:
+            digest.update(source.read())
+
+    return digest.hexdigest()[:12]
+
+
+# the synthetic sheets of a new corpus: every question count at every resolution with and without noise, and a few
+# variants of the layout
+def default_cases():
+    cases = []
+    for questions in (10, 25, 50):
+        for scale in (1.0, 2.0, 3.0):
+            for noise in (0.0, 4.0):
+                for seed in (0, 1):
+                    cases.append({'name': 'q{}-s{}-n{}-{}'.format(questions, scale, noise, seed),
+                                  'questions': questions, 'scale': scale, 'noise': noise, 'seed': seed})
+
+    cases += [
+        {'name': 'circles', 'questions': 25, 'scale': 2.0, 'noise': 4.0, 'seed': 2, 'bubble': 'Circles'},
+        {'name': 'five-choices', 'questions': 25, 'choices': 5, 'scale': 2.0, 'noise': 4.0, 'seed': 3},
+        {'name': 'four-columns', 'questions': 60, 'rows_per_column': 15, 'scale': 2.0, 'noise': 4.0, 'seed': 4},
+        {'name': 'student-id', 'questions': 25, 'scale': 2.0, 'noise': 4.0, 'seed': 5, 'student_id': '042917'},
+        {'name': 'fiducials', 'questions': 50, 'scale': 2.0, 'noise': 4.0, 'seed': 6, 'fiducials': True},
+    ]
+    return cases
+
+
+# the quiz a sheet of the corpus is corrected with
+def case_quiz(case):
+    from api.models import Quiz
+    from .synthetic import synthetic_quiz
+    import numpy as np
+
+    if 'image' in case:
+        return Quiz(sheet_name=case['name'], **case['quiz'])
+
+    choices = case.get('choices', 4)
+    key = np.random.default_rng(case['seed'] + KEY_SEED_OFFSET).integers(choices, size=case['questions'])
+
+    return synthetic_quiz([[int(choice)] for choice in key], choices=choices,
+                          rows_per_column=case.get('rows_per_column', 25), sheet_name=case['name'],
+                          student_id_length=len(case.get('student_id') or ''), fiducials=case.get('fiducials', False))
+
+
+# the (image, answers) of a sheet of the corpus, the answers filled are only known for synthetic sheets
+def case_image(case, directory):
+    import cv2
+    from .synthetic import render_sheet
+
+    if 'image' in case:
+        return cv2.imread(os.path.join(directory, case['image'])), case.get('answers')
+
+    arguments = {name: case[name] for name in ('questions', 'choices', 'scale', 'noise', 'seed', 'rows_per_column',
+                                               'bubble', 'student_id', 'fiducials') if name in case}
+    return render_sheet(**arguments)
+
+
+# the choices detected for every question of a sheet, read back from the packed summary of its result
+def detected_answers(summary):
+    from .packing import PackedSummary
+
+    return PackedSummary.from_json(summary).answers()
+
+
+# the part of the output of the engine which is recorded for a sheet
+def sheet_outcome(ok, res):
+    if not ok:
+        return {'ok': False, 'error': res}
+
+    return {'ok': True, 'score': float(res['score']), 'total': float(res['total']),
+            'student_code': res['student_code'], 'answers': detected_answers(res['summary'])}
+
+
+# corrects the sheets of the corpus with the given engine: 'serial' corrects them one by one with an MCQCorrector
+# and 'batch' with a BatchCorrector of the given number of workers. Returns the outcomes of the sheets, the answers
+# filled on them (when known) and the seconds spent correcting them
+def correct_corpus(cases, directory, engine='serial', workers=None, ocr=False):
+    import cv2
+    from .engine import create_corrector, create_batch_corrector
+
+    with tempfile.TemporaryDirectory() as images_directory:
+        # the photos are written as jpeg files first, both engines read them from disk like in production
+        quizzes, paths, truths = [], [], []
+        for i, case in enumerate(cases):
+            image, answers = case_image(case, directory)
+            if image is None:
+                raise Exception('could not read the image of the sheet {}'.format(case['name']))
+
+            paths.append(os.path.join(images_directory, '{}.jpg'.format(i)))
+            cv2.imwrite(paths[-1], image)
+            quizzes.append(case_quiz(case))
+            truths.append(answers)
+
+        start = time.perf_counter()
+        if engine == 'batch':
+            corrector = create_batch_corrector(max_workers=workers, read_student_codes=ocr)
+            outputs = [sheet_outputs[0] for sheet_outputs in corrector.correct(
+                [(quiz, [path]) for quiz, path in zip(quizzes, paths)])]
+        else:
+            outputs = []
+            for quiz, path in zip(quizzes, paths):
+                try:
+                    outputs.append((True, create_corrector(quiz, read_student_code=ocr).correct_sheet(path)))
+                except Exception as err:
+                    outputs.append((False, str(err)))
+
+        seconds = time.perf_counter() - start
+
+    return [sheet_outcome(ok, res) for ok, res in outputs], truths, seconds
+
+
+# compares the outcome of a sheet with the recorded one, returns None when they are the same. Student codes are only
+# compared when both were read
+def compare_outcome(expected, actual):
+    if not expected['ok'] or not actual['ok']:
+        if expected['ok'] == actual['ok']:
+            return None
+
+        return {'status': 'now failing' if expected['ok'] else 'now corrected',
+                'error': actual.get('error', expected.get('error'))}
+
+    delta = {}
+    if actual['score'] != expected['score']:
+        delta['score_delta'] = actual['score'] - expected['score']
+
+    changed = [i for i, (a, b) in enumerate(zip(expected['answers'], actual['answers'])) if a != b]
+    if changed or len(expected['answers']) != len(actual['answers']):
+        delta['changed_questions'] = changed
+
+    if expected['student_code'] and actual['student_code'] and expected['student_code'] != actual['student_code']:
+        delta['student_code'] = [expected['student_code'], actual['student_code']]
+
+    if not delta:
+        return None
+
+    delta['status'] = 'changed'
+    return delta
+
+
+# number of questions whose detected answers are the ones filled, and number of questions checked
+def truth_accuracy(outcome, answers):
+    if answers is None:
+        return 0, 0
+
+    if not outcome['ok']:
+        return 0, len(answers)
+
+    return sum(a == b for a, b in zip(outcome['answers'], answers)), len(answers)
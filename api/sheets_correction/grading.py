@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+Vectorized grading of the answers detected on the sheets.
+
+The answer key of a quiz is compiled once into dense arrays, grading a matrix of detected answers is then a handful of
+array operations. Every function accepts a single (questions, choices) matrix of answers as well as a stacked batch of
+shape (students, questions, choices).
+"""
+import numpy as np
+from .packing import PackedSummary
+
+
+class AnswerKey:
+    def __init__(self, correct, weights, totals, allocation, fail_mark):
+        self.correct = correct  # (questions, choices) boolean mask of the correct choices
+        self.weights = weights  # (questions, choices) percentage of the points given by each correct choice
+        self.totals = totals  # (questions,) total percentage distributed for each question
+        self.allocation = allocation  # (questions,) marks allocated to each question
+        self.fail_mark = fail_mark
+
+    @property
+    def questions(self):
+        return self.correct.shape[0]
+
+    @property
+    def choices(self):
+        return self.correct.shape[1]
+
+    @property
+    def total(self):
+        return float(np.sum(self.allocation))
+
+
+# builds the answer key arrays from the parsed quiz fields
+# int_answers: [[0, 1], [2]], distribution: [{'0': '30', '1': '70'}, {'2': '100'}], allocation: ['2', '1']
+def compile_answer_key(int_answers, distribution, allocation, fail_mark, questions, choices):
+    if len(int_answers) < questions or len(distribution) < questions or len(allocation) < questions:
+        raise ValueError('the answer key does not cover the {} questions of the sheet'.format(questions))
+
+    correct = np.zeros((questions, choices), dtype=bool)
+    weights = np.zeros((questions, choices), dtype=np.float64)
+    totals = np.zeros(questions, dtype=np.float64)
+
+    for i in range(questions):
+        correct[i, [ans for ans in int_answers[i] if ans < choices]] = True
+
+        # the percentages of all the distributed answers make the total of the question, but only correct choices
+        # can earn points
+        for ans, percentage in distribution[i].items():
+            totals[i] += float(percentage)
+            if int(ans) < choices and correct[i, int(ans)]:
+                weights[i, int(ans)] = float(percentage)
+
+    allocation = np.array([float(mk) for mk in allocation[:questions]])
+
+    return AnswerKey(correct, weights, totals, allocation, float(fail_mark))
+
+
+class Grades:
+    def __init__(self, marks, percentage_pass, correct_choices, wrong_choices):
+        self.marks = marks  # (..., questions) marks obtained for each question
+        self.percentage_pass = percentage_pass  # (..., questions) percentage of the question's points obtained
+        self.correct_choices = correct_choices  # (..., questions, choices) chosen answers which are correct
+        self.wrong_choices = wrong_choices  # (..., questions, choices) chosen answers which are wrong
+        self.scores = marks.sum(axis=-1)
+
+    # per question summary of one student of a batch (or of the single sheet graded when student is None), labels
+    # are the labels of the choices e.g {0: {'correct_choices': ['A'], 'wrong_choices': [], 'percentage_pass': 100.0,
+    # 'mark': 2.0}, ...}
+    def summary(self, labels, student=None):
+        index = () if student is None else (student,)
+        marks = self.marks[index].tolist()
+        percentage_pass = self.percentage_pass[index].tolist()
+        correct_choices = self.correct_choices[index]
+        wrong_choices = self.wrong_choices[index]
+
+        return {
+            i: {
+                'correct_choices': [labels[j] for j in np.flatnonzero(correct_choices[i])],
+                'wrong_choices': [labels[j] for j in np.flatnonzero(wrong_choices[i])],
+                'percentage_pass': percentage_pass[i],
+                'mark': marks[i]
+            }
+            for i in range(len(marks))
+        }
+
+    # the summary of one student of a batch (or of the single sheet graded when student is None) in the compact form
+    # of packing.PackedSummary
+    def packed_summary(self, student=None):
+        index = () if student is None else (student,)
+        correct_choices = self.correct_choices[index]
+        bits = 1 << np.arange(correct_choices.shape[-1], dtype=np.int64)
+
+        return PackedSummary(correct_choices.shape[-1], ((correct_choices | self.wrong_choices[index]) @ bits).tolist(),
+                             (correct_choices @ bits).tolist(), self.marks[index].tolist(),
+                             self.percentage_pass[index].tolist())
+
+
+# summaries of the students of a batch, each one is only built the first time it is read
+class LazySummaries:
+    def __init__(self, grades: Grades, labels):
+        self.grades = grades
+        self.labels = labels
+        self._summaries = {}
+
+    def __len__(self):
+        return self.grades.marks.shape[0]
+
+    def __getitem__(self, student):
+        if not -len(self) <= student < len(self):
+            raise IndexError('there are {} students in the batch'.format(len(self)))
+
+        student %= len(self)
+        if student not in self._summaries:
+            self._summaries[student] = self.grades.summary(self.labels, student)
+
+        return self._summaries[student]
+
+    def __iter__(self):
+        return (self[student] for student in range(len(self)))
+
+
+# grades boolean matrices of chosen answers against the compiled answer key
+def grade(chosen, key: AnswerKey):
+    chosen = np.asarray(chosen, dtype=bool)
+    correct_choices = chosen & key.correct
+    wrong_choices = chosen & ~key.correct
+
+    # choices are read from left to right and a wrong choice cancels the points of the correct choices before it,
+    # so only the correct choices after the last wrong one count
+    num_choices = chosen.shape[-1]
+    has_wrong = wrong_choices.any(axis=-1)
+    last_wrong = np.where(has_wrong, num_choices - 1 - np.argmax(wrong_choices[..., ::-1], axis=-1), -1)
+    counted = correct_choices & (np.arange(num_choices) > last_wrong[..., None])
+
+    # if at least one correct answer counts, the question gets the fraction of its marks given by the distribution
+    # of the counted answers, else the fail mark is subtracted
+    points_percentage = (counted * key.weights).sum(axis=-1)
+    passed = points_percentage > 0
+    points_frac = np.divide(points_percentage, key.totals, out=np.zeros_like(points_percentage), where=passed)
+
+    marks = np.where(passed, points_frac * key.allocation, 0.0 - key.fail_mark)
+    percentage_pass = np.where(passed, points_frac * 100, 0.0)
+
+    return Grades(marks, percentage_pass, correct_choices, wrong_choices)
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+Layout templates of the sheets of a quiz.
+
+Every sheet of a quiz is printed with the same layout, so once the boxes of one sheet have been found by the contour
+search their corners are remembered relative to the page, i.e the top-down view given by scansheet.registerPage. A box
+of a later sheet is then located by scaling its remembered corners to the size of its page, without searching the
+contours again.
+"""
+import cv2
+import numpy as np
+
+# smallest share of the photo the page may cover, and of the page a box may cover, when a template is learned
+MIN_PAGE_AREA = 0.2
+MIN_BOX_AREA = 0.005
+
+# largest relative difference between the heights of the answer columns of a learned template
+MAX_COLUMN_HEIGHT_SPREAD = 0.1
+
+
+class LayoutTemplate:
+    def __init__(self, boxes):
+        # box name => (4, 2) corners in the order of utils.reorder, as fractions of the page width and height
+        self.boxes = boxes
+        self._matrices = {}  # (box name, width, height) => perspective transform from the unit page to the box
+
+    # builds the template from the (reordered) corners of the boxes found on a scanned sheet of the given shape
+    @classmethod
+    def learn(cls, page_shape, boxes):
+        height, width = page_shape[:2]
+        return cls({name: np.asarray(corners, dtype=np.float64).reshape(4, 2) / [width, height]
+                    for name, corners in boxes.items()})
+
+    # corners of every box on a scanned sheet of the given shape
+    def locate(self, page_shape):
+        height, width = page_shape[:2]
+        return {name: np.rint(corners * [width, height]).astype(np.int32).reshape(4, 1, 2)
+                for name, corners in self.boxes.items()}
+
+    # perspective transform from a page of the given (width, height) to the bird's eye view (width x height) of a box.
+    # The transform of the unit page is the same for every sheet, it is only computed once
+    def region_matrix(self, name, page_size, width, height):
+        key = (name, width, height)
+        if key not in self._matrices:
+            self._matrices[key] = cv2.getPerspectiveTransform(np.float32(self.boxes[name]), np.float32(
+                [[0, 0], [width, 0], [0, height], [width, height]]))
+
+        return self._matrices[key] @ np.diag([1 / page_size[0], 1 / page_size[1], 1.0])
+
+    def to_json(self):
+        return {'boxes': {name: corners.tolist() for name, corners in self.boxes.items()}}
+
+    @classmethod
+    def from_json(cls, data):
+        return cls({name: np.asarray(corners, dtype=np.float64) for name, corners in data['boxes'].items()})
+
+
+# area of a quadrilateral whose corners are in the order of utils.reorder, 0 when they do not make a convex one
+def _convex_area(corners):
+    polygon = np.float32(corners).reshape(4, 2)[[0, 1, 3, 2]]
+    if not cv2.isContourConvex(polygon):
+        return 0.0
+
+    return float(cv2.contourArea(polygon))
+
+
+# whether the page was found cleanly on a photo of the given shape: a convex quadrilateral covering a good part of it.
+# corners are in the order of utils.reorder
+def clean_page(image_shape, corners):
+    height, width = image_shape[:2]
+    return _convex_area(corners) >= MIN_PAGE_AREA * width * height
+
+
+# whether the boxes found on a page of the given shape look like the layout of the sheet, so that a template can be
+# learned from them: every box is a convex quadrilateral inside the page, the answer columns have the same height and
+# no two boxes overlap. The corners of the boxes are in the order of utils.reorder
+def clean_layout(page_shape, boxes):
+    height, width = page_shape[:2]
+    corners = {name: np.float32(box).reshape(-1, 2) for name, box in boxes.items()}
+
+    for box in corners.values():
+        if len(box) != 4 or _convex_area(box) < MIN_BOX_AREA * width * height:
+            return False
+
+        margin = 0.02 * np.array([width, height])
+        if (box < -margin).any() or (box > [width, height] + margin).any():
+            return False
+
+    column_heights = [np.ptp(box[:, 1]) for name, box in corners.items() if name.startswith('column_')]
+    if column_heights and max(column_heights) - min(column_heights) > MAX_COLUMN_HEIGHT_SPREAD * max(column_heights):
+        return False
+
+    polygons = [box[[0, 1, 3, 2]] for box in corners.values()]
+    for i, first in enumerate(polygons):
+        for second in polygons[i + 1:]:
+            overlap, _ = cv2.intersectConvexConvex(first, second)
+            if overlap > 0.01 * min(cv2.contourArea(first), cv2.contourArea(second)):
+                return False
+
+    return True
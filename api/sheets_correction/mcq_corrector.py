@@ -6,26 +6,59 @@ Created on Wed Feb 24 12:21:44 2021
 """
 
 import cv2
-import imutils
 import numpy as np
 from .utils import *
+from .grading import compile_answer_key, grade, LazySummaries
+from .answer_keys import answer_keys
 from api.models import Quiz
-import pytesseract
-from .scansheet import scanSheet
+from . import ocr
+from .scansheet import findRegistrationCorners, scanSheet
+from .transform import page_transform
+from .threshold import binarize, ink_mask, scaled_block_size
+from .layout import LayoutTemplate, clean_layout, clean_page
+from .tracing import SheetTrace, trace_stage
+import logging
 import os
 
+logger = logging.getLogger(__name__)
+
+# the boxes of a sheet are searched on a view of its page no taller than this. findBoxCorners searches them on a
+# pyrDown level of it, which also smooths the edges of the thresholded page
+DETECTION_HEIGHT = 1400
+
+# share of a cell which must be filled for its bubble to be shaded when it cannot be calibrated on the sheet. It is
+# the pixel threshold (4520 / 3) which was tuned for the 175x36 cells of the 700x900 warp
+FILL_RATIO = (4520 / 3) / (175 * 36)
+
 
 class MCQCorrector:
     def __init__(
             self,
             sheet_instance: Quiz,
-            image_width=700,
-            image_height=900, ):
+            image_width=280,
+            image_height=360,
+            debug_dir=None,
+            answer_key=None,
+            read_student_code=True,
+            trace=False, ):
         self.sheet_instance = sheet_instance
+        # size of the bird's eye view of a full answer column, the answers are detected from fill ratios so it is
+        # only as large as needed to count the pixels of the bubbles reliably
         self.image_width = image_width
         self.image_height = image_height
+        self.debug_dir = debug_dir  # when set, the intermediate images of each sheet are saved in this directory
         self.correction_index = 0  # represents the number of sheets which have been corrected
 
+        self._answer_key = answer_key  # compiled answer key of the current sheet, see answer_key()
+        self._layout_template = None  # see layout_template()
+
+        # when False the student code is not read, the crop of the code box is returned as 'code_image' instead so
+        # that the codes of many sheets can be read together (see ocr.OCRService)
+        self.read_student_code = read_student_code
+
+        # when True every stage of the correction of a sheet is timed, the stages are returned with its result
+        self.trace = trace
+
         self.correspondence_dict = {'A': 0, 'B': 1, 'C': 2, 'D': 3, 'E': 4, 'i': 0, 'ii': 1, 'iii': 2, 'iv': 3, 'v': 4,
                                     '1': 0, '2': 3, '3': 2, '4': 3, '5': 4}
 
@@ -33,6 +66,8 @@ class MCQCorrector:
     def set_sheet(self, sheet: Quiz):
         self.sheet_instance = sheet
         self.correction_index = 0
+        self._answer_key = None
+        self._layout_template = None
 
     def get_int_answer_values(self):
 
@@ -64,328 +99,272 @@ class MCQCorrector:
 
         return final_distribution  # sample result [{'1': '70', '0': '30'}, {'0': '100'}]
 
-    def get_answer_label_from_number(self, number):
-        choice_label = self.sheet_instance.choiceLabels
-        if choice_label == "A-B-C":
-            return 'ABCDE'[number]
-        elif choice_label == 'i-ii-iii':
-            return ['i', 'ii', 'iii', 'iv', 'v'][number]
-        else:
-            return '12345'[number]
-
-    def correct_sheet(self, image_path):
-
-        self.correction_index += 1
-
-        # we determine if the sheet has two parts according to the number of questions
-        questions = int(self.sheet_instance.questions)
-
-        if (questions - 25) > 0:
-            is_two_parts = True
-        else:
-            is_two_parts = False
-
-        # we determine the number of rows and columns in each part of the sheet body
-        if questions <= 25:
-            body_rows_1 = questions
-        else:
-            body_rows_1 = 25
-            body_rows_2 = questions - 25
-
-        num_choices = int(self.sheet_instance.choices)
-        body_cols_1 = num_choices
-        body_cols_2 = num_choices
-
-        # we convert the answer choices to numerical values
-        correct_answers = self.get_int_answer_values()
-        # we set questions correct answers
-        if is_two_parts:
-            answers1 = correct_answers[0:25]
-            answers2 = correct_answers[25:]
-        else:
-            answers1 = correct_answers
-
-        # read the image from the given path
-        img = cv2.imread(image_path)
-
-        # we scan the image to get only the sheet
-        imname = self.sheet_instance.sheet_name+str(self.correction_index)
-        scanSheet(img, imname)
-
-        abs_path = os.path.abspath('.')
-        if os.path.exists(os.path.join(abs_path, imname+'.jpg')):
-            print("path exists!===>")
-
-            img = cv2.imread(rf"{os.path.join(abs_path, imname+'.jpg')}")
-            os.unlink(os.path.join(abs_path, imname+'.jpg'))
-        else:
-            raise Exception("path to scanned image does not exist!")
-
-        # resize the image
-        # img = cv2.resize(img, (self.image_width, self.image_height))
-
-        img_contours = img.copy()
-        # image with required contours
-        cont_image = img.copy()
-
-        # Image pre-processing ##########################################
-
-        # convert image to grayscale
-        # img_gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-
-        # add gaussian blur to grayscale image
-        # img_blur = cv2.GaussianBlur(img_gray, (5, 5), 1)
+    # the answer key, mark allocations and mark distributions of the sheet are parsed into arrays used for grading
+    def compile_answer_key(self):
+        return compile_answer_key(self.get_int_answer_values(), self.extract_mark_distribution(),
+                                  self.sheet_instance.marksAllocation, self.sheet_instance.failMark,
+                                  int(self.sheet_instance.questions), int(self.sheet_instance.choices))
 
-        # edge detection
-        img_canny = cv2.Canny(img, 10, 50)
+    # compiled keys are shared by all the correctors of the process, so a quiz is only parsed again when it changes
+    def answer_key(self):
+        if self._answer_key is None:
+            self._answer_key = answer_keys.get(self.sheet_instance, self.compile_answer_key)
 
+        return self._answer_key
 
-        # ############################################################
+    # the layout template of the sheet when it uses one and it was learned, see layout.LayoutTemplate
+    def layout_template(self):
+        if not self.sheet_instance.use_layout_template:
+            return None
 
-        # We find the contours on the image
-        contours, hierachy = cv2.findContours(img_canny, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        cv2.drawContours(img_contours, contours, -1, (0, 255, 0), 2)  # draw contours on image
+        if self._layout_template is None and self.sheet_instance.layout_template:
+            self._layout_template = LayoutTemplate.from_json(self.sheet_instance.layout_template)
 
-        # We obtain all the rectangular contours and get the largest which represents the largest rectangle on our paper
-        rect_con = rectContours(contours)
+        return self._layout_template
 
-        # if our sheet has two parts, then the second biggest rectangle is our answers rectangle
-        # and the third biggest is the sheet code rectangle
-
-        if is_two_parts:
-            biggest_contour = getCornerPoints(rect_con[1])  # left-most big rectangle
-            biggest_contour2 = getCornerPoints(rect_con[0])  # right-most big rectangle
-            # student_name = getCornerPoints(rect_con[2])
-            # registration_number = getCornerPoints(rect_con[3], epsilon=0.034)
-            student_code = getCornerPoints(rect_con[2])
-
-        else:
-            biggest_contour2 = None
-            biggest_contour = getCornerPoints(rect_con[0])  # left-most big rectangle
-            # student_name = getCornerPoints(rect_con[1])
-            # registration_number = getCornerPoints(rect_con[2])
-            student_code = getCornerPoints(rect_con[1])
-
-        # we now show the draw those two biggest contours on our image
-
-        if biggest_contour.size != 0 and student_code.size != 0:
-
-            cv2.drawContours(cont_image, [biggest_contour], -1, (255, 0, 0), 8)
-            if biggest_contour2 is not None:
-                cv2.drawContours(cont_image, [biggest_contour2], -1, (0, 255, 255), 6)
-
-            cv2.drawContours(cont_image, [student_code], -1, (0, 255, 255), 5)
-            # cv2.imshow("Scanned", imutils.resize(cont_image, height=650))
-            # cv2.waitKey(0)
-
-            # we reorder the points of the big rectangles and the code and student name rectangles
-            biggest_contour = reorder(biggest_contour)
-            if biggest_contour2 is not None:
-                biggest_contour2 = reorder(biggest_contour2)
-            # student_name = reorder(student_name)
-            # print("reg number shape:{}".format(registration_number.shape))
-
-            # registration_number = reorder(registration_number)
-            student_code = reorder(student_code)
-
-            # we apply a warpPerspective to get a bird's eye view of the specific contours we need
-            # we do this by getting the transformation matrix as below
-
-            warp_image_colored = get_warped_image(img, biggest_contour, self.image_width, self.image_height)
-
-            if biggest_contour2 is not None:
-                warp_image_colored2 = get_warped_image(img, biggest_contour2, self.image_width, self.image_height)
-
-            # We now apply Threshold to the warped images
-
-            # # for first big rectangle
-            # warp_image_gray =cv2.cvtColor(warp_image_colored, cv2.COLOR_BGR2GRAY)
-            img_thresh = cv2.threshold(warp_image_colored, 200, 255, cv2.THRESH_BINARY_INV)[1]
-
-            cv2.imshow("Scanned", imutils.resize(img_thresh, height=650))
-            cv2.waitKey(0)
-
-            # for second big rectangle
-            if biggest_contour2 is not None:
-                # warp_image_gray2 = cv2.cvtColor(warp_image_colored2, cv2.COLOR_BGR2GRAY)
-                img_thresh2 = cv2.threshold(warp_image_colored2, 200, 255, cv2.THRESH_BINARY_INV)[1]
+    # the answers are printed in columns of rows_per_column questions from left to right, this returns the number of
+    # questions of each column e.g [25, 25, 10] for 60 questions
+    def get_column_rows(self):
+        questions = int(self.sheet_instance.questions)
+        rows_per_column = int(self.sheet_instance.rows_per_column)
 
-            # we split the two biggest rectangles into individual bubbles
-            boxes1 = splitBoxes(img_thresh, rows=body_rows_1, cols=body_cols_1)
+        return [min(rows_per_column, questions - start) for start in range(0, questions, rows_per_column)]
 
-            if biggest_contour2 is not None:
-                boxes2 = splitBoxes(img_thresh2, rows=body_rows_2, cols=body_cols_2)
+    # searches the boxes of a scanned sheet, the names are those of the layout templates:
+    # column_0, column_1... for the answer columns from left to right and code for the student code box
+    def find_boxes(self, img, columns):
+        # We obtain the corners of the largest rectangular contours, the largest represents the largest rectangle on our
+        # paper. They are searched on a downscaled copy of the sheet, only the warps read the full resolution sheet
+        rect_con = findBoxCorners(img, columns + 1)
 
-            # we then count non-zero pixels for each bubble and arrange the bubbles in a 2-dimensional array
-            # each sub array corresponds to one row of the answer sheet body
+        if len(rect_con) < columns + 1:
+            raise Exception("could not find the {} boxes of the sheet".format(columns + 1))
 
-            pixel_values = np.zeros((body_rows_1, body_cols_1), np.int32)
-            if biggest_contour2 is not None:
-                pixel_values2 = np.zeros((body_rows_2, body_cols_2), np.int32)
+        # the biggest rectangles are the answer columns, the next one is the sheet code rectangle
+        # student_name = rect_con[columns + 1]
+        # registration_number = rect_con[columns + 2]
+        answer_columns = sorted(rect_con[:columns], key=lambda corners: corners.reshape(-1, 2)[:, 0].mean())
 
-            count_c = 0
-            count_r = 0
+        boxes = {'column_{}'.format(i): corners for i, corners in enumerate(answer_columns)}
+        boxes['code'] = rect_con[columns]
+        return boxes
 
-            for box in boxes1:
+    def get_answer_label_from_number(self, number):
+        return self.sheet_instance.get_choice_label(number)
 
-                pixel_values[count_r][count_c] = np.count_nonzero(box)
+    def debug_image_path(self, sheet_number, suffix):
+        if self.debug_dir is None:
+            return None
 
-                count_c += 1
-                if count_c == body_cols_1:
-                    count_r += 1
-                    count_c = 0
+        os.makedirs(self.debug_dir, exist_ok=True)
+        return os.path.join(self.debug_dir, '{}{}{}.jpg'.format(self.sheet_instance.sheet_name, sheet_number, suffix))
 
-            count_c = 0
-            count_r = 0
+    # image is the path of the sheet image or the already decoded image
+    # sheet_number lets callers which correct sheets out of order (e.g. in parallel) keep the numbering of the batch
+    def correct_sheet(self, image, sheet_number=None):
 
-            if biggest_contour2 is not None:
-                for box in boxes2:
-
-                    pixel_values2[count_r][count_c] = np.count_nonzero(box)
-                    count_c += 1
-                    if count_c == body_cols_2:
-                        count_r += 1
-                        count_c = 0
-
-            # print(pixel_values)
-            # we find the box with the highest pixel value for each row(question) and store its index in an array
-
-            given_answers_indexes1 = []
-
-            # we set the pixel treshold value for correct shaded boxes
-            pixel_treshold = 4520  # TODO adjust threshold value later
-
-            # we pass through each row and check for the boxes with pixel values above a certain threshold
-            # (1800 in this case)
-            for row in pixel_values:
-                current_indexes = []
-                for i in range(0, len(row)):
-                    if row[i] >= pixel_treshold:
-                        current_indexes.append(i)
-                # given_index = np.where(row == np.amax(row))
-                given_answers_indexes1.append(current_indexes)
+        if sheet_number is None:
+            self.correction_index += 1
+            sheet_number = self.correction_index
 
-            # print("given indexes are ", str(given_answers_indexes1))
+        # we determine the number of rows of each answer column of the sheet body and its number of choices
+        questions = int(self.sheet_instance.questions)
+        column_rows = self.get_column_rows()
+        num_choices = int(self.sheet_instance.choices)
 
-            if biggest_contour2 is not None:
-                given_answers_indexes2 = []
+        # we compile the answer choices to numerical arrays
+        answer_key = self.answer_key()
 
-                for row in pixel_values2:
-                    current_indexes = []
-                    for i in range(0, len(row)):
-                        if row[i] >= pixel_treshold:
-                            current_indexes.append(i)
-                    # given_index = np.where(row == np.amax(row))
-                    given_answers_indexes2.append(current_indexes)
+        # when tracing, every stage of the pipeline is timed in the trace of the sheet, see tracing.py
+        trace = SheetTrace() if self.trace else None
 
-            # Now we grade the questions
-            # by comparing the givenAnswers indexes and the correct answers indexes defined above
-            # we equally assign mark according to mark allocation and mark distribution for each question
-            # for failed questions we subtract the fail_mark
+        # read the image from the given path
+        with trace_stage(trace, 'read') as stage:
+            if isinstance(image, str):
+                img = cv2.imread(image)
+            else:
+                img = image
+
+            stage.image = img
+
+        if img is None:
+            raise Exception("could not read the sheet image {}".format(image))
+
+        # we register the page of the sheet once, every region of interest is then extracted straight from the image
+        # with the perspective transform of the page composed with that of the region, so its pixels are resampled once
+        with trace_stage(trace, 'register', img):
+            page_corners, marked = findRegistrationCorners(img, fiducials=self.sheet_instance.fiducials)
+            registration = page_transform(page_corners)
+        page_matrix, page_size = registration
+        page_shape = (page_size[1], page_size[0])
+
+        # with a layout template the boxes are located from the page corners alone, without searching the contours.
+        # Else they are searched, and the first sheet corrected cleanly teaches the template of sheets which use one:
+        # its page was registered with the markers it is printed with (or a clean page contour) and all of its boxes
+        # look like the layout of the sheet
+        template = self.layout_template()
+        learned_template = None
+
+        # the boxes are searched on a thresholded view of the page no taller than DETECTION_HEIGHT, it is only scanned
+        # when they must be searched or for the debug images
+        page = None
+        with trace_stage(trace, 'detect') as stage:
+            if template is None or self.debug_dir is not None:
+                page = stage.image = scanSheet(img, self.debug_image_path(sheet_number, ''), registration=registration,
+                                               height=DETECTION_HEIGHT)
+
+            if template is not None:
+                boxes = template.locate(page_shape)
+                found = [corners[[0, 1, 3, 2]] for corners in template.locate(page.shape).values()] \
+                    if page is not None else []
+            else:
+                found = self.find_boxes(page, len(column_rows))
+
+                # the corners found on the detection page are brought back to the full size page
+                factor = page_shape[0] / page.shape[0]
+                boxes = {name: reorder(corners) * factor for name, corners in found.items()}
+                found = list(found.values())
+
+                registered = marked if self.sheet_instance.fiducials else clean_page(img.shape, reorder(page_corners))
+                if self.sheet_instance.use_layout_template and registered and clean_layout(page_shape, boxes):
+                    learned_template = LayoutTemplate.learn(page_shape, boxes)
+
+        # image with required contours, only drawn when debugging
+        if self.debug_dir is not None:
+            cont_image = cv2.cvtColor(page, cv2.COLOR_GRAY2BGR)
+            cv2.drawContours(cont_image, found, -1, (255, 0, 0), 4)
+            cv2.imwrite(self.debug_image_path(sheet_number, '_contours'), cont_image)
+
+        # perspective transform from the image to the bird's eye view (width x height) of a box
+        def box_matrix(name, width, height):
+            if template is not None:
+                return template.region_matrix(name, page_size, width, height) @ page_matrix
+
+            return region_matrix(boxes[name], width, height) @ page_matrix
+
+        # we apply a warpPerspective to get a bird's eye view of every answer column, the columns are warped
+        # below each other in one image where every question takes a row of the same height
+        cell_height = self.image_height // int(self.sheet_instance.rows_per_column)
+        with trace_stage(trace, 'warp') as stage:
+            matrices = [box_matrix('column_{}'.format(i), self.image_width, rows * cell_height)
+                        for i, rows in enumerate(column_rows)]
+            body = stage.image = warp_columns(img, matrices, column_rows, self.image_width, cell_height)
+
+        # We now threshold the warped columns, the block size of the local threshold follows the scale of the
+        # columns to the page
+        with trace_stage(trace, 'threshold', body):
+            scale = np.mean([region_scale(boxes['column_{}'.format(i)], rows * cell_height)
+                             for i, rows in enumerate(column_rows)])
+            body = ink_mask(body, scaled_block_size(scale), dst=body)
+
+        # we count the shaded pixels of every bubble of all the columns in one pass
+        # each row of the fill matrix corresponds to one row(question) of the answer sheet body
+        with trace_stage(trace, 'fill', body):
+            pixel_values = fill_matrix(body, rows=questions, cols=num_choices)
+
+        # the counts are turned into the share of each cell which is filled, so the detection does not depend on the
+        # size of the warp. The share above which a bubble is shaded is calibrated on the cells of the sheet
+        fill_ratio = fill_ratios(pixel_values, self.image_width // num_choices, cell_height)
+        fill_treshold = calibrate_fill_threshold(fill_ratio, default=FILL_RATIO)
+
+        # the boxes with fill ratios above the threshold are the answers given for each row(question)
+        given_answers = detect_answers(fill_ratio, fill_treshold)
+
+        # Now we grade the questions
+        # by comparing the given answers and the correct answers of the compiled answer key
+        # we equally assign mark according to mark allocation and mark distribution for each question
+        # for failed questions we subtract the fail_mark
+        with trace_stage(trace, 'grade'):
+            grades = grade(given_answers, answer_key)
+
+            # the summary is returned packed, see packing.PackedSummary, clients ask for the verbose one
+            result_summary = grades.packed_summary().to_json()
+
+        # we then find the total score of the student
+        score = grades.scores
+
+        logger.debug('final score of sheet %s of %s: %s', sheet_number, self.sheet_instance.sheet_name, score)
+
+        result = {
+            'student_code': '',
+            'score': score,
+            'total': answer_key.total,
+            'sheet_name': self.sheet_instance.sheet_name,
+            'summary': result_summary,
+            'sheet_number': sheet_number,
+        }
+
+        # the list of the stages of the trace, the stages still to come are recorded in it too
+        if trace is not None:
+            result['trace'] = trace.stages
+
+        # the template is only kept once a sheet was fully corrected with it, it is returned to be saved
+        if learned_template is not None:
+            self._layout_template = learned_template
+            result['layout_template'] = learned_template.to_json()
+
+        # sheets with a student id grid are read like the answers, without OCR
+        digits = int(self.sheet_instance.student_id_length)
+        if digits > 0:
+            cell_size = 40
+            with trace_stage(trace, 'student_id') as stage:
+                id_image = stage.image = warp_region(img, box_matrix('code', digits * cell_size, 10 * cell_size),
+                                                     digits * cell_size, 10 * cell_size)
+                id_scale = region_scale(boxes['code'], 10 * cell_size)
+                ink_mask(id_image, scaled_block_size(id_scale), dst=id_image)
+                result['student_code'] = self.read_student_id(id_image, cell_size)
+
+            return result
+
+        # we now read the student code
+        with trace_stage(trace, 'code') as stage:
+            code_image = stage.image = warp_region(img, box_matrix('code', 300, 100), 300, 100)
+            binarize(code_image, scaled_block_size(region_scale(boxes['code'], 100)), dst=code_image)
+
+        if not self.read_student_code:
+            result['code_image'] = code_image
+            return result
+
+        with trace_stage(trace, 'ocr', code_image):
+            student_code_text = self.image_matrix_to_string(code_image)
+        logger.debug('student code of sheet %s: %r', sheet_number, student_code_text)
 
-            mark_allocation = [float(mk) for mk in self.sheet_instance.marksAllocation]
-            mark_distribution = self.extract_mark_distribution()
-            fail_mark = float(self.sheet_instance.failMark)
-            result_summary = {}
+        result['student_code'] = ocr.clean_student_code(student_code_text)
+        return result
 
-            grading1 = []
+    # reads the student id grid from the ink of its bird's eye view, each digit is a column of 10 bubbles of cell_size
+    def read_student_id(self, id_ink, cell_size):
+        fills = fill_matrix(id_ink, rows=10, cols=int(self.sheet_instance.student_id_length))
 
-            for i in range(0, body_rows_1):
-                points_percentage = 0.0
-                result_summary[i] = {'correct_choices': [], 'wrong_choices': [], 'percentage_pass': 0.0, 'mark': 0.0}
-                # we evaluate the total % of the points for the given question which has been answered correctly
-                for ans in given_answers_indexes1[i]:
-                    if ans in answers1[i]:
-                        points_percentage += float(mark_distribution[i][str(ans)])
-                        result_summary[i]["correct_choices"].append(self.get_answer_label_from_number(ans))
-                    else:
-                        points_percentage = 0.0
-                        result_summary[i]["wrong_choices"].append(self.get_answer_label_from_number(ans))
-
-                # if atleast one correct answer is given, we calculate the points obtained by multiplying the fraction
-                # of points obtained by the mark allocated to that question, else we subtract the fail mark from the
-                # final grading
-                final_question_points = 0.0
-                if points_percentage > 0:
-                    points_total_percentage = 0.0
-                    for pc in mark_distribution[i].values():
-
-                        points_total_percentage += float(pc)
-
-                    points_frac = points_percentage / points_total_percentage
-                    final_question_points = points_frac * mark_allocation[i]
-                    result_summary[i]["percentage_pass"] = points_frac * 100
-
-                else:
-                    final_question_points -= fail_mark
-
-                result_summary[i]["mark"] = final_question_points
-                grading1.append(final_question_points)
-
-            # we repeat the same exercise for the second sheet body
-            if biggest_contour2 is not None:
-                grading2 = []
-
-                for i in range(0, body_rows_2):
-                    points_percentage = 0.0
-                    # we evaluate the total % of the points for the given question which has been answered correctly
-                    for ans in given_answers_indexes2[i]:
-                        if ans in answers2[i]:
-                            points_percentage += float(mark_distribution[25 + i][str(ans)])
-                            result_summary[25 + i]["correct_choices"].append(self.get_answer_label_from_number(ans))
-                        else:
-                            points_percentage = 0.0
-                            result_summary[25 + i]["wrong_choices"].append(self.get_answer_label_from_number(ans))
-
-                    final_question_points = 0.0
-                    if points_percentage > 0:
-                        points_total_percentage = 0.0
-                        for pc in mark_distribution[25 + i].values():
-                            points_total_percentage += float(pc)
-
-                        points_frac = points_percentage / points_total_percentage
-                        final_question_points = points_frac * mark_allocation[25 + i]
-                        result_summary[25 + i]["percentage_pass"] = points_frac * 100
-                    else:
-                        final_question_points -= fail_mark
-
-                    result_summary[25 + i]["mark"] = final_question_points
-
-                    grading2.append(final_question_points)
-
-            # we then find the total score of the student
-
-            if biggest_contour2 is not None:
-                score = sum(grading1) + sum(grading2)
+        # the digit bubbles take most of their cell while the borders of the box can fill a third of the cells along
+        # the edges, so a bubble is shaded when almost half of its cell is filled
+        id_treshold = 0.45 * cell_size * cell_size
 
-            else:
-                score = np.sum(grading1)
+        return decode_student_id(fills, id_treshold)
 
-            # we now read student name , registration number and code
-            # student_name_image = get_warped_image(img, student_name, 600, 100)
-            # reg_number_image = get_warped_image(img, registration_number, 600, 100)
-            code_image = get_warped_image(img, student_code, 300, 100)
+    # turns the grades of a sheet into the verbose per question summary, see Grades.summary
+    def build_result_summary(self, grades):
+        return grades.summary(self.choice_labels())
 
-            # student_name_text = self.image_matrix_to_string(student_name_image)
-            # reg_number_text = self.image_matrix_to_string(reg_number_image)
-            student_code_text = self.image_matrix_to_string(code_image)
-            print('student code:{}'.format(student_code_text))
+    # labels of the choices of the quiz, indexed by choice number
+    def choice_labels(self):
+        return [self.get_answer_label_from_number(i) for i in range(int(self.sheet_instance.choices))]
 
-            print("final score: ", score)
+    # grades the answers detected on many sheets of the quiz in one pass, chosen is a (students, questions, choices)
+    # boolean tensor. Returns the Grades of the batch (scores, marks, correct and wrong choices of every student) and
+    # their summaries, which are only built for the students whose summary is read
+    def grade_batch(self, chosen):
+        chosen = np.asarray(chosen, dtype=bool)
+        answer_key = self.answer_key()
 
-            return {
-                'student_code': ''.join([char for char in student_code_text if str.isalnum(char)]),
-                'score': score,
-                'total': np.sum(mark_allocation),
-                'sheet_name': self.sheet_instance.sheet_name,
-                'summary': result_summary,
-                'sheet_number': self.correction_index
-            }
+        if chosen.ndim != 3 or chosen.shape[1:] != (answer_key.questions, answer_key.choices):
+            raise ValueError('expected the answers of (students, {}, {}) sheets, got {}'.format(
+                answer_key.questions, answer_key.choices, chosen.shape))
 
-        return 'error'
+        grades = grade(chosen, answer_key)
+        return grades, LazySummaries(grades, self.choice_labels())
 
     @staticmethod
     def image_matrix_to_string(image_matrix):
-        custom_config = r'--oem 3 --psm 6'
         # im_rgb = cv2.cvtColor(image_matrix, cv2.COLOR_BGR2RGB)
-        return pytesseract.image_to_string(image_matrix, config=custom_config)
+        return ocr.image_to_string(image_matrix)
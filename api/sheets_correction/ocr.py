@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+OCR of the student codes printed on the sheets.
+
+pytesseract starts a new tesseract process for every image, which writes the image to a temporary file and loads the
+language data again each time. When tesserocr is installed, the engines below keep the tesseract C API initialised
+instead, so reading a code is only the recognition itself. Without tesserocr (or when its engine cannot start) we
+fall back to pytesseract.
+
+OCRService keeps a few warm engines in threads which read the crops put on its queue, so the codes of many sheets are
+read in batch while the next sheets are still being graded. tesserocr releases the GIL during recognition, the threads
+do run in parallel.
+"""
+from concurrent.futures import Future
+import numpy as np
+import os
+import pytesseract
+import queue
+import threading
+from .tracing import trace_stage
+
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+TESSERACT_CONFIG = r'--oem 3 --psm 6'
+
+
+class PytesseractEngine:
+    def recognize(self, image):
+        return pytesseract.image_to_string(image, config=TESSERACT_CONFIG)
+
+    def close(self):
+        pass
+
+
+class TesserocrEngine:
+    def __init__(self, lang='eng'):
+        # same page segmentation and engine modes as TESSERACT_CONFIG
+        self.api = tesserocr.PyTessBaseAPI(lang=lang, psm=tesserocr.PSM.SINGLE_BLOCK, oem=tesserocr.OEM.DEFAULT)
+
+    def recognize(self, image):
+        # the pixels are handed over directly, without encoding the image
+        image = np.ascontiguousarray(image, dtype=np.uint8)
+        height, width = image.shape[:2]
+        channels = image.shape[2] if image.ndim == 3 else 1
+        self.api.SetImageBytes(image.tobytes(), width, height, channels, width * channels)
+        return self.api.GetUTF8Text()
+
+    def close(self):
+        self.api.End()
+
+
+def create_engine():
+    if tesserocr is not None:
+        try:
+            return TesserocrEngine()
+        except RuntimeError:
+            # e.g. the language data could not be found
+            pass
+
+    return PytesseractEngine()
+
+
+# a warm engine may fail on an image tesseract itself reads, the image is then read the slow way
+def recognize(engine, image):
+    try:
+        return engine.recognize(image)
+
+    except Exception:
+        if isinstance(engine, PytesseractEngine):
+            raise
+
+        return PytesseractEngine().recognize(image)
+
+
+# the codes only hold letters and digits, anything else is noise from the box borders
+def clean_student_code(text):
+    return ''.join([char for char in text if str.isalnum(char)])
+
+
+_local = threading.local()
+
+
+# reads one image with the warm engine of the calling thread
+def image_to_string(image):
+    engine = getattr(_local, 'engine', None)
+    if engine is None:
+        engine = _local.engine = create_engine()
+
+    return recognize(engine, image)
+
+
+class OCRService:
+    def __init__(self, engines=1):
+        self.engines = engines  # number of warm engines, each one is used by its own thread
+        self._requests = queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            while len(self._threads) < self.engines:
+                thread = threading.Thread(target=self._serve, name='ocr-{}'.format(len(self._threads)), daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def close(self):
+        with self._lock:
+            for thread in self._threads:
+                self._requests.put(None)
+
+            for thread in self._threads:
+                thread.join()
+
+            self._threads = []
+
+    # queues an image and returns the future of its text. The recognition is recorded in the given trace if any
+    def submit(self, image, trace=None):
+        if len(self._threads) < self.engines:
+            self.start()
+
+        future = Future()
+        self._requests.put((image, future, trace))
+        return future
+
+    def recognize_batch(self, images):
+        futures = [self.submit(image) for image in images]
+        return [future.result() for future in futures]
+
+    def _serve(self):
+        engine = create_engine()
+
+        try:
+            while True:
+                request = self._requests.get()
+                if request is None:
+                    break
+
+                image, future, trace = request
+                if not future.set_running_or_notify_cancel():
+                    continue
+
+                try:
+                    with trace_stage(trace, 'ocr', image):
+                        text = recognize(engine, image)
+
+                    future.set_result(text)
+                except Exception as err:
+                    future.set_exception(err)
+
+        finally:
+            engine.close()
+
+
+_service = None
+_service_pid = None
+_service_lock = threading.Lock()
+
+
+# OCR service of the process. Threads do not survive a fork, a forked process gets a service of its own
+def get_ocr_service():
+    global _service, _service_pid
+
+    with _service_lock:
+        if _service is None or _service_pid != os.getpid():
+            from django.conf import settings
+
+            _service = OCRService(engines=getattr(settings, 'CORRECTION_OCR_ENGINES', None) or 1)
+            _service_pid = os.getpid()
+
+        return _service
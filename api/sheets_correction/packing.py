@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+Compact form of the per question summary of a corrected sheet.
+
+For every question the summary keeps the bitmask of the chosen choices and the bitmask of the chosen choices which are
+correct (bit j is choice j), the wrong choices being the chosen ones which are not correct, plus the mark and the
+percentage of the question's points obtained as float32. The binary form is
+
+    version (uint8) | questions (uint16) | choices (uint8)
+    | chosen masks | correct masks (ceil(choices / 8) bytes per question each)
+    | marks | percentages (float32 per question), little endian
+
+and the packed JSON form, returned to clients and stored with the results, is that binary form encoded in base64: a
+50 question sheet takes about 680 characters instead of the 5 kilobytes of the verbose summary. The verbose form, with
+the labels of the choices, is only built by expand(). The module only needs the standard library, so the web processes
+read packed summaries without loading the correction engine.
+"""
+from array import array
+import base64
+import struct
+import sys
+
+VERSION = 1
+
+HEADER = struct.Struct('<BHB')
+
+
+def mask_size(choices):
+    return (choices + 7) // 8
+
+
+# rounds a float32 value to the shortest decimal which reads back as the same float32, e.g 1.6 instead of
+# 1.600000023841858
+def float32_value(value):
+    return float('{:.7g}'.format(value))
+
+
+class PackedSummary:
+    def __init__(self, choices, chosen, correct, marks, percentage_pass):
+        self.choices = choices
+        self.chosen = list(chosen)  # (questions,) bitmasks of the chosen choices
+        self.correct = list(correct)  # (questions,) bitmasks of the chosen choices which are correct
+        self.marks = array('f', marks)
+        self.percentage_pass = array('f', percentage_pass)
+
+    @property
+    def questions(self):
+        return len(self.chosen)
+
+    # bitmasks of the chosen choices which are wrong
+    @property
+    def wrong(self):
+        return [chosen & ~correct for chosen, correct in zip(self.chosen, self.correct)]
+
+    # the list of the choices chosen for every question
+    def answers(self):
+        return [[j for j in range(self.choices) if mask >> j & 1] for mask in self.chosen]
+
+    def to_bytes(self):
+        size = mask_size(self.choices)
+        marks, percentage_pass = array('f', self.marks), array('f', self.percentage_pass)
+        if sys.byteorder != 'little':
+            marks.byteswap()
+            percentage_pass.byteswap()
+
+        return b''.join([
+            HEADER.pack(VERSION, self.questions, self.choices),
+            b''.join(mask.to_bytes(size, 'little') for mask in self.chosen),
+            b''.join(mask.to_bytes(size, 'little') for mask in self.correct),
+            marks.tobytes(),
+            percentage_pass.tobytes(),
+        ])
+
+    @classmethod
+    def from_bytes(cls, data):
+        version, questions, choices = HEADER.unpack_from(data)
+        if version != VERSION:
+            raise ValueError('unknown version {} of packed summary'.format(version))
+
+        size = mask_size(choices)
+        offset = HEADER.size
+        if len(data) != offset + questions * (2 * size + 8):
+            raise ValueError('the packed summary of {} questions is truncated'.format(questions))
+
+        masks = [int.from_bytes(data[start:start + size], 'little')
+                 for start in range(offset, offset + 2 * questions * size, size)]
+        offset += 2 * questions * size
+
+        floats = array('f')
+        floats.frombytes(data[offset:])
+        if sys.byteorder != 'little':
+            floats.byteswap()
+
+        return cls(choices, masks[:questions], masks[questions:], floats[:questions], floats[questions:])
+
+    def to_json(self):
+        return base64.b64encode(self.to_bytes()).decode('ascii')
+
+    @classmethod
+    def from_json(cls, packed):
+        return cls.from_bytes(base64.b64decode(packed))
+
+    # the verbose summary, labels are the labels of the choices e.g {0: {'correct_choices': ['A'], 'wrong_choices': [],
+    # 'percentage_pass': 100.0, 'mark': 2.0}, ...}
+    def expand(self, labels):
+        return {
+            i: {
+                'correct_choices': [labels[j] for j in range(self.choices) if correct >> j & 1],
+                'wrong_choices': [labels[j] for j in range(self.choices) if wrong >> j & 1],
+                'percentage_pass': float32_value(percentage_pass),
+                'mark': float32_value(mark)
+            }
+            for i, (correct, wrong, percentage_pass, mark) in enumerate(zip(self.correct, self.wrong,
+                                                                            self.percentage_pass, self.marks))
+        }
@@ -0,0 +1,229 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from .ocr import get_ocr_service, clean_student_code
+from .tracing import SheetTrace
+from . import engine
+import hashlib
+import multiprocessing
+import os
+import pickle
+import threading
+
+# correctors living in a process, keyed by the hash of the quiz snapshot they were built from. They are kept between
+# the batches, so a worker only builds (and warms up) the corrector of a quiz once until the quiz changes
+_worker_correctors = {}
+
+# most correctors kept by a process and most quiz snapshots kept for the workers of a pool, the oldest are dropped first
+MAX_CORRECTORS = 32
+
+# (snapshot, answer_key) of the quizzes keyed by the hash of their snapshot, the workers build their correctors from
+# them. Each snapshot is stored once per quiz, the images are sent to the workers with its key only. In the workers of
+# a pool this is the dict shared by the pool (see get_pool), else the correctors are built in this process
+_snapshots = {}
+
+# process pools of the process keyed by their size, with the dict of snapshots shared by their workers. They live as
+# long as the process so that the batches never pay for starting the pool workers and loading the engine in them
+_pools = {}
+_pools_pid = None
+_pools_lock = threading.Lock()
+
+
+def quiz_snapshot(quiz):
+    # plain field values can be unpickled in a worker before django is set up, unlike model instances
+    return {field.attname: getattr(quiz, field.attname) for field in quiz._meta.concrete_fields}
+
+
+def _snapshot_batch(quiz):
+    # the answer key is compiled (or taken from the cache) here once, workers never parse it again. A key which
+    # cannot be compiled is left to the workers so that it fails each image of the quiz like any other error
+    try:
+        answer_key = engine.create_corrector(quiz).answer_key()
+    except Exception:
+        answer_key = None
+
+    snapshot = quiz_snapshot(quiz)
+    return hashlib.sha1(pickle.dumps(snapshot)).hexdigest(), snapshot, answer_key
+
+
+def _setup_django():
+    from django.apps import apps
+    if not apps.ready:
+        import django
+        django.setup()
+
+
+def _worker_corrector(key, trace):
+    corrector = _worker_correctors.pop((key, trace), None)
+    if corrector is None:
+        from django.conf import settings
+        from api.models import Quiz
+
+        # the snapshot is only fetched the first time the process sees the quiz
+        snapshot, answer_key = _snapshots[key]
+
+        # the student codes are read by the OCR service of the parent, see BatchCorrector.read_student_codes
+        corrector = engine.create_corrector(Quiz(**snapshot), answer_key=answer_key,
+                                            debug_dir=getattr(settings, 'CORRECTION_DEBUG_DIR', None),
+                                            read_student_code=False, trace=trace)
+
+    # the correctors are kept from the least to the most recently used
+    _worker_correctors[(key, trace)] = corrector
+    while len(_worker_correctors) > MAX_CORRECTORS:
+        del _worker_correctors[next(iter(_worker_correctors))]
+
+    return corrector
+
+
+def _init_pool_worker(snapshots):
+    global _snapshots
+    _snapshots = snapshots
+
+    # the pool already keeps every core busy, opencv's own threads would only compete with the other workers
+    import cv2
+    cv2.setNumThreads(1)
+
+    _setup_django()
+    engine.preload()
+
+
+# (pool, snapshots) of the given size of the process, a forked process gets pools of its own. The snapshots are a dict
+# of a multiprocessing manager given to the workers of the pool when they start
+def get_pool(workers):
+    global _pools_pid
+
+    with _pools_lock:
+        if _pools_pid != os.getpid():
+            _pools.clear()
+            _pools_pid = os.getpid()
+
+        if workers not in _pools:
+            manager = multiprocessing.Manager()
+            snapshots = manager.dict()
+            pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_pool_worker, initargs=(snapshots,))
+            _pools[workers] = (pool, snapshots, manager)
+
+        return _pools[workers][:2]
+
+
+# a pool whose worker died cannot run anything anymore, the next batch starts a new one
+def discard_pool(pool):
+    managers = []
+    with _pools_lock:
+        for workers, (existing, snapshots, manager) in list(_pools.items()):
+            if existing is pool:
+                del _pools[workers]
+                managers.append(manager)
+
+    pool.shutdown(wait=False)
+    for manager in managers:
+        manager.shutdown()
+
+
+# stores the snapshots of the batches which are not stored yet. The oldest snapshots are dropped, except those of the
+# batches which are about to be corrected
+def share_snapshots(snapshots, batches):
+    keys = [key for key, snapshot, answer_key in batches]
+    for key, snapshot, answer_key in batches:
+        if key not in snapshots:
+            snapshots[key] = (snapshot, answer_key)
+
+    stored = list(snapshots.keys())
+    for key in stored[:max(0, len(stored) - MAX_CORRECTORS)]:
+        if key not in keys:
+            del snapshots[key]
+
+
+# runs in the worker, errors are returned instead of raised so one bad image never affects the others. key is the key
+# of the snapshot of the quiz of the image, see share_snapshots
+def _correct_one(key, trace, image_path, sheet_number):
+    try:
+        return True, _worker_corrector(key, trace).correct_sheet(image_path, sheet_number=sheet_number)
+
+    except Exception as err:
+        return False, str(err)
+
+
+class BatchCorrector:
+    def __init__(self, max_workers=None, ocr_service=None, read_student_codes=True, trace=False):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.ocr_service = ocr_service
+
+        # when True the results hold the trace of the stages of their sheet, see MCQCorrector
+        self.trace = trace
+
+        # when False the crops of the code boxes are dropped and the student codes are left empty
+        self.read_student_codes = read_student_codes
+
+    # batches is a list of (quiz, image_paths) pairs. For each quiz we return the list of (ok, result_or_error)
+    # pairs of its images in the same order as the given paths
+    def correct(self, batches):
+        total = sum(len(paths) for quiz, paths in batches)
+        if total == 0:
+            return [[] for quiz, paths in batches]
+
+        # the snapshot of each quiz is stored once for the workers, the images are only sent with its key. The
+        # workers only build a corrector for the snapshots they have not seen yet
+        snapshots = [_snapshot_batch(quiz) for quiz, paths in batches]
+        keys = [key for key, snapshot, answer_key in snapshots]
+
+        ocr_service = self.ocr_service or (get_ocr_service() if self.read_student_codes else None)
+
+        # the code crop of each graded sheet is queued for OCR as soon as it is available, so the codes are read
+        # while the next sheets are graded
+        if self.max_workers == 1:
+            _setup_django()
+            share_snapshots(_snapshots, snapshots)
+            outcomes = [[self._queue_ocr(_correct_one(key, self.trace, path, number + 1), ocr_service)
+                         for number, path in enumerate(paths)]
+                        for key, (quiz, paths) in zip(keys, batches)]
+
+        else:
+            pool, shared = get_pool(self.max_workers)
+            share_snapshots(shared, snapshots)
+            futures = [[pool.submit(_correct_one, key, self.trace, path, number + 1)
+                        for number, path in enumerate(paths)]
+                       for key, (quiz, paths) in zip(keys, batches)]
+
+            outcomes = [[self._queue_ocr(self._outcome(pool, future), ocr_service) for future in quiz_futures]
+                        for quiz_futures in futures]
+
+        return [[self._read_student_code(outcome) for outcome in quiz_outcomes] for quiz_outcomes in outcomes]
+
+    def _queue_ocr(self, outcome, ocr_service):
+        ok, res = outcome
+        # sheets with a student id grid were fully read by the worker
+        if not ok or 'code_image' not in res:
+            return ok, res, None
+
+        if not self.read_student_codes:
+            del res['code_image']
+            return ok, res, None
+
+        trace = SheetTrace.from_json(res['trace']) if 'trace' in res else None
+        return ok, res, ocr_service.submit(res.pop('code_image'), trace=trace)
+
+    @staticmethod
+    def _read_student_code(outcome):
+        ok, res, code_future = outcome
+        if code_future is None:
+            return ok, res
+
+        try:
+            res['student_code'] = clean_student_code(code_future.result())
+            return ok, res
+
+        except Exception as err:
+            return False, str(err)
+
+    @staticmethod
+    def _outcome(pool, future):
+        # a worker which dies (e.g. killed by the OS) breaks the pool, the remaining images are reported as failed
+        try:
+            return future.result()
+
+        except BrokenProcessPool as err:
+            discard_pool(pool)
+            return False, str(err)
+
+        except Exception as err:
+            return False, str(err)
@@ -1,18 +1,74 @@
 # import the necessary packages
-from .transform import four_point_transform
-from skimage.filters import threshold_local
+from .transform import page_transform
+from .fiducials import find_fiducials
+from .threshold import binarize, scaled_block_size
+import numpy as np
 import cv2
 import imutils
-import os
 
 
-def scanSheet(image, sheet_name):
+# returns the perspective transform from the image to the top-down view of the page of the sheet, and the (width,
+# height) of that view. For sheets printed with fiducial markers, the page corners are those of the markers (see
+# fiducials.py), the page contour is only searched when they cannot all be found
+def registerPage(image, fiducials=False):
 
-	# load the image and compute the ratio of the old height
-	# to the new height, clone it, and resize it
+	return page_transform(findRegistrationCorners(image, fiducials)[0])
 
+
+# returns the corners of the page in the image used by registerPage, and whether they are those of the fiducial markers
+def findRegistrationCorners(image, fiducials=False):
+
+	pageCorners = find_fiducials(image) if fiducials else None
+	if pageCorners is not None:
+		return pageCorners, True
+
+	return findPageCorners(image), False
+
+
+# returns the thresholded top-down view of the sheet, it is only written to debug_path if one is given.
+# registration is the result of registerPage when it is already known. When height is given, the page is
+# scanned no taller than height, straight from the image
+def scanSheet(image, debug_path=None, fiducials=False, registration=None, height=None):
+
+	if registration is None:
+		registration = registerPage(image, fiducials)
+
+	M, (width, pageHeight) = registration
+	scale = 1.0 if height is None else min(height / pageHeight, 1.0)
+	if scale < 1.0:
+		M = np.diag([scale, scale, 1.0]) @ M
+		width, pageHeight = int(round(width * scale)), int(round(pageHeight * scale))
+
+	# apply the perspective transform to obtain a top-down
+	# view of the original image
+	warped = cv2.warpPerspective(image, M, (width, pageHeight))
+
+	# convert the warped image to grayscale, then threshold it
+	# to give it that 'black and white' paper effect
+	if warped.ndim == 3:
+		warped = cv2.cvtColor(warped, cv2.COLOR_BGR2GRAY)
+	warped = binarize(warped, scaled_block_size(scale), dst=warped)
+
+	if debug_path is not None:
+		cv2.imwrite(debug_path, warped)
+
+	# print(warped)
+
+	# show the original and scanned images
+	# "STEP 3: Apply perspective transform"
+	# cv2.imshow("Original", imutils.resize(orig, height=650))
+	# cv2.imshow("Scanned", imutils.resize(warped, height=650))
+	# cv2.waitKey(0)
+
+	return warped
+
+
+# returns the corners of the page in the image, in the coordinates of the image
+def findPageCorners(image):
+
+	# compute the ratio of the old height to the new height and resize the image,
+	# the page is only looked for on the small copy, the full resolution image is read once by the final warp
 	ratio = image.shape[0] / 500.0
-	orig = image.copy()
 	image = imutils.resize(image, height=500)
 
 	# convert the image to grayscale, blur it, and find edges
@@ -24,12 +80,14 @@ def scanSheet(image, sheet_name):
 	# "STEP 1: Edge Detection"
 
 	# find the contours in the edged image, keeping only the
-	# largest ones, and initialize the screen contour
+	# largest ones, and initialize the screen contour. The contours are taken by their convex hull: when the edge of
+	# the page has a gap (e.g at a corner) its contour is not closed and encloses nothing, but its hull is the page
 	cnts = cv2.findContours(edged.copy(), cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
-	cnts = imutils.grab_contours(cnts)
+	cnts = [cv2.convexHull(c) for c in imutils.grab_contours(cnts)]
 	cnts = sorted(cnts, key=cv2.contourArea, reverse=True)[:5]
 
 	# loop over the contours
+	screenCnt = None
 	for c in cnts:
 		# approximate the contour
 		peri = cv2.arcLength(c, True)
@@ -41,30 +99,9 @@ def scanSheet(image, sheet_name):
 			screenCnt = approx
 			break
 
-	# "STEP 2: Find contours of paper"
-
-	cv2.drawContours(image, [screenCnt], -1, (0, 255, 0), 2)
-
-	# apply the four point transform to obtain a top-down
-	# view of the original image
-	warped = four_point_transform(orig, screenCnt.reshape(4, 2) * ratio)
-
-	# convert the warped image to grayscale, then threshold it
-	# to give it that 'black and white' paper effect
-	warped = cv2.cvtColor(warped, cv2.COLOR_BGR2GRAY)
-	T = threshold_local(warped, 107, offset=4, method="mean")
-	warped = (warped > T).astype("uint8") * 255
+	if screenCnt is None:
+		raise Exception("could not find the sheet on the image")
 
-	abs_path = os.path.abspath('.')
-	# we save the image with the sheetname and count
-	cv2.imwrite(f"{os.path.join(abs_path, sheet_name + '.jpg')}", warped)
-
-	# print(warped)
-
-	# show the original and scanned images
-	# "STEP 3: Apply perspective transform"
-	# cv2.imshow("Original", imutils.resize(orig, height=650))
-	# cv2.imshow("Scanned", imutils.resize(warped, height=650))
-	# cv2.waitKey(0)
+	# "STEP 2: Find contours of paper"
 
-	return warped
+	return screenCnt.reshape(4, 2) * ratio
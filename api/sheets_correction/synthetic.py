@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic photos of filled answer sheets.
+
+render_sheet draws a sheet with the layout read by MCQCorrector (a code box at the top right and the answer columns
+of rows_per_column questions below it), fills one bubble of every question, and photographs it: the page is put on a
+dark background with a random perspective, then blurred and noised. The answers are drawn from a seeded generator, so
+the same arguments always give the same photo. Used by the benchmark and golden corpus commands, which run offline.
+"""
+import cv2
+import numpy as np
+
+# size of the page in points at scale 1, about a letter page at 100 dpi
+PAGE_WIDTH = 850
+PAGE_HEIGHT = 1100
+
+# vertical extent of the answer columns on the page, in points
+BODY_TOP = 230
+BODY_BOTTOM = 1040
+
+
+# returns the (photo, answers) of a sheet, answers[i] is the list of the choices filled for question i.
+# scale is the resolution of the page relative to PAGE_WIDTH x PAGE_HEIGHT and noise the standard deviation of the
+# gaussian noise added to the photo. The student code is printed in the code box, or with student_id a grid of
+# len(student_id) digit columns is drawn under it
+def render_sheet(questions=10, choices=4, scale=1.0, noise=0.0, seed=0, answers=None, rows_per_column=25,
+                 bubble='Squares', code='AB123', student_id=None, fiducials=False):
+    rng = np.random.default_rng(seed)
+
+    def points(value):
+        return int(round(value * scale))
+
+    page = np.full((points(PAGE_HEIGHT), points(PAGE_WIDTH)), 255, np.uint8)
+    cv2.putText(page, 'MCQ SHEET', (points(60), points(80)), cv2.FONT_HERSHEY_SIMPLEX, 1.2 * scale, 0,
+                max(1, points(2)))
+
+    cv2.rectangle(page, (points(480), points(60)), (points(800), points(170)), 0, max(2, points(3)))
+    cv2.putText(page, code, (points(510), points(135)), cv2.FONT_HERSHEY_SIMPLEX, 1.6 * scale, 0, max(1, points(3)))
+
+    if student_id is not None:
+        draw_student_id(page, student_id, scale)
+
+    if answers is None:
+        answers = [[int(rng.integers(choices))] for _ in range(questions)]
+
+    column_rows = [min(rows_per_column, questions - start) for start in range(0, questions, rows_per_column)]
+    pitch = 780 / len(column_rows)
+    width = min(pitch - 24, choices * 70)
+    first = 0
+
+    for column, rows in enumerate(column_rows):
+        left = 70 + column * pitch
+        cv2.rectangle(page, (points(left), points(BODY_TOP)), (points(left + width), points(BODY_BOTTOM)), 0,
+                      max(2, points(2)))
+
+        row_height = (BODY_BOTTOM - BODY_TOP) / rows
+        cell_width = width / choices
+        for row in range(rows):
+            for choice in range(choices):
+                filled = choice in answers[first + row]
+                draw_bubble(page, left + (choice + .5) * cell_width, BODY_TOP + (row + .5) * row_height,
+                            cell_width, row_height, filled, bubble, scale)
+
+        first += rows
+
+    if fiducials:
+        from .fiducials import draw_fiducials
+        draw_fiducials(page, size=points(36), margin=points(6))
+
+    return photograph(page, rng, noise), answers
+
+
+# bubbles take 80% of their cell when filled and 32% when empty
+def draw_bubble(page, x, y, cell_width, cell_height, filled, bubble, scale):
+    ratio = .4 if filled else .16
+    half_width, half_height = cell_width * ratio * scale, cell_height * ratio * scale
+    x, y = x * scale, y * scale
+
+    if bubble == 'Squares':
+        cv2.rectangle(page, (int(round(x - half_width)), int(round(y - half_height))),
+                      (int(round(x + half_width)), int(round(y + half_height))), 0, -1 if filled else 1)
+    else:
+        cv2.ellipse(page, (int(round(x)), int(round(y))), (int(round(half_width)), int(round(half_height))), 0, 0, 360,
+                    0, -1 if filled else 1)
+
+
+# draws the student id grid of the digits, '?' leaves a column empty
+def draw_student_id(page, student_id, scale, left=480, top=230, cell_size=30):
+    def points(value):
+        return int(round(value * scale))
+
+    cv2.rectangle(page, (points(left), points(top)), (points(left + len(student_id) * cell_size),
+                                                      points(top + 10 * cell_size)), 0, max(2, points(2)))
+
+    for column, digit in enumerate(student_id):
+        for row in range(10):
+            filled = digit != '?' and int(digit) == row
+            draw_bubble(page, left + (column + .5) * cell_size, top + (row + .5) * cell_size, cell_size, cell_size,
+                        filled, 'Squares', scale)
+
+
+# puts the page on a dark background with a random perspective, the photo is returned as a BGR image
+def photograph(page, rng, noise):
+    page_height, page_width = page.shape
+    width, height = int(page_width * 1.3), int(page_height * 1.25)
+
+    background = rng.integers(40, 90, (height // 8 + 1, width // 8 + 1)).astype(np.uint8)
+    background = cv2.resize(cv2.GaussianBlur(background, (0, 0), 1), (width, height))
+
+    left, top = (width - page_width) / 2, (height - page_height) / 2
+    corners = np.float32([[0, 0], [page_width, 0], [page_width, page_height], [0, page_height]])
+    jitter = rng.uniform(-0.03, 0.03, (4, 2)) * [page_width, page_height]
+    matrix = cv2.getPerspectiveTransform(corners, np.float32(corners + [left, top] + jitter))
+
+    warped = cv2.warpPerspective(page, matrix, (width, height), borderValue=0)
+    mask = cv2.warpPerspective(np.full_like(page, 255), matrix, (width, height))
+    photo = np.where(mask > 0, warped, background).astype(np.float32)
+
+    if noise:
+        photo += rng.normal(0, noise, photo.shape)
+        photo = cv2.GaussianBlur(photo, (0, 0), 1)
+
+    return cv2.cvtColor(np.clip(photo, 0, 255).astype(np.uint8), cv2.COLOR_GRAY2BGR)
+
+
+# an unsaved quiz whose answer key are the given answers, every question is worth 2 marks
+def synthetic_quiz(answers, choices=4, rows_per_column=25, sheet_name='synthetic', **fields):
+    from api.models import Quiz
+
+    quiz = Quiz(sheet_name=sheet_name, questions=len(answers), choices=choices, choiceLabels='A-B-C',
+                marksAllocation=['2'] * len(answers), failMark=0, rows_per_column=rows_per_column, **fields)
+
+    labels = [quiz.get_choice_label(i) for i in range(choices)]
+    quiz.correctAnswers = [' '.join(labels[choice] for choice in question) for question in answers]
+    quiz.marksDistribution = [';'.join('{} {:g}'.format(labels[choice], 100 / len(question)) for choice in question)
+                              for question in answers]
+    return quiz
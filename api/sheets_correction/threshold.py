@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+Local thresholds of the scanned sheets.
+
+The sheets are binarized against the mean of the pixels around each pixel, which copes with the uneven lighting of
+photos. The block size was tuned on full resolution pages, regions extracted at another scale use a block size scaled
+the same way.
+
+The threshold is that of skimage's threshold_local(method='mean'), which works on float64 copies of the image. The
+means are computed here with a float32 box filter into buffers kept by the thread and reused for every image, and the
+pixels are compared with them in place. Only the regions which are graded are thresholded at full resolution, see
+MCQCorrector.correct_sheet.
+"""
+import cv2
+import numpy as np
+import threading
+
+# block size (in pixels of a full resolution page) and offset of the local threshold
+PAGE_BLOCK_SIZE = 107
+PAGE_OFFSET = 4
+
+
+# block size for an image scale times the size of the full resolution page, the block size must be odd
+def scaled_block_size(scale, block_size=PAGE_BLOCK_SIZE):
+    return max(int(round(block_size * scale / 2)) * 2 + 1, 3)
+
+
+class LocalThreshold:
+    def __init__(self):
+        self._means = np.empty(0, dtype=np.float32)  # grown to the largest image thresholded so far
+
+    # the local means of the image minus the offset, in the buffer of the thread. The borders are reflected like in
+    # threshold_local
+    def thresholds(self, gray, block_size, offset):
+        if self._means.size < gray.size:
+            self._means = np.empty(gray.size, dtype=np.float32)
+
+        means = self._means[:gray.size].reshape(gray.shape)
+        cv2.boxFilter(gray, cv2.CV_32F, (block_size, block_size), dst=means, borderType=cv2.BORDER_REFLECT)
+        np.subtract(means, offset, out=means)
+        return means
+
+    # writes 255 where the pixels are above their threshold (or at most their threshold when invert) and 0 elsewhere.
+    # dst may be the image itself
+    def apply(self, gray, block_size, offset, dst=None, invert=False):
+        means = self.thresholds(gray, block_size, offset)
+        if dst is None:
+            dst = np.empty_like(gray)
+
+        compare = np.less_equal if invert else np.greater
+        compare(gray, means, out=dst.view(np.bool_))
+        np.multiply(dst, 255, out=dst)
+        return dst
+
+
+_local = threading.local()
+
+
+def get_local_threshold():
+    threshold = getattr(_local, 'threshold', None)
+    if threshold is None:
+        threshold = _local.threshold = LocalThreshold()
+
+    return threshold
+
+
+# returns the binarized image, paper is white (255) and ink is black (0)
+def binarize(gray, block_size=PAGE_BLOCK_SIZE, offset=PAGE_OFFSET, dst=None):
+    return get_local_threshold().apply(gray, block_size, offset, dst=dst)
+
+
+# returns the mask of the ink of the image, ink is 255 and paper is 0
+def ink_mask(gray, block_size=PAGE_BLOCK_SIZE, offset=PAGE_OFFSET, dst=None):
+    return get_local_threshold().apply(gray, block_size, offset, dst=dst, invert=True)
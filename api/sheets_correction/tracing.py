@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Timings of the stages of the correction of a sheet.
+
+MCQCorrector.correct_sheet records every stage of the pipeline in the SheetTrace of the sheet: its wall time, the CPU
+time of the thread which ran it and the size of the image it handled. The trace is returned with the result of the
+sheet, the traces of every batch are aggregated into the histograms of api.models.StageHistogram.
+"""
+from contextlib import contextmanager
+import time
+
+# upper bounds (in milliseconds) of the buckets of the stage histograms, the last bucket holds the slower stages
+BUCKET_BOUNDS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+
+class TraceStage:
+    def __init__(self, name, image=None):
+        self.name = name
+        self.image = image  # the image handled by the stage, it may be set while the stage runs
+
+    def size(self):
+        if self.image is None:
+            return 0, 0
+
+        height, width = self.image.shape[:2]
+        return width, height
+
+
+class SheetTrace:
+    def __init__(self):
+        self.stages = []
+
+    # records the stage run in the with block
+    @contextmanager
+    def stage(self, name, image=None):
+        stage = TraceStage(name, image)
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield stage
+
+        finally:
+            width, height = stage.size()
+            self.add(name, time.perf_counter() - wall, time.thread_time() - cpu, width, height)
+
+    # times are in seconds
+    def add(self, name, wall, cpu, width=0, height=0):
+        self.stages.append({'stage': name, 'wall': wall, 'cpu': cpu, 'width': width, 'height': height})
+
+    def to_json(self):
+        return list(self.stages)
+
+    # the trace of the given list of stages, the stages recorded are added to that list
+    @classmethod
+    def from_json(cls, stages):
+        trace = cls()
+        trace.stages = stages
+        return trace
+
+
+# records the stage in the trace when there is one
+def trace_stage(trace, name, image=None):
+    if trace is None:
+        return _untraced(name, image)
+
+    return trace.stage(name, image)
+
+
+@contextmanager
+def _untraced(name, image):
+    yield TraceStage(name, image)
+
+
+# index of the bucket of BUCKET_BOUNDS of a time in seconds
+def bucket_index(seconds):
+    milliseconds = seconds * 1000
+    for i, bound in enumerate(BUCKET_BOUNDS):
+        if milliseconds <= bound:
+            return i
+
+    return len(BUCKET_BOUNDS)
+
+
+# adds a time in seconds to the counts of the buckets of BUCKET_BOUNDS
+def add_to_buckets(buckets, seconds):
+    buckets.extend([0] * (len(BUCKET_BOUNDS) + 1 - len(buckets)))
+    buckets[bucket_index(seconds)] += 1
+    return buckets
@@ -26,6 +26,16 @@ def order_points(pts):
 	return rect
 
 def four_point_transform(image, pts):
+	# compute the perspective transform matrix and the size of the top-down view, then apply it
+	M, (maxWidth, maxHeight) = page_transform(pts)
+	warped = cv2.warpPerspective(image, M, (maxWidth, maxHeight))
+
+	# return the warped image
+	return warped
+
+# returns the perspective transform matrix from the image to the top-down view of the
+# four points and the (width, height) of that view
+def page_transform(pts):
 	# obtain a consistent order of the points and unpack them
 	# individually
 	rect = order_points(pts)
@@ -56,9 +66,7 @@ def four_point_transform(image, pts):
 		[maxWidth - 1, maxHeight - 1],
 		[0, maxHeight - 1]], dtype="float32")
 
-	# compute the perspective transform matrix and then apply it
+	# compute the perspective transform matrix
 	M = cv2.getPerspectiveTransform(rect, dst)
-	warped = cv2.warpPerspective(image, M, (maxWidth, maxHeight))
 
-	# return the warped image
-	return warped
\ No newline at end of file
+	return M, (maxWidth, maxHeight)
\ No newline at end of file
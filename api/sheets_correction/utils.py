@@ -14,7 +14,9 @@ def getCornerPoints(cont, epsilon=0.02):
     return approx
 
 
-# returns all rectangular contours in a list of contours
+# returns all rectangular contours in a list of contours. The corners of a contour are those of its convex hull: a box
+# whose border line is broken (e.g by a shaded bubble touching it) has an edge contour which runs along both sides of
+# the line there, but its hull is still the box
 
 def rectContours(contours):
     rectCon = []  # list which will store all rectangular contours
@@ -23,11 +25,11 @@ def rectContours(contours):
         # print(area)
         
         if area > 50:
-            approx = getCornerPoints(ct)
+            approx = getCornerPoints(cv2.convexHull(ct))
             # print("Corner points", len(approx))
             
             # if our contour has four corner points we add it to the rectangles list
-            if len(approx == 4):
+            if len(approx) == 4:
                 rectCon.append(ct)
     
     # we now sort the rectangles list so that the contour with the biggest area is at the start of the list
@@ -36,6 +38,51 @@ def rectContours(contours):
     return rectCon
 
 
+# function finds the corner points of the count biggest rectangles of a scanned sheet, biggest first. The rectangles
+# are searched on a downscaled copy of the sheet: it is halved with pyrDown (which also smooths it for the edge
+# detection) until it is no taller than max_height. The corners found are scaled back to the full resolution sheet
+# and refined there by refineCorners, which only reads a few pixels around each corner
+
+def findBoxCorners(img, count, max_height=1000):
+    level = img
+    factor = 1
+    while level.shape[0] > max_height:
+        level = cv2.pyrDown(level)
+        factor *= 2
+
+    # edge detection
+    img_canny = cv2.Canny(level, 10, 50)
+    contours, hierachy = cv2.findContours(img_canny, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    boxes = []
+    for contour in rectContours(contours)[:count]:
+        corners = getCornerPoints(cv2.convexHull(contour)) * factor
+        if factor > 1:
+            corners = refineCorners(img, corners, radius=2 * factor)
+
+        boxes.append(corners)
+
+    return boxes
+
+
+# function moves each corner of a rectangle to the outermost dark pixel around it in the given radius, i.e the corner
+# of the rectangle's border line as it is found at full resolution. The corners are returned reordered
+
+def refineCorners(img, corners, radius):
+    corners = reorder(corners)
+    outwards = np.array([[-1, -1], [1, -1], [-1, 1], [1, 1]])  # direction of each corner, in the order of reorder
+
+    for i, (x, y) in enumerate(corners.reshape(4, 2)):
+        x0, y0 = max(x - radius, 0), max(y - radius, 0)
+        ys, xs = np.nonzero(img[y0:y + radius + 1, x0:x + radius + 1] < 128)
+
+        if len(xs) > 0:
+            j = np.argmax((xs + x0) * outwards[i][0] + (ys + y0) * outwards[i][1])
+            corners[i] = [xs[j] + x0, ys[j] + y0]
+
+    return corners
+
+
 # reorder function reorders the points of the contours from smallest to biggest.
 # point closer to origin(0,0) is first point, and point further from origin is last point.
 
@@ -64,21 +111,69 @@ def reorder(points):
     return pointsNew
 
 
-# function splits the sheet body into individual boxes which contain a bubble each
+# function measures how much each bubble of the sheet body is filled, it returns a rows x cols matrix holding the
+# number of non-zero pixels of each cell. We build the integral image of the non-zero pixels once, the count of every
+# cell is then read from the integral values at its four corners, so the cost does not grow with the number of cells.
+# Trailing pixels which do not fill a whole cell are ignored
 
-def splitBoxes(img, rows=5, cols=5):
-    imrows = np.vsplit(img, rows)  # split the image into a given number of rows
-    boxes = []
+def fill_matrix(img, rows=5, cols=5):
+    cell_height = img.shape[0] // rows
+    cell_width = img.shape[1] // cols
 
-    for row in imrows:
-        imcols = np.hsplit(row, cols)  # split each row into individual columns (cells)
+    integral = cv2.integral((img != 0).view(np.uint8))
+    corners = integral[0:(rows + 1) * cell_height:cell_height, 0:(cols + 1) * cell_width:cell_width]
 
-        for box in imcols:
-            boxes.append(box)  # send each box to our boxes array
+    return corners[1:, 1:] - corners[:-1, 1:] - corners[1:, :-1] + corners[:-1, :-1]
 
-    # cv2.imshow("first row", imrows[1])
 
-    return boxes
+# function returns a boolean matrix marking the cells of a fill matrix which are shaded enough to be an answer
+
+def detect_answers(fills, threshold):
+    return fills >= threshold
+
+
+# function returns the share of each cell of a fill matrix which is filled, cells of cell_width x cell_height pixels
+
+def fill_ratios(fills, cell_width, cell_height):
+    return fills / float(cell_width * cell_height)
+
+
+# function returns the fill ratio above which the bubbles of a sheet are shaded. The ratios of the cells of a sheet
+# gather around the ratio of the empty bubbles and that of the shaded ones. The two groups are split with Otsu's
+# method, which puts the threshold at the edge of the empty group when there is a gap between them, so it is then
+# moved halfway between the means of the groups (2-means). A sheet whose groups are not far enough apart (e.g all its
+# bubbles are empty) keeps the default ratio, and the threshold is always kept within bounds
+
+def calibrate_fill_threshold(ratios, default=0.24, bounds=(0.15, 0.6), min_separation=0.25, iterations=10):
+    values = np.clip(np.asarray(ratios, dtype=np.float64).ravel(), 0, 1)
+    if values.size < 2:
+        return default
+
+    levels = np.round(values * 255).astype(np.uint8).reshape(1, -1)
+    threshold = cv2.threshold(levels, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[0] / 255
+
+    for i in range(iterations):
+        shaded, empty = values[values > threshold], values[values <= threshold]
+        if shaded.size == 0 or empty.size == 0:
+            return default
+
+        threshold = (shaded.mean() + empty.mean()) / 2
+
+    if shaded.mean() - empty.mean() < min_separation:
+        return default
+
+    return float(np.clip(threshold, *bounds))
+
+
+# function decodes a student id grid from its fill matrix. Each column of the grid is one digit of the id and its rows
+# are the digits 0 to 9 from top to bottom. A column without exactly one shaded bubble cannot be read, it gives '?'
+
+def decode_student_id(fills, threshold):
+    shaded = detect_answers(fills, threshold)
+    digits = np.argmax(fills, axis=0)
+    readable = np.count_nonzero(shaded, axis=0) == 1
+
+    return ''.join(str(digit) if ok else '?' for digit, ok in zip(digits.tolist(), readable.tolist()))
 
 
 def showAnswers(img, markedIndexes, grading, answers, bodyRows, bodyCols):
@@ -105,17 +200,46 @@ def showAnswers(img, markedIndexes, grading, answers, bodyRows, bodyCols):
     return img
 
 
-def get_warped_image(image, contour, width, height):
-    pt1 = np.float32(contour)
-    pt2 = np.float32(
-            [
-                [0, 0], [width, 0],
-                [0, height],
-                [width, height]
-            ]
-                        )
+# function returns the perspective transform from the page to the bird's eye view (width x height) of the box with the
+# given (reordered) corners
+
+def region_matrix(corners, width, height):
+    return cv2.getPerspectiveTransform(np.float32(corners).reshape(4, 2), np.float32(
+        [[0, 0], [width, 0], [0, height], [width, height]]))
+
+
+# function returns how many pixels of the bird's eye view of the box with the given (reordered) corners and height
+# there are for one pixel of the page
+
+def region_scale(corners, height):
+    corners = np.float32(corners).reshape(4, 2)
+    left, right = np.linalg.norm(corners[2] - corners[0]), np.linalg.norm(corners[3] - corners[1])
+    return height / max((left + right) / 2, 1)
+
+
+# function extracts a region of the image with the given perspective transform as a grayscale image, the pixels of
+# the image are resampled once. It is written to dst when given
+
+def warp_region(image, matrix, width, height, dst=None):
+    if image.ndim == 2:
+        return cv2.warpPerspective(image, matrix, (width, height), dst=dst)
+
+    return cv2.cvtColor(cv2.warpPerspective(image, matrix, (width, height)), cv2.COLOR_BGR2GRAY, dst=dst)
+
+
+# function extracts the answer columns of a sheet below each other into a single grayscale image, with the perspective
+# transform of each column from the image. Every row of a column takes cell_height pixels, so with the columns in order
+# the rows of the image are the questions of the sheet in order
+
+def warp_columns(image, matrices, column_rows, width, cell_height):
+    body = np.empty((sum(column_rows) * cell_height, width), dtype=np.uint8)
+    top = 0
+
+    for matrix, rows in zip(matrices, column_rows):
+        height = rows * cell_height
 
-    warp_matrix = cv2.getPerspectiveTransform(pt1, pt2)
-    warp_image = cv2.warpPerspective(image, warp_matrix, (width, height))
+        # the column is written straight into its rows of the body
+        warp_region(image, matrix, width, height, dst=body[top:top + height])
+        top += height
 
-    return warp_image
+    return body
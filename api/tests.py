@@ -1,3 +1,1015 @@
-from django.test import TestCase
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase, TestCase, RequestFactory, override_settings
+from django.utils.timezone import now
+from datetime import timedelta
+from io import StringIO
+from api import jobs
+from api.models import Quiz, SheetImage, CorrectionJob, CorrectionResult
+from api.sheets_correction.answer_keys import answer_keys
+from api.sheets_correction.grading import compile_answer_key, grade
+from rest_framework.test import APIClient
+from unittest import mock, skipUnless
+import importlib
+import importlib.util
+import json
+import os
+import pickle
+import shutil
+import subprocess
+import sys
+import tempfile
+
+# modules loading the API of a web process, none of them may import the correction engine
+WEB_MODULES = ['api.urls', 'api.views', 'api.admin', 'api.serializers', 'api.correction', 'api.jobs',
+               'api.sheets_correction.engine']
+
+# modules of the computer vision stack, only the correction workers import them
+ENGINE_MODULES = ['cv2', 'numpy', 'imutils', 'pytesseract', 'tesserocr', 'skimage', 'scipy']
+
+# seconds a fresh interpreter may take to set django up and import the web modules
+STARTUP_BUDGET = 3.0
+
+STARTUP_SCRIPT = '''
+import json, sys, time
+start = time.perf_counter()
+import django
+django.setup()
+for name in {modules!r}:
+    __import__(name)
+print(json.dumps({{'seconds': time.perf_counter() - start, 'modules': sorted(sys.modules)}}))
+'''
+
+
+class WebStartupTests(SimpleTestCase):
+    # the web modules are imported by a fresh interpreter, the modules already imported by the test runner would
+    # hide what they import
+    def measure_startup(self):
+        env = dict(os.environ)
+        env.setdefault('DJANGO_SETTINGS_MODULE', 'automcq_backend.settings')
+        output = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT.format(modules=WEB_MODULES)], env=env,
+                                cwd=settings.BASE_DIR, capture_output=True, text=True, check=True).stdout
+
+        return json.loads(output.splitlines()[-1])
+
+    def test_web_modules_do_not_import_the_engine(self):
+        modules = set(self.measure_startup()['modules'])
+
+        self.assertEqual([name for name in ENGINE_MODULES if name in modules], [])
+
+    def test_startup_time_budget(self):
+        self.assertLess(self.measure_startup()['seconds'], STARTUP_BUDGET)
+
+
+class CorrectionJobQueueTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('teacher', password='secret')
+
+    def enqueue(self, minutes_ago, **payload):
+        job = jobs.enqueue_job('batch', payload or {'sheets': []}, self.user)
+        CorrectionJob.objects.filter(pk=job.pk).update(created=now() - timedelta(minutes=minutes_ago))
+        return job
+
+    def test_oldest_job_is_claimed_first(self):
+        newer = self.enqueue(1)
+        older = self.enqueue(5)
+
+        self.assertEqual(jobs.claim_next_job('w1').pk, older.pk)
+        self.assertEqual(jobs.claim_next_job('w2').pk, newer.pk)
+
+    def test_claimed_job_is_not_claimed_again(self):
+        job = self.enqueue(1)
+
+        claimed = jobs.claim_next_job('w1')
+        self.assertIsNone(jobs.claim_next_job('w2'))
+
+        claimed.refresh_from_db()
+        self.assertEqual((claimed.pk, claimed.status, claimed.worker, claimed.attempts), (job.pk, 'running', 'w1', 1))
+
+    def test_failure_is_recorded(self):
+        job = jobs.enqueue_job('upload', {'sheet_id': 404, 'image_ids': [1]}, self.user)
+
+        jobs.run_job(jobs.claim_next_job('w1'))
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertIn('does not exist', job.error)
+        self.assertIsNotNone(job.finished)
+
+    def test_finished_job_is_recorded(self):
+        job = self.enqueue(1)
+
+        self.assertEqual(jobs.work('w1', max_jobs=5), 1)
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.result), ('done', []))
+
+    @override_settings(CORRECTION_JOB_TIMEOUT=60, CORRECTION_JOB_ATTEMPTS=2)
+    def test_job_of_a_dead_worker_is_claimed_again(self):
+        job = self.enqueue(10)
+        jobs.claim_next_job('dead')
+        CorrectionJob.objects.filter(pk=job.pk).update(started=now() - timedelta(minutes=5))
+
+        claimed = jobs.claim_next_job('w2')
+        self.assertEqual((claimed.pk, claimed.worker, claimed.attempts), (job.pk, 'w2', 2))
+
+        # the dead worker does not overwrite the outcome of the job it lost
+        lost = CorrectionJob.objects.get(pk=job.pk)
+        lost.worker = 'dead'
+        jobs.run_job(lost)
+        self.assertEqual(CorrectionJob.objects.get(pk=job.pk).status, 'running')
+
+    @override_settings(CORRECTION_JOB_TIMEOUT=60, CORRECTION_JOB_ATTEMPTS=2)
+    def test_job_abandoned_too_many_times_fails(self):
+        job = self.enqueue(10)
+        CorrectionJob.objects.filter(pk=job.pk).update(status='running', attempts=2,
+                                                       started=now() - timedelta(minutes=5))
+
+        self.assertIsNone(jobs.claim_next_job('w1'))
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertIn('stopped 2 times', job.error)
+
+
+# per question grading loop of MCQCorrector.correct_sheet before grading was vectorized, the reference of grade()
+def baseline_grade(given_answers, answers, distribution, allocation, fail_mark):
+    marks, percentages, corrects, wrongs = [], [], [], []
+
+    for i, given in enumerate(given_answers):
+        points_percentage = 0.0
+        correct, wrong = [], []
+        for ans in given:
+            if ans in answers[i]:
+                points_percentage += float(distribution[i][str(ans)])
+                correct.append(ans)
+            else:
+                points_percentage = 0.0
+                wrong.append(ans)
+
+        mark, percentage = 0.0, 0.0
+        if points_percentage > 0:
+            points_frac = points_percentage / sum(float(pc) for pc in distribution[i].values())
+            mark = points_frac * float(allocation[i])
+            percentage = points_frac * 100
+        else:
+            mark -= float(fail_mark)
+
+        marks.append(mark)
+        percentages.append(percentage)
+        corrects.append(correct)
+        wrongs.append(wrong)
+
+    return marks, percentages, corrects, wrongs
+
+
+class GradingTests(SimpleTestCase):
+    # a random answer key of one to all the choices per question, the distribution of some questions also gives
+    # percentages to a wrong choice, which only count in the total of the question
+    def random_key(self, rng, questions, choices):
+        answers, distribution = [], []
+        for i in range(questions):
+            correct = sorted(rng.choice(choices, size=rng.integers(1, choices + 1), replace=False).tolist())
+            percentages = {str(ans): str(int(rng.integers(10, 100))) for ans in correct}
+            wrong = [ans for ans in range(choices) if ans not in correct]
+            if wrong and rng.random() < .3:
+                percentages[str(wrong[0])] = str(int(rng.integers(10, 100)))
+
+            answers.append(correct)
+            distribution.append(percentages)
+
+        allocation = [str(int(rng.integers(1, 6))) for i in range(questions)]
+        return answers, distribution, allocation
+
+    def assert_grades_like_baseline(self, chosen, answers, distribution, allocation, fail_mark):
+        import numpy as np
+
+        questions, choices = chosen.shape
+        key = compile_answer_key(answers, distribution, allocation, fail_mark, questions, choices)
+        grades = grade(chosen, key)
+        marks, percentages, corrects, wrongs = baseline_grade(
+            [np.flatnonzero(row).tolist() for row in chosen], answers, distribution, allocation, fail_mark)
+
+        np.testing.assert_allclose(grades.marks, marks)
+        np.testing.assert_allclose(grades.percentage_pass, percentages)
+        np.testing.assert_allclose(grades.scores, sum(marks))
+        self.assertEqual([np.flatnonzero(row).tolist() for row in grades.correct_choices], corrects)
+        self.assertEqual([np.flatnonzero(row).tolist() for row in grades.wrong_choices], wrongs)
+
+    def test_random_keys_and_answers(self):
+        import numpy as np
+
+        rng = np.random.default_rng(5)
+        for choices in (2, 4, 5):
+            for fail_mark in (0, 0.5, 1):
+                answers, distribution, allocation = self.random_key(rng, 40, choices)
+                chosen = rng.random((40, choices)) < .35
+
+                self.assert_grades_like_baseline(chosen, answers, distribution, allocation, fail_mark)
+
+    def test_multiple_correct_choices_wrong_choice_after_correct_and_empty_rows(self):
+        import numpy as np
+
+        answers = [[0, 2], [0, 1], [1], [3, 4], [0, 1, 2, 3, 4]]
+        distribution = [{'0': '30', '2': '70'}, {'0': '50', '1': '50'}, {'1': '100'}, {'3': '40', '4': '40', '0': '20'},
+                        {str(ans): '20' for ans in range(5)}]
+        allocation = ['2', '3', '1', '4', '5']
+        chosen = np.zeros((5, 5), dtype=bool)
+        chosen[0, [0, 2]] = True  # all the correct choices
+        chosen[1, [0, 3]] = True  # a wrong choice after a correct one cancels it
+        chosen[3, [1, 4]] = True  # a correct choice after a wrong one still counts
+        chosen[4, [1, 2, 4]] = True  # 5 choices, part of the correct ones
+
+        self.assert_grades_like_baseline(chosen, answers, distribution, allocation, 0.5)
+
+        grades = grade(chosen, compile_answer_key(answers, distribution, allocation, 0.5, 5, 5))
+        np.testing.assert_allclose(grades.marks, [2.0, -0.5, -0.5, 1.6, 3.0])
+
+    def test_batch_grades_like_single_sheets(self):
+        import numpy as np
+
+        rng = np.random.default_rng(7)
+        answers, distribution, allocation = self.random_key(rng, 30, 5)
+        key = compile_answer_key(answers, distribution, allocation, 1, 30, 5)
+        chosen = rng.random((6, 30, 5)) < .3
+
+        grades = grade(chosen, key)
+        for student in range(len(chosen)):
+            single = grade(chosen[student], key)
+            np.testing.assert_allclose(grades.marks[student], single.marks)
+            np.testing.assert_allclose(grades.scores[student], single.scores)
+
+    def batch_corrector(self, rng, questions, choices):
+        from api.sheets_correction.mcq_corrector import MCQCorrector
+
+        answers, distribution, allocation = self.random_key(rng, questions, choices)
+        key = compile_answer_key(answers, distribution, allocation, 0.5, questions, choices)
+        quiz = Quiz(sheet_name='quiz', questions=questions, choices=choices, bubble='Squares')
+        return MCQCorrector(quiz, answer_key=key, read_student_code=False), key
+
+    def test_grade_batch_grades_like_single_sheets(self):
+        import numpy as np
+
+        rng = np.random.default_rng(11)
+        corrector, key = self.batch_corrector(rng, 20, 4)
+        chosen = rng.random((5, 20, 4)) < .35
+
+        grades, summaries = corrector.grade_batch(chosen)
+        self.assertEqual(len(summaries), 5)
+        for student in range(len(chosen)):
+            single = grade(chosen[student], key)
+            np.testing.assert_allclose(grades.scores[student], single.scores)
+            np.testing.assert_allclose(grades.marks[student], single.marks)
+            self.assertEqual(summaries[student], single.summary(corrector.choice_labels()))
+
+        self.assertEqual(list(summaries), [summaries[student] for student in range(5)])
+
+    def test_grade_batch_refuses_answers_of_the_wrong_shape(self):
+        import numpy as np
+
+        corrector, key = self.batch_corrector(np.random.default_rng(3), 20, 4)
+        for shape in ((20, 4), (2, 19, 4), (2, 20, 5), (2, 2, 20, 4)):
+            with self.subTest(shape=shape), self.assertRaises(ValueError):
+                corrector.grade_batch(np.zeros(shape, dtype=bool))
+
+    def test_batch_summaries_are_only_built_when_read(self):
+        import numpy as np
+        from api.sheets_correction.grading import Grades
+
+        rng = np.random.default_rng(13)
+        corrector, key = self.batch_corrector(rng, 20, 4)
+        chosen = rng.random((4, 20, 4)) < .35
+
+        with mock.patch.object(Grades, 'summary', autospec=True, side_effect=Grades.summary) as summary:
+            grades, summaries = corrector.grade_batch(chosen)
+            self.assertEqual(summary.call_count, 0)
+
+            first = summaries[1]
+            self.assertIs(summaries[1], first)
+            self.assertEqual(summary.call_count, 1)
+
+            # negative indexes count from the end of the batch and share its summaries
+            self.assertIs(summaries[-3], first)
+            self.assertIs(summaries[-1], summaries[3])
+            self.assertEqual(summary.call_count, 2)
+
+        for student in (4, -5):
+            with self.subTest(student=student), self.assertRaises(IndexError):
+                summaries[student]
+
+
+def create_quiz(creator, questions=3, **fields):
+    return Quiz.objects.create(sheet_name='quiz', creator=creator, questions=questions, choices=4, choiceLabels='A-B-C',
+                               bubble='Squares', correctAnswers=['A'] * questions, marksAllocation=['2'] * questions,
+                               marksDistribution=['A 100'] * questions, **fields)
+
+
+class QuizSerializerTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('teacher', password='secret')
+        self.quiz = create_quiz(self.user)
+
+    def test_rows_per_column_must_be_positive(self):
+        from api.serializers import QuizSerializer
+
+        for rows, valid in ((0, False), (1, True), (25, True)):
+            serializer = QuizSerializer(self.quiz, data={'rows_per_column': rows}, partial=True)
+            self.assertEqual(serializer.is_valid(), valid, rows)
+            self.assertEqual('rows_per_column' in serializer.errors, not valid)
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.patch('/api/quizes/{}'.format(self.quiz.pk), {'rows_per_column': 0}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Quiz.objects.get(pk=self.quiz.pk).rows_per_column, 25)
+
+
+class QuizVersionTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser('admin', password='secret')
+        self.quiz = create_quiz(self.user)
+        answer_keys.clear()
+
+    # number of times the answer key of the stored quiz is compiled by the cache when it is read twice
+    def compilations(self):
+        compiled = []
+        for i in range(2):
+            answer_keys.get(Quiz.objects.get(pk=self.quiz.pk), lambda: compiled.append(1))
+
+        return len(compiled)
+
+    def test_orm_edit_of_the_answers_recompiles_the_key(self):
+        self.assertEqual(self.compilations(), 1)
+
+        quiz = Quiz.objects.get(pk=self.quiz.pk)
+        quiz.correctAnswers = ['B', 'A', 'A']
+        quiz.save()
+
+        self.assertEqual(quiz.version, 2)
+        self.assertEqual(self.compilations(), 1)
+
+    def test_admin_edit_of_the_answers_recompiles_the_key(self):
+        self.assertEqual(self.compilations(), 1)
+
+        model_admin = admin.site._registry[Quiz]
+        request = RequestFactory().post('/')
+        request.user = self.user
+
+        quiz = Quiz.objects.get(pk=self.quiz.pk)
+        form = model_admin.get_form(request, quiz, change=True)(instance=quiz, data={
+            'sheet_name': 'quiz', 'bubble': 'Squares', 'questions': 3, 'choices': 4, 'choiceLabels': 'A-B-C',
+            'failMark': 1, 'pending_images': 0, 'corrected_images': 0, 'rows_per_column': 25, 'student_id_length': 0,
+            'layout_template': 'null', 'version': quiz.version, 'correctAnswers': 'A,A,A', 'marksAllocation': '2,2,2',
+            'marksDistribution': 'A 100,A 100,A 100', 'remarks': 'courage', 'creator': self.user.pk, 'credit': 4})
+        self.assertTrue(form.is_valid(), form.errors)
+        model_admin.save_model(request, form.save(commit=False), form, True)
+
+        self.assertEqual(Quiz.objects.get(pk=self.quiz.pk).version, 2)
+        self.assertEqual(self.compilations(), 1)
+
+    def test_edits_which_do_not_change_the_correction_keep_the_version(self):
+        quiz = Quiz.objects.get(pk=self.quiz.pk)
+        quiz.sheet_name = 'renamed'
+        quiz.correctAnswers = ['A', 'A', 'A']
+        quiz.save()
+
+        self.assertEqual(Quiz.objects.get(pk=self.quiz.pk).version, 1)
+        self.assertEqual(self.compilations(), 1)
+
+    def test_partial_saves_only_compare_the_fields_they_save(self):
+        self.assertEqual(self.compilations(), 1)
+
+        # the answers changed in memory are not written by a save of the name
+        quiz = Quiz.objects.get(pk=self.quiz.pk)
+        quiz.sheet_name = 'renamed'
+        quiz.correctAnswers = ['B', 'A', 'A']
+        quiz.save(update_fields=['sheet_name'])
+
+        stored = Quiz.objects.get(pk=self.quiz.pk)
+        self.assertEqual((stored.sheet_name, stored.correctAnswers, stored.version), ('renamed', ['A', 'A', 'A'], 1))
+        self.assertEqual(self.compilations(), 0)
+
+        quiz.save(update_fields=['correctAnswers'])
+        stored = Quiz.objects.get(pk=self.quiz.pk)
+        self.assertEqual((stored.correctAnswers, stored.version), (['B', 'A', 'A'], 2))
+        self.assertEqual(self.compilations(), 1)
+
+    def test_api_edit_of_the_answers_makes_a_new_version(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        response = client.patch('/api/quizes/{}'.format(self.quiz.pk), {'marksAllocation': ['1', '2', '3']},
+                                format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['version'], 2)
+
+
+class SheetUploadLimitTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.user = User.objects.create_user('teacher', password='secret')
+        self.quiz = create_quiz(self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def upload(self, *sizes):
+        files = [SimpleUploadedFile('sheet-{}.jpg'.format(i), bytes([i]) * size, content_type='image/jpeg')
+                 for i, size in enumerate(sizes)]
+
+        with self.settings(MEDIA_ROOT=self.media_root):
+            return self.client.post('/api/upload-sheets/?sheet_id={}'.format(self.quiz.pk), {'images': files},
+                                    format='multipart')
+
+    @override_settings(SHEET_UPLOAD_MAX_FILE_SIZE=4096)
+    def test_file_limit_returns_the_images_stored_before(self):
+        response = self.upload(1000, 2000, 10000, 1000)
+
+        self.assertEqual(response.status_code, 413)
+        stored = list(SheetImage.objects.filter(sheet=self.quiz).order_by('id'))
+        self.assertEqual(response.data['image_ids'], [image.id for image in stored])
+        self.assertEqual(len(stored), 2)
+        self.assertIn('4096 bytes allowed per image', response.data['error'])
+
+        # the images stored are counted and their correction was queued
+        jobs_queued = CorrectionJob.objects.filter(pk__in=response.data['job_ids'])
+        self.assertEqual(sorted(image_id for job in jobs_queued for image_id in job.payload['image_ids']),
+                         response.data['image_ids'])
+        self.assertEqual(Quiz.objects.get(pk=self.quiz.pk).pending_images, 2)
+
+        # the partial file of the image over the limit was removed
+        files = [name for root, dirs, names in os.walk(self.media_root) for name in names]
+        self.assertEqual(len(files), 2)
+
+    @override_settings(SHEET_UPLOAD_MAX_REQUEST_SIZE=4096)
+    def test_request_limit_refuses_the_upload(self):
+        response = self.upload(3000, 3000)
+
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual((response.data['image_ids'], response.data['job_ids']), ([], []))
+        self.assertFalse(SheetImage.objects.exists())
+        self.assertFalse(CorrectionJob.objects.exists())
+
+    # multipart body of the given images, cut after the first size bytes of the last one
+    @staticmethod
+    def interrupted_body(*sizes):
+        from django.test.client import BOUNDARY, encode_multipart
+
+        files = [SimpleUploadedFile('sheet-{}.jpg'.format(i), bytes([i + 1]) * size, content_type='image/jpeg')
+                 for i, size in enumerate(sizes)]
+        body = encode_multipart(BOUNDARY, {'images': files})
+        return body[:body.rindex(bytes([len(sizes)])) + 1 - sizes[-1] // 2]
+
+    def stored_files(self):
+        return [name for root, dirs, names in os.walk(self.media_root) for name in names]
+
+    def test_truncated_upload_removes_the_partial_image(self):
+        from django.test.client import MULTIPART_CONTENT
+
+        with self.settings(MEDIA_ROOT=self.media_root):
+            response = self.client.generic('POST', '/api/upload-sheets/?sheet_id={}'.format(self.quiz.pk),
+                                           self.interrupted_body(1000, 3000), content_type=MULTIPART_CONTENT)
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(SheetImage.objects.filter(sheet=self.quiz).count(), 1)
+        self.assertEqual(len(self.stored_files()), 1)
+
+    def test_disconnected_upload_removes_the_partial_image(self):
+        from io import BytesIO
+        from django.core.handlers.wsgi import LimitedStream
+        from django.test.client import MULTIPART_CONTENT
+        from rest_framework.test import APIRequestFactory, force_authenticate
+        from api.views import SheetsCorrection
+
+        # the connection breaks in the middle of the second image
+        class Disconnected(BytesIO):
+            def read(self, size=-1):
+                data = super().read(size)
+                if not data:
+                    raise OSError('connection reset by peer')
+                return data
+
+        body = self.interrupted_body(1000, 3000)
+        request = APIRequestFactory().generic('POST', '/api/upload-sheets/?sheet_id={}'.format(self.quiz.pk), body,
+                                              content_type=MULTIPART_CONTENT)
+        request._stream = LimitedStream(Disconnected(body), len(body) + 100)
+        force_authenticate(request, self.user)
+
+        with self.settings(MEDIA_ROOT=self.media_root), self.assertRaises(OSError):
+            SheetsCorrection.as_view()(request)
+
+        self.assertEqual(len(self.stored_files()), 1)
+
+    @override_settings(SHEET_UPLOAD_MAX_FILE_SIZE=4096, SHEET_UPLOAD_MAX_REQUEST_SIZE=4096 * 4)
+    def test_upload_under_the_limits_is_queued(self):
+        response = self.upload(1000, 4000)
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(SheetImage.objects.filter(sheet=self.quiz).count(), 2)
+
+
+@override_settings(CORRECTION_POOL_SIZE=1)
+class CorrectionResultReuseTests(TestCase):
+    def setUp(self):
+        import cv2
+        from api.sheets_correction.synthetic import render_sheet, synthetic_quiz
+
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.user = User.objects.create_user('teacher', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+        # the sheet of the student-id case of the golden corpus, its id is read from the grid without tesseract
+        image, answers = render_sheet(questions=25, scale=2.0, noise=4.0, seed=5, student_id='042917')
+        self.photo = cv2.imencode('.jpg', image)[1].tobytes()
+        self.quiz = synthetic_quiz(answers, creator=self.user, student_id_length=6, bubble='Squares')
+        self.quiz.save()
+
+    # uploads the photo and runs its job, returns the result of the job and the number of images corrected
+    def upload(self):
+        from api.sheets_correction.parallel import BatchCorrector
+
+        correct = BatchCorrector.correct
+        with self.settings(MEDIA_ROOT=self.media_root), \
+                mock.patch.object(BatchCorrector, 'correct', autospec=True, side_effect=correct) as corrector:
+            response = self.client.post('/api/upload-sheets/?sheet_id={}'.format(self.quiz.pk), {
+                'images': [SimpleUploadedFile('sheet.jpg', self.photo, content_type='image/jpeg')]}, format='multipart')
+            jobs.work('worker', max_jobs=1)
+
+        job = CorrectionJob.objects.get(pk=response.data['job_ids'][0])
+        self.assertEqual(job.status, 'done', job.error)
+        return job.result['results'][0], sum(len(paths) for call in corrector.call_args_list
+                                             for quiz, paths in call.args[1])
+
+    def test_same_image_reuses_its_result_until_the_quiz_changes(self):
+        first, corrected = self.upload()
+        self.assertEqual((corrected, first['student_code'], first['score']), (1, '042917', 50.0))
+
+        again, corrected = self.upload()
+        self.assertEqual(corrected, 0)
+        self.assertEqual((again['score'], again['summary']), (first['score'], first['summary']))
+        self.assertEqual(CorrectionResult.objects.count(), 1)
+
+        # the answer of the first question is changed, the stored result was graded with the old answers
+        quiz = Quiz.objects.get(pk=self.quiz.pk)
+        labels = quiz.choice_labels()
+        quiz.correctAnswers = [labels[(labels.index(quiz.correctAnswers[0]) + 1) % 4]] + quiz.correctAnswers[1:]
+        quiz.marksDistribution = ['{} 100'.format(quiz.correctAnswers[0])] + quiz.marksDistribution[1:]
+        quiz.save()
+
+        regraded, corrected = self.upload()
+        self.assertEqual((corrected, regraded['score']), (1, 48.0))
+        self.assertEqual(sorted(CorrectionResult.objects.values_list('quiz_version', flat=True)), [1, 2])
+
+
+class LayoutTemplateTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('teacher', password='secret')
+
+    # corners in the order of utils.reorder of the axis aligned box (left, top, right, bottom)
+    @staticmethod
+    def box(left, top, right, bottom):
+        import numpy as np
+
+        return np.float64([[left, top], [right, top], [left, bottom], [right, bottom]])
+
+    def sheet_boxes(self):
+        return {'column_0': self.box(70, 230, 330, 1040), 'column_1': self.box(460, 230, 720, 1040),
+                'code': self.box(480, 60, 800, 170)}
+
+    def test_clean_layout(self):
+        from api.sheets_correction.layout import clean_layout
+
+        self.assertTrue(clean_layout((1100, 850), self.sheet_boxes()))
+
+        overlapping = dict(self.sheet_boxes(), code=self.box(300, 150, 600, 400))
+        self.assertFalse(clean_layout((1100, 850), overlapping))
+
+        uneven = dict(self.sheet_boxes(), column_1=self.box(460, 230, 720, 700))
+        self.assertFalse(clean_layout((1100, 850), uneven))
+
+        outside = dict(self.sheet_boxes(), code=self.box(480, -200, 800, 170))
+        self.assertFalse(clean_layout((1100, 850), outside))
+
+        twisted = self.sheet_boxes()
+        twisted['code'] = twisted['code'][[0, 1, 3, 2]]
+        self.assertFalse(clean_layout((1100, 850), twisted))
+
+        self.assertFalse(clean_layout((1100, 850), dict(self.sheet_boxes(), code=self.box(480, 60, 490, 70))))
+
+    def correct(self, **fields):
+        from api.sheets_correction.engine import create_corrector
+        from api.sheets_correction.synthetic import render_sheet, synthetic_quiz
+
+        image, answers = render_sheet(questions=25, scale=2.0, noise=4.0, seed=2)
+        quiz = synthetic_quiz(answers, use_layout_template=True, **fields)
+        return create_corrector(quiz, read_student_code=False).correct_sheet(image)
+
+    def test_template_is_learned_from_a_clean_sheet(self):
+        result = self.correct()
+
+        self.assertEqual(sorted(result['layout_template']['boxes']), ['code', 'column_0'])
+        self.assertEqual(result['score'], 50.0)
+
+    def test_template_is_not_learned_when_the_markers_are_missing(self):
+        # the sheet is still corrected from the page contour, but that registration is not the one it is printed for
+        result = self.correct(fiducials=True)
+
+        self.assertNotIn('layout_template', result)
+        self.assertEqual(result['score'], 50.0)
+
+    def test_template_is_only_forgotten_when_the_layout_changes(self):
+        quiz = create_quiz(self.user, use_layout_template=True, layout_template={'boxes': {}})
+
+        quiz.sheet_name = 'renamed'
+        quiz.correctAnswers = ['B', 'A', 'A']
+        quiz.save()
+        self.assertEqual(Quiz.objects.get(pk=quiz.pk).layout_template, {'boxes': {}})
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        client.patch('/api/quizes/{}'.format(quiz.pk), {'sheet_name': 'renamed again'}, format='json')
+        self.assertEqual(Quiz.objects.get(pk=quiz.pk).layout_template, {'boxes': {}})
+
+        quiz = Quiz.objects.get(pk=quiz.pk)
+        quiz.rows_per_column = 20
+        quiz.save()
+        self.assertIsNone(Quiz.objects.get(pk=quiz.pk).layout_template)
+
+
+class BoxDetectionTests(SimpleTestCase):
+    def test_box_with_a_broken_border(self):
+        import cv2
+        import numpy as np
+        from api.sheets_correction.utils import findBoxCorners, getCornerPoints, rectContours, reorder
+
+        # where the border of a box is broken its edge contour runs inside the box, it is not a quadrilateral anymore
+        page = np.full((800, 600), 255, np.uint8)
+        outline = np.int32([[100, 150], [400, 150], [400, 200], [330, 215], [400, 230], [400, 700], [100, 700]])
+        cv2.polylines(page, [outline], True, 0, 3)
+
+        contours = cv2.findContours(cv2.Canny(page, 10, 50), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[0]
+        self.assertEqual(len(getCornerPoints(contours[0])), 6)
+        self.assertEqual(len(rectContours(contours)), 1)
+
+        boxes = findBoxCorners(page, 1)
+        self.assertEqual([len(corners) for corners in boxes], [4])
+        np.testing.assert_allclose(reorder(boxes[0]).reshape(4, 2), [[100, 150], [400, 150], [100, 700], [400, 700]],
+                                   atol=3)
+
+        # contours which are not rectangles at all are never taken for boxes
+        triangle = np.full((800, 600), 255, np.uint8)
+        cv2.polylines(triangle, [np.int32([[100, 150], [400, 150], [250, 700]])], True, 0, 3)
+        self.assertEqual(findBoxCorners(triangle, 1), [])
+
+    # the sheets of the golden corpus whose page edge or column border have a gap, they are read as filled
+    def test_sheets_with_gaps_are_read(self):
+        import cv2
+        from api.sheets_correction import golden
+        from api.sheets_correction.engine import create_corrector
+
+        cases = [{'questions': 50, 'scale': 1.0, 'noise': 0.0, 'seed': 1, 'name': 'page-gap'},
+                 {'questions': 50, 'scale': 2.0, 'noise': 0.0, 'seed': 1, 'name': 'border-gap'}]
+
+        with tempfile.TemporaryDirectory() as directory:
+            for case in cases:
+                image, answers = golden.case_image(case, directory)
+                path = os.path.join(directory, '{}.jpg'.format(case['name']))
+                cv2.imwrite(path, image)
+
+                result = create_corrector(golden.case_quiz(case), read_student_code=False).correct_sheet(path)
+                self.assertEqual(golden.truth_accuracy(golden.sheet_outcome(True, result), answers), (50, 50))
+                self.assertEqual(result['score'], 40.0)
+
+
+class StageHistogramTests(TestCase):
+    def test_recorded_stages_update_their_histogram(self):
+        from api.correction import record_stage_timings
+        from api.models import StageHistogram
+
+        record_stage_timings([[{'stage': 'warp', 'wall': 0.002, 'cpu': 0.001, 'width': 700, 'height': 900}]])
+        StageHistogram.objects.filter(stage='warp').update(updated=now() - timedelta(hours=1))
+
+        record_stage_timings([[{'stage': 'warp', 'wall': 0.004, 'cpu': 0.003, 'width': 700, 'height': 900}]])
+        histogram = StageHistogram.objects.get(stage='warp')
+        self.assertEqual(histogram.count, 2)
+        self.assertAlmostEqual(histogram.wall_total, 0.006)
+        self.assertGreater(histogram.updated, now() - timedelta(minutes=1))
+
+    def test_quiz_is_shared_once_with_the_workers(self):
+        import cv2
+        from concurrent.futures import ProcessPoolExecutor
+        from api.sheets_correction.parallel import BatchCorrector, get_pool, _snapshot_batch
+        from api.sheets_correction.synthetic import render_sheet, synthetic_quiz
+
+        image, answers = render_sheet(questions=25, scale=2.0, noise=4.0, seed=5, student_id='042917')
+        quiz = synthetic_quiz(answers, student_id_length=6)
+
+        with tempfile.TemporaryDirectory() as directory:
+            paths = [os.path.join(directory, '{}.jpg'.format(i)) for i in range(4)]
+            for path in paths:
+                cv2.imwrite(path, image)
+
+            submit = ProcessPoolExecutor.submit
+            with mock.patch.object(ProcessPoolExecutor, 'submit', autospec=True, side_effect=submit) as submitted:
+                outcomes = BatchCorrector(max_workers=2, read_student_codes=False).correct([(quiz, paths)])
+
+        self.assertEqual([(ok, res['score'], res['student_code']) for ok, res in outcomes[0]],
+                         [(True, 50.0, '042917')] * 4)
+
+        # the images are sent with the key of the snapshot of their quiz, which was stored once for the pool
+        key = _snapshot_batch(quiz)[0]
+        self.assertEqual([call.args[2] for call in submitted.call_args_list], [key] * 4)
+        self.assertTrue(all(len(pickle.dumps(call.args[2:])) < 200 for call in submitted.call_args_list))
+        self.assertIn(key, get_pool(2)[1].keys())
+
+
+class StageTracingTests(SimpleTestCase):
+    def correct(self, **options):
+        from api.sheets_correction.engine import create_corrector
+        from api.sheets_correction.synthetic import render_sheet, synthetic_quiz
+
+        image, answers = render_sheet(questions=25, scale=2.0, noise=4.0, seed=2)
+        return create_corrector(synthetic_quiz(answers), read_student_code=False, **options).correct_sheet(image)
+
+    def test_stages_are_not_traced_by_default(self):
+        self.assertNotIn('trace', self.correct())
+
+    def test_stages_are_traced_on_request(self):
+        trace = self.correct(trace=True)['trace']
+
+        self.assertIn('register', [stage['stage'] for stage in trace])
+        self.assertTrue(all(stage['wall'] >= 0 for stage in trace))
+
+
+class FillThresholdTests(SimpleTestCase):
+    # fill ratios of the cells of a 50 question sheet of 4 choices, the shaded cells around shaded_ratio and the others
+    # around empty_ratio
+    @staticmethod
+    def ratios(shaded, empty_ratio=0.08, shaded_ratio=0.7, seed=0):
+        import numpy as np
+
+        rng = np.random.default_rng(seed)
+        return np.where(shaded, shaded_ratio, empty_ratio) + rng.normal(0, 0.02, shaded.shape)
+
+    @staticmethod
+    def shaded(seed=0):
+        import numpy as np
+
+        return np.eye(4, dtype=bool)[np.random.default_rng(seed).integers(4, size=50)]
+
+    def test_blank_sheet_keeps_the_default(self):
+        import numpy as np
+        from api.sheets_correction.mcq_corrector import FILL_RATIO
+        from api.sheets_correction.utils import calibrate_fill_threshold
+
+        blank = self.ratios(np.zeros((50, 4), dtype=bool))
+        self.assertEqual(calibrate_fill_threshold(blank, default=FILL_RATIO), FILL_RATIO)
+
+    def test_fully_shaded_sheet_keeps_the_default(self):
+        import numpy as np
+        from api.sheets_correction.mcq_corrector import FILL_RATIO
+        from api.sheets_correction.utils import calibrate_fill_threshold
+
+        shaded = self.ratios(np.ones((50, 4), dtype=bool))
+        self.assertEqual(calibrate_fill_threshold(shaded, default=FILL_RATIO), FILL_RATIO)
+
+    def test_bimodal_sheet_is_split_between_its_groups(self):
+        import numpy as np
+        from api.sheets_correction.utils import calibrate_fill_threshold, detect_answers
+
+        for seed in range(5):
+            shaded = self.shaded(seed)
+            ratios = self.ratios(shaded, seed=seed)
+            threshold = calibrate_fill_threshold(ratios)
+
+            self.assertAlmostEqual(threshold, (ratios[shaded].mean() + ratios[~shaded].mean()) / 2, places=6)
+            np.testing.assert_array_equal(detect_answers(ratios, threshold), shaded)
+
+        # the threshold follows the sheet, e.g a light pencil
+        light = self.ratios(self.shaded(), shaded_ratio=0.45)
+        self.assertLess(calibrate_fill_threshold(light), 0.3)
+
+    def test_groups_too_close_fall_back_to_the_default(self):
+        import numpy as np
+        from api.sheets_correction.mcq_corrector import FILL_RATIO
+        from api.sheets_correction.utils import calibrate_fill_threshold
+
+        # e.g smudges or a shadow across the sheet: two groups, but only 0.15 apart
+        ratios = self.ratios(self.shaded(), empty_ratio=0.1, shaded_ratio=0.25)
+        self.assertEqual(calibrate_fill_threshold(ratios, default=FILL_RATIO), FILL_RATIO)
+
+        self.assertEqual(calibrate_fill_threshold(np.float64([0.7]), default=FILL_RATIO), FILL_RATIO)
+
+    def test_threshold_is_kept_within_bounds(self):
+        from api.sheets_correction.utils import calibrate_fill_threshold
+
+        self.assertEqual(calibrate_fill_threshold(self.ratios(self.shaded(), empty_ratio=0.0, shaded_ratio=0.28)),
+                         0.15)
+        self.assertEqual(calibrate_fill_threshold(self.ratios(self.shaded(), empty_ratio=0.7, shaded_ratio=1.0)),
+                         0.6)
+
+
+# local thresholds of skimage's threshold_local(method='mean') in float64, which the sheets were thresholded with before
+# threshold.LocalThreshold: the mean of the block around each pixel, the borders being reflected, minus the offset
+def reference_thresholds(gray, block_size, offset):
+    import numpy as np
+
+    half = block_size // 2
+    padded = np.pad(gray.astype(np.float64), half, mode='symmetric')
+    sums = np.pad(padded.cumsum(axis=0).cumsum(axis=1), ((1, 0), (1, 0)))
+    height, width = gray.shape
+    below, right = slice(block_size, block_size + height), slice(block_size, block_size + width)
+    blocks = sums[below, right] - sums[:height, right] - sums[below, :width] + sums[:height, :width]
+
+    return blocks / block_size ** 2 - offset
+
+
+class LocalThresholdTests(SimpleTestCase):
+    # most pixels which may land on the other side of the threshold, only pixels within float32 rounding of their
+    # threshold may differ
+    MAX_DIFFERENT_SHARE = 1e-4
+    MAX_DIFFERENT_DISTANCE = 1e-3
+
+    def sheets(self):
+        import cv2
+        from api.sheets_correction.synthetic import render_sheet
+
+        for scale, noise, seed in ((1.0, 0.0, 0), (2.0, 4.0, 1), (1.5, 8.0, 2)):
+            image, answers = render_sheet(questions=25, scale=scale, noise=noise, seed=seed)
+            yield cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+    def block_sizes(self):
+        from api.sheets_correction.threshold import PAGE_BLOCK_SIZE, scaled_block_size
+
+        return [3, 15, PAGE_BLOCK_SIZE] + [scaled_block_size(scale) for scale in (0.01, 0.37, 0.5, 1.3)]
+
+    def assert_same_masks(self, mask, reference, gray, thresholds):
+        import numpy as np
+
+        different = mask != reference
+        self.assertLessEqual(different.mean(), self.MAX_DIFFERENT_SHARE)
+        if different.any():
+            self.assertLess(np.abs(gray[different] - thresholds[different]).max(), self.MAX_DIFFERENT_DISTANCE)
+
+    def test_masks_match_the_float64_threshold(self):
+        import numpy as np
+        from api.sheets_correction.threshold import PAGE_OFFSET, binarize, ink_mask
+
+        for gray in self.sheets():
+            for block_size in self.block_sizes():
+                self.assertEqual(block_size % 2, 1)
+                thresholds = reference_thresholds(gray, block_size, PAGE_OFFSET)
+
+                self.assert_same_masks(binarize(gray, block_size), (gray > thresholds) * 255, gray, thresholds)
+                self.assert_same_masks(ink_mask(gray, block_size), (gray <= thresholds) * 255, gray, thresholds)
+
+                # in place, as the corrector thresholds its regions
+                inplace = gray.copy()
+                ink_mask(inplace, block_size, dst=inplace)
+                np.testing.assert_array_equal(inplace, ink_mask(gray, block_size))
+
+    @skipUnless(importlib.util.find_spec('skimage'), 'scikit-image is not installed')
+    def test_reference_is_threshold_local(self):
+        import numpy as np
+        from skimage.filters import threshold_local
+
+        gray = next(iter(self.sheets()))
+        for block_size in self.block_sizes():
+            np.testing.assert_allclose(reference_thresholds(gray, block_size, 4),
+                                       threshold_local(gray, block_size, offset=4, method='mean'), atol=1e-6)
+
+
+class PackedSummaryTests(SimpleTestCase):
+    def assert_round_trip(self, summary):
+        from api.sheets_correction.packing import PackedSummary
+
+        for unpacked in (PackedSummary.from_bytes(summary.to_bytes()), PackedSummary.from_json(summary.to_json())):
+            self.assertEqual(unpacked.choices, summary.choices)
+            self.assertEqual(unpacked.chosen, summary.chosen)
+            self.assertEqual(unpacked.correct, summary.correct)
+            self.assertEqual(list(unpacked.marks), list(summary.marks))
+            self.assertEqual(list(unpacked.percentage_pass), list(summary.percentage_pass))
+
+        return unpacked
+
+    def test_more_than_eight_choices(self):
+        from api.sheets_correction.packing import PackedSummary, mask_size
+
+        for choices in (8, 9, 16, 17):
+            last = 1 << (choices - 1)
+            summary = PackedSummary(choices, [last, last | 1, 0b10], [last, 1, 0], [2.0, 1.0, 0.0], [100.0, 50.0, 0.0])
+
+            self.assertEqual(len(summary.to_bytes()), 4 + 3 * (2 * mask_size(choices) + 8))
+            unpacked = self.assert_round_trip(summary)
+            self.assertEqual(unpacked.answers(), [[choices - 1], [0, choices - 1], [1]])
+            self.assertEqual(unpacked.wrong, [0, last, 0b10])
+
+    def test_empty_answers(self):
+        from api.sheets_correction.packing import PackedSummary
+
+        unpacked = self.assert_round_trip(PackedSummary(4, [0, 0], [0, 0], [0.0, -0.5], [0.0, 0.0]))
+        self.assertEqual(unpacked.answers(), [[], []])
+        self.assertEqual(unpacked.expand('ABCD')[1], {'correct_choices': [], 'wrong_choices': [],
+                                                      'percentage_pass': 0.0, 'mark': -0.5})
+
+        self.assertEqual(self.assert_round_trip(PackedSummary(4, [], [], [], [])).expand('ABCD'), {})
+
+    def test_header_mismatch_is_refused(self):
+        from api.sheets_correction.packing import HEADER, VERSION, PackedSummary
+
+        data = PackedSummary(5, [0b11, 0b100], [0b01, 0], [1.0, 0.0], [50.0, 0.0]).to_bytes()
+
+        with self.assertRaisesMessage(ValueError, 'unknown version'):
+            PackedSummary.from_bytes(bytes([VERSION + 1]) + data[1:])
+
+        # a header announcing more or fewer questions than the data holds
+        for questions in (1, 3):
+            with self.assertRaisesMessage(ValueError, 'truncated'):
+                PackedSummary.from_bytes(HEADER.pack(VERSION, questions, 5) + data[HEADER.size:])
+
+        with self.assertRaisesMessage(ValueError, 'truncated'):
+            PackedSummary.from_bytes(data[:-1])
+
+    def test_scores_are_rounded_to_float32(self):
+        from api.sheets_correction.packing import PackedSummary, float32_value
+
+        summary = PackedSummary(4, [1, 2, 4], [1, 2, 0], [1.6, 2 / 3, 0.1], [100.0, 100 / 3, 0.0])
+        unpacked = self.assert_round_trip(summary)
+
+        # the float32 values are not the float64 ones but read back as the shortest decimal of the same float32
+        self.assertNotEqual(unpacked.marks[0], 1.6)
+        expanded = unpacked.expand('ABCD')
+        self.assertEqual([expanded[i]['mark'] for i in range(3)], [1.6, 0.6666667, 0.1])
+        self.assertEqual([expanded[i]['percentage_pass'] for i in range(3)], [100.0, 33.33333, 0.0])
+        self.assertEqual(float32_value(unpacked.marks[1]), 0.6666667)
+
+    def test_migration_packs_version_one(self):
+        from api.sheets_correction.packing import VERSION, PackedSummary
+
+        # the migration keeps its own copy of the version 1 packing
+        migration = importlib.import_module('api.migrations.0028_packed_result_summary')
+        self.assertEqual(VERSION, migration.PACKED_VERSION)
+
+        summary = PackedSummary(10, [1 << 9, 0b11], [1 << 9, 0b01], [2.0, 0.4], [100.0, 20.0])
+        packed = migration.pack_summary(10, [1 << 9, 0b11], [1 << 9, 0b01], [2.0, 0.4], [100.0, 20.0])
+        self.assertEqual(packed, summary.to_json())
+
+        choices, chosen, correct, marks, percentage_pass = migration.unpack_summary(packed)
+        self.assertEqual((choices, chosen, correct), (10, summary.chosen, summary.correct))
+        self.assertEqual((marks, percentage_pass), (list(summary.marks), list(summary.percentage_pass)))
+
+
+class GoldenCorpusTests(SimpleTestCase):
+    # a sheet of every question count and of the layout variants, the whole corpus is left to the command
+    CASES = ['q10-s1.0-n4.0-0', 'q25-s2.0-n4.0-1', 'q50-s1.0-n0.0-1', 'q50-s2.0-n0.0-1', 'q50-s3.0-n0.0-0',
+             'five-choices', 'four-columns', 'student-id', 'fiducials']
+
+    def check(self, *cases, **options):
+        output = StringIO()
+        call_command('golden_corpus', 'check', *['--case={}'.format(case) for case in cases], stdout=output, **options)
+        return output.getvalue()
+
+    def test_subset_matches_the_corpus(self):
+        self.assertIn('all {} sheets match the golden corpus'.format(len(self.CASES)), self.check(*self.CASES))
+
+    def test_subset_matches_the_corpus_in_batch(self):
+        output = self.check(*self.CASES, engine='batch', workers=2)
+        self.assertIn('all {} sheets match the golden corpus'.format(len(self.CASES)), output)
+
+    def test_changed_outputs_are_reported(self):
+        from api.sheets_correction import golden
+
+        with open(golden.DEFAULT_CORPUS) as corpus_file:
+            corpus = json.load(corpus_file)
+
+        case = next(case for case in corpus['cases'] if case['name'] == 'student-id')
+        case['expected']['score'] += 2
+        case['expected']['answers'][0] = []
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'corpus.json')
+            with open(path, 'w') as corpus_file:
+                json.dump(corpus, corpus_file)
+
+            with self.assertRaisesMessage(CommandError, '1 of 1 sheets differ from the golden corpus'):
+                self.check('student-id', corpus=path)
+
+    # the sheets of the corpus are all readable, an error recorded as the expected output of a sheet is a regression
+    def test_corpus_expects_every_sheet_to_be_corrected(self):
+        from api.sheets_correction import golden
+
+        with open(golden.DEFAULT_CORPUS) as corpus_file:
+            corpus = json.load(corpus_file)
+
+        self.assertEqual([case['name'] for case in corpus['cases'] if not case['expected']['ok']], [])
+
+    def test_unknown_sheets_are_refused(self):
+        with self.assertRaisesMessage(CommandError, 'there is no sheet named missing'):
+            self.check('missing')
 
-# Create your tests here.
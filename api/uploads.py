@@ -0,0 +1,152 @@
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopFutureHandlers, StopUpload
+from django.db.models import F
+from django.http import QueryDict
+from django.utils.datastructures import MultiValueDict
+from rest_framework import exceptions
+from .models import Quiz, SheetImage
+import hashlib
+import os
+
+
+def hash_file(file):
+    sha = hashlib.sha256()
+    for chunk in file.chunks():
+        sha.update(chunk)
+
+    return sha.hexdigest()
+
+
+# returns the image of the sheet which was already stored with the same content, if any
+def find_stored_image(sheet: Quiz, content_hash):
+    return SheetImage.objects.filter(sheet_id=sheet.id, content_hash=content_hash).order_by('id').first()
+
+
+# raised when an upload goes over one of the limits. The images completed before are kept (their correction may
+# already have started), they are listed in the error so that the client only uploads the other ones again
+class UploadTooLarge(exceptions.APIException):
+    status_code = 413
+    default_code = 'upload_too_large'
+
+    def __init__(self, error, images=(), job_ids=()):
+        super().__init__(error)
+        self.error = error
+        self.images = list(images)
+
+        # the ids are returned as numbers, not as the error strings the detail is made of otherwise
+        self.detail = {'error': self.detail, 'image_ids': [image.id for image in self.images],
+                       'job_ids': list(job_ids)}
+
+
+# file returned to django for each streamed image, the image is already stored and saved as a SheetImage
+class StoredSheetImage(UploadedFile):
+    def __init__(self, sheet_image, content_type, size):
+        super().__init__(file=None, name=sheet_image.image.name, content_type=content_type, size=size)
+        self.sheet_image = sheet_image
+
+
+# upload handler which writes each uploaded sheet image straight to its final location (see nameFile) chunk by chunk,
+# so a request never holds more than one chunk of an image in memory. The SheetImage of each file is saved as soon as
+# the file is complete and on_image is called with it, e.g. to start its correction while the next files still upload.
+# Files are hashed while they are written, a file which was already uploaded for the sheet is removed again and the
+# SheetImage stored the first time is used instead
+class SheetImageUploadHandler(FileUploadHandler):
+    field_name = 'images'
+
+    def __init__(self, request, sheet: Quiz, on_image=None, max_file_size=None, max_request_size=None):
+        super().__init__(request)
+        self.sheet = sheet
+        self.on_image = on_image
+        self.max_file_size = max_file_size or getattr(settings, 'SHEET_UPLOAD_MAX_FILE_SIZE', None)
+        self.max_request_size = max_request_size or getattr(settings, 'SHEET_UPLOAD_MAX_REQUEST_SIZE', None)
+
+        self.error = None  # set when the upload was stopped because it went over one of the limits
+        self.images = []  # SheetImages saved so far
+        self.destination = None  # the file being written
+        self.image = None
+        self.sha = None  # hash of the file being written
+        self.received = 0  # bytes received for all the files of the request
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        # requests announcing more than the limit are refused before reading anything
+        if self.max_request_size is not None and content_length > self.max_request_size:
+            self.error = 'The upload is larger than the {} bytes allowed per request'.format(self.max_request_size)
+            return QueryDict(), MultiValueDict()
+
+    def new_file(self, field_name, file_name, *args, **kwargs):
+        super().new_file(field_name, file_name, *args, **kwargs)
+        if field_name != self.field_name:
+            return
+
+        self.image = SheetImage(name="image-{}".format(str(self.sheet)), sheet=self.sheet, status='pending')
+        field = SheetImage._meta.get_field('image')
+        name = field.storage.get_available_name(field.generate_filename(self.image, file_name))
+        path = field.storage.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self.image.image.name = name
+        self.destination = open(path, 'xb')
+        self.sha = hashlib.sha256()
+
+        # the other handlers would buffer the file in memory or in a temporary file
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.image is None:
+            return raw_data
+
+        self.received += len(raw_data)
+        if self.max_file_size is not None and start + len(raw_data) > self.max_file_size:
+            self.stop('{} is larger than the {} bytes allowed per image'.format(self.file_name, self.max_file_size))
+
+        if self.max_request_size is not None and self.received > self.max_request_size:
+            self.stop('The upload is larger than the {} bytes allowed per request'.format(self.max_request_size))
+
+        self.destination.write(raw_data)
+        self.sha.update(raw_data)
+
+    def file_complete(self, file_size):
+        if self.image is None:
+            return None
+
+        image, self.image = self.image, None
+        self.destination.close()
+        image.content_hash = self.sha.hexdigest()
+
+        duplicate = find_stored_image(self.sheet, image.content_hash)
+        if duplicate is not None:
+            os.unlink(self.destination.name)
+            image = duplicate
+        else:
+            image.save()
+            Quiz.objects.filter(pk=self.sheet.id).update(pending_images=F('pending_images') + 1)
+
+        self.destination = None
+        self.sha = None
+        self.images.append(image)
+
+        if self.on_image is not None:
+            self.on_image(image)
+
+        return StoredSheetImage(image, self.content_type, file_size)
+
+    def stop(self, error):
+        self.error = error
+        self.discard_partial_image()
+        raise StopUpload(connection_reset=True)
+
+    # the request ended before the image being written was complete (e.g. the client went away)
+    def upload_interrupted(self):
+        self.discard_partial_image()
+
+    # the partially written image is removed, images which were complete are kept
+    def discard_partial_image(self):
+        if self.destination is None:
+            return
+
+        self.destination.close()
+        os.unlink(self.destination.name)
+        self.destination = None
+        self.sha = None
+        self.image = None
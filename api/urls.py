@@ -26,6 +26,16 @@ urlpatterns = [
     path('upload-sheets/', views.SheetsCorrection.as_view()),
     path('batch-correct/', views.SheetsBatchCorrect.as_view()),
 
+    # correction jobs endpoints
+    path('jobs/<int:pk>', views.CorrectionJobDetail.as_view()),
+    path('jobs/<int:pk>/result', views.CorrectionJobResult.as_view()),
+
+    # stored correction results
+    path('results/', views.CorrectionResultsList.as_view()),
+
+    # timings of the correction pipeline
+    path('metrics/', views.StageMetricsList.as_view()),
+
     # images endpoint
     path('images/', views.ImagesList.as_view()),
     path('images/pending/', views.PendingSheetsLists.as_view()),
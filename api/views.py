@@ -2,17 +2,18 @@ from django.contrib.auth.models import User
 from rest_framework import viewsets, exceptions
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
-from api.serializers import UserSerializer, QuizSerializer, ImageSerializer
-from .models import Quiz, SheetImage
+from api.serializers import UserSerializer, QuizSerializer, ImageSerializer, CorrectionJobSerializer, \
+    CorrectionResultSerializer, StageHistogramSerializer
+from .models import Quiz, SheetImage, CorrectionJob, CorrectionResult, StageHistogram
 from rest_framework import generics, permissions, mixins
+from rest_framework.pagination import PageNumberPagination
 from .permissions import IsOwnerOrReadOnly, IsAdminOrOwner, IsAdminOrUser
 from rest_framework.authtoken.models import Token
-from .sheets_correction.mcq_corrector import MCQCorrector
-from django.utils.timezone import now
-from django.conf import settings
-from django.db.models import Q
-import os
-import shutil
+from .jobs import enqueue_job
+from .uploads import SheetImageUploadHandler, StoredSheetImage, UploadTooLarge, hash_file, find_stored_image
+from .sheets_correction.answer_keys import answer_keys
+from django.db import transaction
+from django.db.models import Q, F
 
 
 # for user in User.objects.all():
@@ -60,34 +61,112 @@ class QuizDetail(generics.RetrieveUpdateDestroyAPIView):
     serializer_class = QuizSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly, IsAdminOrOwner]
 
+    def perform_destroy(self, instance):
+        quiz_id = instance.id
+        instance.delete()
+        answer_keys.invalidate(quiz_id)
 
-# this function moves a sheet image which has been corrected from the pending directory to the corrected directory
-def move_corrected_image(image: SheetImage, sheet:Quiz):
+
+# stores the images uploaded for a sheet and returns the sheet with all its new images in upload order.
+# When the sheet id is given in the query string, SheetImageUploadHandler streams the images straight to disk and calls
+# on_image as soon as each one is saved. Else django buffers the whole upload before we can store the images.
+# Images already uploaded for the sheet are not stored again, the list then holds the image stored the first time.
+# A streamed upload going over the size limits raises UploadTooLarge with the images stored before
+def store_sheet_images(request, on_image=None):
+    sheet_id = request.query_params.get('sheet_id')
+    handler = None
+
+    if sheet_id is not None:
+        im_quiz = Quiz.objects.get(pk=sheet_id)
+        handler = SheetImageUploadHandler(request, im_quiz, on_image=on_image)
+        request.upload_handlers.insert(0, handler)
+
+    # django only tells the handlers that an upload was interrupted when the request body ends early, not when reading
+    # it fails (e.g. the client disconnects)
     try:
-        filename = image.image.name.split('/')[-1]
-        im_path = image.image.path
-        new_path = os.path.join(settings.MEDIA_ROOT,
-                                'images', 'sheets', 'sheet_{}'.format(image.sheet.id),
-                                'corrected', filename)
+        files = request.FILES.getlist('images')
+    except Exception:
+        if handler is not None:
+            handler.upload_interrupted()
+        raise
+
+    if handler is not None and handler.error is not None:
+        raise UploadTooLarge(handler.error, handler.images)
+
+    if sheet_id is None:
+        im_quiz = Quiz.objects.get(pk=request.data["sheet_id"])
+
+    imagelist = []
+    buffered = []
+    buffered_hashes = {}
+
+    for file in files:
+        if isinstance(file, StoredSheetImage):
+            imagelist.append(file.sheet_image)
+            continue
+
+        content_hash = hash_file(file)
+        image = buffered_hashes.get(content_hash) or find_stored_image(im_quiz, content_hash)
+        if image is None:
+            image = SheetImage(name="image-{}".format(str(im_quiz)), image=file, sheet=im_quiz, status='pending',
+                               content_hash=content_hash)
+            buffered.append(image)
+            buffered_hashes[content_hash] = image
+
+        imagelist.append(image)
+
+    if buffered:
+        # the files are written to the storage by bulk_create, which saves all the rows with one query
+        with transaction.atomic():
+            SheetImage.objects.bulk_create(buffered)
+            Quiz.objects.filter(pk=im_quiz.id).update(pending_images=F('pending_images') + len(buffered))
+
+        # some databases (e.g mysql) do not return the ids of rows created in bulk, the stored names are unique
+        if any(im.pk is None for im in buffered):
+            ids = dict(SheetImage.objects.filter(image__in=[im.image.name for im in buffered])
+                       .values_list('image', 'id'))
+            for im in buffered:
+                im.pk = ids[im.image.name]
 
-        # Create dir if necessary and move file
-        if not os.path.exists(os.path.dirname(new_path)):
-            os.makedirs(os.path.dirname(new_path))
+    return im_quiz, imagelist
 
-        shutil.move(im_path, new_path)
-        image.status = 'corrected'
-        image.save()
 
-        sheet.pending_images -= 1
-        sheet.corrected_images += 1
+# the clients ask for the timings of the stages of their sheets with ?trace=1, they are returned with the results
+def trace_requested(request):
+    return request.query_params.get('trace', '').lower() in ('1', 'true', 'yes')
 
-        sheet.save()
 
-    except FileNotFoundError as err:
-        raise exceptions.ValidationError('Could not find the image file {} '.format(err), code=404)
+# the summaries of the results are returned packed (see api.sheets_correction.packing), clients ask for the verbose
+# ones with ?summary=verbose
+def verbose_summary_requested(request):
+    return request.query_params.get('summary', '').lower() == 'verbose'
 
-    except OSError as err:
-        raise exceptions.ValidationError('Could not move file to corrected folder ==> {} '.format(err), 400)
+
+# the result of a job with the verbose summaries, each one expanded with the choice labels of its sheet. The
+# summaries of deleted sheets stay packed
+def expand_job_result(job: CorrectionJob):
+    if job.kind == 'upload':
+        sheets = [(job.payload['sheet_id'], job.result['results'])]
+    else:
+        sheets = [(sheet_results['sheet_id'], sheet_results['results']) for sheet_results in job.result]
+
+    quizzes = Quiz.objects.in_bulk([sheet_id for sheet_id, results in sheets])
+    for sheet_id, results in sheets:
+        if sheet_id not in quizzes:
+            continue
+
+        for res in results:
+            res['summary'] = quizzes[sheet_id].expand_summary(res['summary'])
+
+    return job.result
+
+
+# payload of a correction job, the trace flag is only set when asked for
+def job_payload(request, **payload):
+    if trace_requested(request):
+        payload['trace'] = True
+
+    return payload
 
 
 class SheetsCorrection(generics.ListCreateAPIView):
@@ -96,31 +175,33 @@ class SheetsCorrection(generics.ListCreateAPIView):
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
     def post(self, request, *args, **kwargs):
+        # the sheets are corrected by the correction workers, the client polls the jobs for the results.
+        # Streamed images get a job each as soon as they are stored so their correction starts during the upload
+        jobs = []
+        queued_ids = set()
 
-        images = request.FILES.getlist('images')
-        im_quiz = Quiz.objects.get(pk=request.data["sheet_id"])
-
-        # instantiate mcq corrector
-        mcq_corrector = MCQCorrector(sheet_instance=im_quiz)
+        def correct_streamed_image(image):
+            # the same file uploaded twice in the request is only corrected once
+            if image.id in queued_ids:
+                return
 
-        results = []
+            queued_ids.add(image.id)
+            jobs.append(enqueue_job('upload', job_payload(request, sheet_id=image.sheet_id, image_ids=[image.id]),
+                                    request.user))
 
-        for file in images:
-            new_im = SheetImage(name="image-{}".format(str(im_quiz)), image=file, sheet=im_quiz)
-            new_im.url = new_im.image.url
-            new_im.save()
-            im_quiz.pending_images += 1
+        try:
+            im_quiz, imagelist = store_sheet_images(request, on_image=correct_streamed_image)
 
-            try:
-                res = mcq_corrector.correct_sheet(new_im.image.path)
-                results.append(res)
-                move_corrected_image(new_im, im_quiz)
+        except UploadTooLarge as err:
+            # the images stored before the limit was reached are still corrected, the client gets their jobs
+            raise UploadTooLarge(err.error, err.images, [job.id for job in jobs])
 
-            except Exception as err:
-                raise exceptions.ValidationError('One or more of the sheets is not well formatted ===> {}'.format(err),
-                                                 code=400)
+        buffered_ids = list(dict.fromkeys(im.id for im in imagelist if im.id not in queued_ids))
+        if buffered_ids:
+            jobs.append(enqueue_job('upload', job_payload(request, sheet_id=im_quiz.id, image_ids=buffered_ids),
+                                    request.user))
 
-        return Response(data={'results': results}, status=200)
+        return Response(data={'job_ids': [job.id for job in jobs], 'status': 'queued'}, status=202)
 
 
 # API view to upload images to be saved or to get all images belonging to a creator
@@ -140,18 +221,8 @@ class ImagesList(generics.ListCreateAPIView):
 
     def post(self, request, *args, **kwargs):
 
-        images = request.FILES.getlist('images')
-        im_quiz = Quiz.objects.get(pk=request.data["sheet_id"])
+        im_quiz, imagelist = store_sheet_images(request)
 
-        imagelist = []
-        for file in images:
-            new_im = SheetImage(name="image-{}".format(str(im_quiz)), image=file, sheet=im_quiz, status='pending')
-            new_im.url = new_im.image.url
-            new_im.save()
-            im_quiz.pending_images += 1
-            imagelist.append(new_im)
-
-        im_quiz.save()
         res = self.serializer_class(instance=imagelist, many=True, context={"request": request})
         return Response(res.data)
 
@@ -164,31 +235,72 @@ class SheetsBatchCorrect(generics.GenericAPIView):
 
     def post(self, request):
         sheet_ids = request.data['sheets']
-        sheets = Quiz.objects.filter(pk__in=sheet_ids)
-        corrector = MCQCorrector(Quiz())
+        job = enqueue_job('batch', job_payload(request, sheets=sheet_ids), request.user)
+
+        return Response(data={'job_id': job.id, 'status': job.status}, status=202)
+
+
+# views used by clients to poll the correction jobs they started
+class CorrectionJobDetail(generics.RetrieveAPIView):
+    serializer_class = CorrectionJobSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return CorrectionJob.objects.filter(creator_id=self.request.user.id)
+
+
+class CorrectionJobResult(generics.RetrieveAPIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return CorrectionJob.objects.filter(creator_id=self.request.user.id)
+
+    def retrieve(self, request, *args, **kwargs):
+        job = self.get_object()
+
+        if job.status == 'failed':
+            raise exceptions.ValidationError(job.error, code=400)
+
+        if job.status != 'done':
+            return Response(data={'job_id': job.id, 'status': job.status}, status=202)
+
+        return Response(expand_job_result(job) if verbose_summary_requested(request) else job.result)
+
 
-        final_results = []
+class CorrectionResultsPagination(PageNumberPagination):
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+
+# paginated results of the sheets of the user, they can be filtered by sheet and by student code
+class CorrectionResultsList(generics.ListAPIView):
+    serializer_class = CorrectionResultSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = CorrectionResultsPagination
+
+    def get_queryset(self):
+        queryset = CorrectionResult.objects.filter(sheet__creator_id=self.request.user.id).select_related('sheet')
 
-        sheet_index = 0
-        for sheet in sheets:
-            corrector.set_sheet(sheet)
-            pending_images = SheetImage.objects.filter(Q(sheet_id=sheet.id) & Q(status='pending'))
-            final_results.append({'sheet_id': sheet.id, 'sheet_name': sheet.sheet_name, 'results': [], 'errors': []})
+        sheet_id = self.request.query_params.get('sheet_id')
+        if sheet_id is not None:
+            queryset = queryset.filter(sheet_id=sheet_id)
 
-            for image in pending_images:
-                try:
-                    res = corrector.correct_sheet(image.image.path)
-                    final_results[sheet_index]['results'].append(res)
+        student_code = self.request.query_params.get('student_code')
+        if student_code is not None:
+            queryset = queryset.filter(student_code=student_code)
 
-                    move_corrected_image(image, sheet)
+        return queryset
 
-                except Exception as err:
-                    final_results[sheet_index]['errors'].append(str(err))
-                    continue
+    def get_serializer_context(self):
+        return dict(super().get_serializer_context(), verbose_summary=verbose_summary_requested(self.request))
 
-            sheet_index += 1
 
-        return Response(final_results)
+# histograms of the timings of the stages of the correction pipeline, see api.sheets_correction.tracing
+class StageMetricsList(generics.ListAPIView):
+    queryset = StageHistogram.objects.all()
+    serializer_class = StageHistogramSerializer
+    permission_classes = [permissions.IsAdminUser]
 
 
 class PendingSheetsLists(generics.ListAPIView):
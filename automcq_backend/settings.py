@@ -146,3 +146,31 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'  # 'http://myhost:port/media/'
+
+# Sheet correction jobs
+# number of worker processes started by "manage.py correction_workers" and how often (in seconds) they poll the queue
+CORRECTION_WORKERS = 2
+CORRECTION_POLL_INTERVAL = 1.0
+
+# seconds after which a running job is considered abandoned by a dead worker and queued again, it should be longer
+# than the slowest batch. A job abandoned CORRECTION_JOB_ATTEMPTS times fails
+CORRECTION_JOB_TIMEOUT = 30 * 60
+CORRECTION_JOB_ATTEMPTS = 3
+
+# size of the process pool each worker uses to correct the images of a job in parallel, None shares the cores between
+# the CORRECTION_WORKERS workers
+CORRECTION_POOL_SIZE = None
+
+# whether the stages of every corrected sheet are timed and added to the stage histograms, clients can still request
+# the timings of their own jobs
+CORRECTION_TRACE_STAGES = False
+
+# directory where the intermediate images of every corrected sheet are saved for debugging, None saves nothing
+CORRECTION_DEBUG_DIR = None
+
+# number of warm tesseract engines reading the student codes in each correction process, see api.sheets_correction.ocr
+CORRECTION_OCR_ENGINES = 2
+
+# limits (in bytes) of the sheet images streamed to disk during an upload, see api.uploads.SheetImageUploadHandler
+SHEET_UPLOAD_MAX_FILE_SIZE = 25 * 1024 * 1024
+SHEET_UPLOAD_MAX_REQUEST_SIZE = 1024 * 1024 * 1024